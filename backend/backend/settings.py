@@ -70,6 +70,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "network.middleware.MetricsMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -126,3 +127,70 @@ STATIC_URL = "static/"
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Resolved network snapshots (network/utils/resolved.py), evicted LRU above this many rows
+RESOLVED_NETWORK_MAX_ROWS = config('RESOLVED_NETWORK_MAX_ROWS', default=10000000, cast=int)
+
+# MVT tile cache (network/utils/tile_cache.py). BACKEND is 'filesystem', 'mbtiles', 'none' or a dotted path.
+TILE_CACHE = {
+    'BACKEND': config('TILE_CACHE_BACKEND', default='filesystem'),
+    'LOCATION': config('TILE_CACHE_LOCATION', default=os.path.join(MEDIA_ROOT, 'tile_cache')),
+    'MAX_AGE': config('TILE_CACHE_MAX_AGE', default=300, cast=int),
+}
+
+# Batch tile endpoint (TileBatchView): tiles per request and threads rendering them
+TILE_BATCH = {
+    'MAX_TILES': config('TILE_BATCH_MAX_TILES', default=64, cast=int),
+    'WORKERS': config('TILE_BATCH_WORKERS', default=4, cast=int),
+}
+
+# Low-zoom tile generalization (network/utils/tiles.py). Below GENERALIZE_BELOW_ZOOM links are drawn from the zoom
+# given for their facility_type (DEFAULT_MINZOOM for a NULL or unlisted type) and merged into display-only lines;
+# generalized tiles above MAX_TILE_BYTES lose their least important classes. Nodes are drawn from NODE_MINZOOM.
+# Adjust FACILITY_MINZOOM to the facility coding of the networks. A change moves the tile cache to new namespaces and
+# sets the base pyramids aside until they are generated again (tiles.tile_settings_version()).
+TILE_GENERALIZATION = {
+    'GENERALIZE_BELOW_ZOOM': 10,
+    'NODE_MINZOOM': 12,
+    'FACILITY_MINZOOM': {1: 0, 2: 0, 3: 6, 4: 7, 5: 8, 6: 9},
+    'DEFAULT_MINZOOM': 0,
+    'MAX_TILE_BYTES': config('TILE_MAX_BYTES', default=500 * 1024, cast=int),
+}
+
+# Caches. 'default' holds the request metrics histograms and tile cache counters (network/utils/metrics.py): with the
+# per-process LocMemCache, MetricsView only reports the process that answers it and never the run_jobs workers.
+# Point CACHE_BACKEND/CACHE_LOCATION at a shared backend (e.g. django.core.cache.backends.redis.RedisCache) in production.
+# 'conflicts' holds conflict verdicts per set of project changesets (network/utils/conflict_cache.py); a verdict never
+# changes, so a per-process cache stays correct and only costs one detect_conflicts() per process and set.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    },
+    'conflicts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'conflicts',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': config('CONFLICT_CACHE_MAX_ENTRIES', default=5000, cast=int)},
+    },
+}
+
+# Processes serializing and compressing the per-pid netchange files of ToChangeFileView
+NETCHANGE_WORKERS = config('NETCHANGE_WORKERS', default=min(4, os.cpu_count() or 1), cast=int)
+
+# Attribute keys feeding the promoted NodeVersion/LinkVersion columns (network/utils/promoted.py),
+# per column, first present wins, e.g. {'capacity': ['cap', 'capacity']}. Run backfill_promoted_attributes after a change.
+PROMOTED_ATTRIBUTES = {}
+
+# Request instrumentation (network/middleware.py): Server-Timing header and histograms of the API requests,
+# cProfile dumps of ?profile=1 requests by superusers, the PROFILE_KEEP newest kept in PROFILE_DIR
+METRICS = {
+    'ENABLED': config('METRICS_ENABLED', default=True, cast=bool),
+    'PATH_PREFIX': '/api/',
+    'PROFILE_DIR': config('METRICS_PROFILE_DIR', default=os.path.join(MEDIA_ROOT, 'profiles')),
+    'PROFILE_KEEP': config('METRICS_PROFILE_KEEP', default=50, cast=int),
+}
+
+# Background jobs (network/utils/jobs.py). Inputs and results are kept under JOB_ROOT/<job id>/
+JOB_ROOT = config('JOB_ROOT', default=os.path.join(MEDIA_ROOT, 'jobs'))
+JOB_WORKERS = config('JOB_WORKERS', default=2, cast=int)
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from network.utils.promoted import PROMOTED_COLUMNS, backfill_promoted_columns
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the promoted attribute columns (n, a, b, facility_type, ...) of every node and link "
+        "version from their JSON attributes. Run after changing settings.PROMOTED_ATTRIBUTES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-rows", type=int, default=100_000, help="Rows updated per statement.")
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            for element in PROMOTED_COLUMNS:
+                t0 = time.time()
+                rows = backfill_promoted_columns(cursor, element, options["batch_rows"])
+                self.stdout.write(f"{element}: {rows} versions backfilled in {time.time()-t0:.2f} seconds")
@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from network.utils.diff import compare_gdf
+
+SRID = settings.USE_SRID
+
+class Command(BaseCommand):
+    help = (
+        "Diffs a synthetic link network against an edited copy with known created, deleted and "
+        "modified links, and reports the time per stage of the diff engine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200_000, help="Links in the reference network.")
+        parser.add_argument("--changed", type=float, default=0.05, help="Share of links modified (half geometry, half attributes).")
+        parser.add_argument("--created", type=int, default=1_000, help="Links added to the edited network.")
+        parser.add_argument("--deleted", type=int, default=1_000, help="Links removed from the edited network.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        rows = options["rows"]
+
+        t0 = time.perf_counter()
+        original = self._network(rng, rows)
+        edited, expected = self._edit(rng, original, options)
+        self.stdout.write(f"Synthetic network: {rows} links, {time.perf_counter()-t0:.2f} seconds")
+
+        timings = {}
+        t0 = time.perf_counter()
+        changes = compare_gdf(original, edited, "link", timings=timings)
+        total = time.perf_counter() - t0
+
+        counts = pd.Series([c["action"] for c in changes]).value_counts().to_dict()
+        for stage, seconds in timings.items():
+            self.stdout.write(f"{stage:<12}{seconds:>10.3f} s")
+        self.stdout.write(f"{'total':<12}{total:>10.3f} s  ({rows / total:,.0f} rows/s)")
+
+        for action in ["create", "delete", "modify"]:
+            status = "ok" if counts.get(action, 0) == expected[action] else "MISMATCH"
+            self.stdout.write(f"{action:<8}{counts.get(action, 0):>8} expected {expected[action]:>8}  {status}")
+
+    def _network(self, rng, rows):
+        x0 = rng.uniform(1_700_000, 2_000_000, rows)
+        y0 = rng.uniform(600_000, 800_000, rows)
+        geoms = shapely.linestrings(np.stack([
+            np.column_stack([x0, y0]),
+            np.column_stack([x0 + rng.uniform(-500, 500, rows), y0 + rng.uniform(-500, 500, rows)]),
+        ], axis=1))
+        return gpd.GeoDataFrame({
+            "link_id": np.arange(1, rows + 1),
+            "a": rng.integers(1, rows, rows),
+            "b": rng.integers(1, rows, rows),
+            "lanes": rng.integers(1, 4, rows),
+            "capacity": rng.uniform(500, 2000, rows).round(1),
+            "name": np.where(rng.random(rows) < 0.5, "Main St", None),
+            "version": 1,
+        }, geometry=geoms, crs=f"EPSG:{SRID}")
+
+    def _edit(self, rng, original, options):
+        rows = len(original)
+        edited = original.drop(columns="version").copy()
+
+        deleted = rng.choice(rows, options["deleted"], replace=False)
+        remaining = np.setdiff1d(np.arange(rows), deleted)
+        modified = rng.choice(remaining, int(rows * options["changed"]), replace=False)
+        geom_modified, attr_modified = np.array_split(modified, 2)
+
+        edited.loc[attr_modified, "lanes"] += 1
+        edited.loc[geom_modified, "geometry"] = shapely.transform(edited.geometry.values[geom_modified], lambda c: c + 5.0)
+
+        # Round-tripped coordinates stay equal within tolerance and must not count as modified
+        untouched = np.setdiff1d(remaining, modified)[:1_000]
+        edited.loc[untouched, "geometry"] = shapely.transform(edited.geometry.values[untouched], lambda c: c + 1e-6)
+
+        created = original.iloc[:options["created"]].drop(columns="version").copy()
+        created["link_id"] = -1
+        edited = pd.concat([edited.drop(index=deleted), created], ignore_index=True)
+
+        expected = {"create": options["created"], "delete": options["deleted"], "modify": len(modified)}
+        return gpd.GeoDataFrame(edited, geometry="geometry", crs=original.crs), expected
@@ -0,0 +1,182 @@
+import math
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.conf import settings
+
+from network.models import Changeset
+from network.utils.resolved import get_resolved_network, resolve_sql, resolved_network_sql
+from network.utils.tiles import build_tile_sql, tile_sql_params, allowed_changeset_ids
+from network.utils.scripts import CONFLICT_CANDIDATES_SQL
+
+SRID = settings.USE_SRID
+
+# Synthetic grid origin and spacing, in USE_SRID units (Ohio South, US feet)
+ORIGIN_X, ORIGIN_Y = 1_800_000, 700_000
+SPACING = 500
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = (
+        "Builds a synthetic network inside a transaction, runs EXPLAIN ANALYZE on the hot "
+        "network queries with and without index scans, and rolls everything back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nodes", type=int, default=50_000, help="Number of nodes in the synthetic grid.")
+        parser.add_argument("--projects", type=int, default=5, help="Number of project changesets on top of the base.")
+        parser.add_argument("--edits", type=int, default=2_000, help="Link versions written per project.")
+        parser.add_argument("--zoom", type=int, default=14, help="Zoom of the tile explained at the grid center.")
+        parser.add_argument("--no-baseline", action="store_true", help="Skip the run with index scans disabled.")
+        parser.add_argument("--plans", action="store_true", help="Print the full query plans.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise _Rollback()
+        except _Rollback:
+            self.stdout.write("Synthetic network rolled back.")
+
+    def _run(self, options):
+        with connection.cursor() as cursor:
+            base, projects, center = self._build_network(cursor, options)
+            queries = self._hot_queries(base, projects, center, options["zoom"])
+
+            rows = []
+            for name, sql, params in queries:
+                indexed_ms, plan = self._explain(cursor, sql, params)
+                baseline_ms = None
+                if not options["no_baseline"]:
+                    cursor.execute("SET LOCAL enable_indexscan = off")
+                    cursor.execute("SET LOCAL enable_bitmapscan = off")
+                    cursor.execute("SET LOCAL enable_indexonlyscan = off")
+                    baseline_ms, _ = self._explain(cursor, sql, params)
+                    cursor.execute("RESET enable_indexscan")
+                    cursor.execute("RESET enable_bitmapscan")
+                    cursor.execute("RESET enable_indexonlyscan")
+                rows.append((name, baseline_ms, indexed_ms))
+
+                if options["plans"]:
+                    self.stdout.write(self.style.MIGRATE_HEADING(name))
+                    self.stdout.write(plan)
+
+        self.stdout.write(f"{'query':<32}{'no index (ms)':>16}{'indexed (ms)':>16}{'speedup':>10}")
+        for name, baseline_ms, indexed_ms in rows:
+            speedup = f"{baseline_ms / indexed_ms:.1f}x" if baseline_ms and indexed_ms else "-"
+            baseline = f"{baseline_ms:.1f}" if baseline_ms is not None else "-"
+            self.stdout.write(f"{name:<32}{baseline:>16}{indexed_ms:>16.1f}{speedup:>10}")
+
+    def _build_network(self, cursor, options):
+        side = max(2, int(math.sqrt(options["nodes"])))
+        n_nodes = side * side
+
+        base = Changeset.objects.create(comment="explain_hot_queries synthetic base", pid="synthetic",
+                                        is_base_network=True, auth_area="all")
+        base.base_network = base
+        base.save()
+        self.stdout.write(f"Building a {side}x{side} grid ({n_nodes} nodes) under changeset {base.id}...")
+
+        # Nodes on a regular grid
+        cursor.execute(f"""
+            CREATE TEMP TABLE synth_nodes ON COMMIT DROP AS
+            SELECT g AS k, mod(g, {side}) AS col, g / {side} AS row,
+                   nextval(pg_get_serial_sequence('network_node', 'id')) AS node_id
+            FROM generate_series(0, {n_nodes - 1}) g
+        """)
+        cursor.execute("INSERT INTO network_node (id) SELECT node_id FROM synth_nodes")
+        cursor.execute(f"""
+            INSERT INTO network_nodeversion (node_id, version, active, is_valid, geometry, attributes, n, changeset_id, created_at)
+            SELECT node_id, 1, TRUE, TRUE,
+                   ST_SetSRID(ST_MakePoint({ORIGIN_X} + col * {SPACING}, {ORIGIN_Y} + row * {SPACING}), {SRID}),
+                   jsonb_build_object('n', k + 1), k + 1, {base.id}, now()
+            FROM synth_nodes
+        """)
+
+        # Links between horizontal and vertical neighbours
+        cursor.execute(f"""
+            CREATE TEMP TABLE synth_links ON COMMIT DROP AS
+            SELECT nextval(pg_get_serial_sequence('network_link', 'id')) AS link_id, *
+            FROM (
+                SELECT a.node_id AS f_node_id, b.node_id AS t_node_id, a.k + 1 AS an, b.k + 1 AS bn,
+                       a.col AS acol, a.row AS arow, b.col AS bcol, b.row AS brow
+                FROM synth_nodes a JOIN synth_nodes b ON b.k = a.k + 1 AND a.col < {side - 1}
+                UNION ALL
+                SELECT a.node_id, b.node_id, a.k + 1, b.k + 1, a.col, a.row, b.col, b.row
+                FROM synth_nodes a JOIN synth_nodes b ON b.k = a.k + {side}
+            ) pairs
+        """)
+        cursor.execute("INSERT INTO network_link (id) SELECT link_id FROM synth_links")
+        cursor.execute(f"""
+            INSERT INTO network_linkversion (link_id, version, active, is_valid, f_node_id, t_node_id, geometry, attributes, a, b, lanes, changeset_id, created_at)
+            SELECT link_id, 1, TRUE, TRUE, f_node_id, t_node_id,
+                   ST_SetSRID(ST_MakeLine(
+                       ST_MakePoint({ORIGIN_X} + acol * {SPACING}, {ORIGIN_Y} + arow * {SPACING}),
+                       ST_MakePoint({ORIGIN_X} + bcol * {SPACING}, {ORIGIN_Y} + brow * {SPACING})
+                   ), {SRID}),
+                   jsonb_build_object('a', an, 'b', bn, 'lanes', 1), an, bn, 1, {base.id}, now()
+            FROM synth_links
+        """)
+
+        # Project changesets modifying random links
+        projects = []
+        for p in range(options["projects"]):
+            project = Changeset.objects.create(comment="explain_hot_queries synthetic project", pid=f"synthetic-{p}",
+                                               base_network=base, auth_area="all")
+            cursor.execute(f"""
+                INSERT INTO network_linkversion (link_id, version, active, is_valid, f_node_id, t_node_id, geometry, attributes, a, b, lanes, changeset_id, created_at)
+                SELECT link_id, {p + 2}, TRUE, is_valid, f_node_id, t_node_id, geometry,
+                       attributes || jsonb_build_object('lanes', 2), a, b, 2, {project.id}, now()
+                FROM network_linkversion
+                WHERE changeset_id = {base.id}
+                ORDER BY random()
+                LIMIT {options["edits"]}
+            """)
+            projects.append(project)
+
+        cursor.execute("ANALYZE network_node, network_nodeversion, network_link, network_linkversion")
+
+        cursor.execute(f"""
+            SELECT ST_X(p), ST_Y(p) FROM (
+                SELECT ST_Transform(ST_SetSRID(ST_MakePoint(
+                    {ORIGIN_X} + {side * SPACING / 2}, {ORIGIN_Y} + {side * SPACING / 2}), {SRID}), 4326) AS p
+            ) c
+        """)
+        center = cursor.fetchone()
+        return base, projects, center
+
+    def _hot_queries(self, base, projects, center, z):
+        all_ids = [base.id] + [p.id for p in projects]
+
+        # Tile at the center of the grid
+        lon, lat = center
+        n = 2 ** z
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+
+        resolved = get_resolved_network(all_ids)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE network_resolvednode, network_resolvedlink")
+        nodes_sql, links_sql = resolved_network_sql(resolved.id)
+        ref_nodes_sql, ref_links_sql = resolved_network_sql(resolved.id, active_only=False, node_columns="v.*", link_columns="v.*")
+
+        queries = [
+            ("resolve nodes", resolve_sql("node"), [all_ids]),
+            ("resolve links", resolve_sql("link"), [all_ids]),
+            (f"tile {z}/{x}/{y}", build_tile_sql(z, x, y), tile_sql_params(z, resolved.id, allowed_changeset_ids(resolved.id, "all"))),
+            ("build_network nodes", nodes_sql, None),
+            ("build_network links", links_sql, None),
+            ("to_netchange reference nodes", ref_nodes_sql, None),
+            ("to_netchange reference links", ref_links_sql, None),
+            ("detect_conflicts candidates", CONFLICT_CANDIDATES_SQL, {"ids": [p.id for p in projects]}),
+        ]
+        return queries
+
+    def _explain(self, cursor, sql, params):
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)
+        plan = "\n".join(r[0] for r in cursor.fetchall())
+        match = re.search(r"Execution Time: ([\d.]+) ms", plan)
+        return (float(match.group(1)) if match else None), plan
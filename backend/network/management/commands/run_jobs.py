@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.conf import settings
+
+from network.utils.jobs import JOB_HANDLERS, run_next_job, requeue_stale_jobs
+
+def _init_worker():
+    # Pool processes start without Django configured when the start method is not fork
+    django.setup()
+
+class Command(BaseCommand):
+    help = "Runs queued jobs (uploads, exports, base tiles) in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.JOB_WORKERS, help="Number of worker processes.")
+        parser.add_argument("--poll", type=float, default=2.0, help="Seconds to wait before polling an empty queue again.")
+        parser.add_argument("--kinds", nargs="*", choices=sorted(JOB_HANDLERS), help="Only run jobs of these kinds.")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty.")
+        parser.add_argument("--requeue-stale", type=int, default=None, metavar="MINUTES",
+                            help="On start, requeue running jobs without progress for this many minutes.")
+
+    def handle(self, *args, **options):
+        if options["requeue_stale"] is not None:
+            requeued = requeue_stale_jobs(options["requeue_stale"])
+            self.stdout.write(f"Requeued {requeued} stale jobs.")
+
+        # Forked workers must not share the parent's database sockets
+        connections.close_all()
+
+        workers = max(1, options["workers"])
+        kinds = options["kinds"]
+        self.stdout.write(f"Running jobs with {workers} workers...")
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            running = set()
+            idle_since = None
+            try:
+                while True:
+                    # Keep every worker busy until one of them finds the queue empty, then poll
+                    if idle_since is None or time.monotonic() - idle_since >= options["poll"]:
+                        idle_since = None
+                        while len(running) < workers:
+                            running.add(pool.submit(run_next_job, kinds))
+
+                    if not running:
+                        if options["once"]:
+                            break
+                        time.sleep(options["poll"])
+                        continue
+
+                    done, running = wait(running, timeout=options["poll"], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job_id = future.result()
+                        if job_id is None:
+                            idle_since = idle_since or time.monotonic()
+                        else:
+                            self.stdout.write(f"Job {job_id} finished.")
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping, waiting for running jobs...")
@@ -0,0 +1,259 @@
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.conf import settings
+
+from network.models import Changeset
+from network.utils.generate_base_tiles import get_base_mbtiles
+from network.utils.mbtiles import MBTiles
+from network.utils.resolved import get_resolved_network
+from network.utils.tile_cache import get_tile_cache, tile_namespace
+from network.utils.tiles import render_tile, tile_has_features, tile_touched_by_projects, changeset_bbox, bbox_to_tile_range
+
+# Rendered tiles written to an MBTiles file per transaction
+WRITE_BATCH = 500
+
+############################## Targets ##############################
+
+class CacheTarget:
+    '''Writes into the tile cache namespace MVTNetworkTileView reads for the project set.'''
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.tile_cache = get_tile_cache()
+
+    def get(self, z, x, y):
+        return self.tile_cache.get(self.namespace, z, x, y)
+
+    def put_tiles(self, tiles):
+        for z, x, y, data in tiles:
+            self.tile_cache.set(self.namespace, z, x, y, data)
+
+class MBTilesTarget:
+    def __init__(self, path):
+        self.mbtiles = MBTiles(path)
+
+    def get(self, z, x, y):
+        return self.mbtiles.get_tile(z, x, y)
+
+    def put_tiles(self, tiles):
+        self.mbtiles.put_tiles(tiles)
+
+def make_target(spec):
+    kind, location = spec
+    return CacheTarget(location) if kind == "cache" else MBTilesTarget(location)
+
+############################## Workers ##############################
+
+_worker = {}
+
+def _init_worker(state):
+    # Pool processes start without Django configured when the start method is not fork
+    django.setup()
+    _worker.clear()
+    _worker.update(state)
+    _worker["target"] = make_target(state["target"])
+    _worker["pyramid"] = get_base_mbtiles(state["base_id"]) if state["pyramid_zooms"] else None
+
+def _seed_tile(z, x, y):
+    '''
+    Renders tile z/x/y with the tile view SQL. Returns (z, x, y, status, data to write or None, size, descend):
+    status is "rendered", "skipped" (already in the target, with --resume) or "pyramid" (served from the base
+    pyramid by the view, nothing to cache); descend tells whether the children can hold features.
+    '''
+    w = _worker
+    zooms = w["pyramid_zooms"]
+    if zooms and zooms[0] <= z <= zooms[1] and (
+        not w["project_ids"] or not tile_touched_by_projects(z, x, y, w["base_id"], w["project_ids"])
+    ):
+        status, data = "pyramid", w["pyramid"].get_tile(z, x, y) or b""
+    else:
+        data = w["target"].get(z, x, y) if w["resume"] else None
+        status = "skipped"
+        if data is None:
+            status, data = "rendered", bytes(render_tile(z, x, y, w["resolved_id"], w["auth_area"]) or b"")
+
+    descend = bool(data) or tile_has_features(z, x, y, w["resolved_id"])
+    return z, x, y, status, data if status == "rendered" else None, len(data), descend
+
+############################## Command ##############################
+
+class Progress:
+    '''Tile counts and throughput of one project set, reported every `every` seconds and at the end of each zoom.'''
+
+    def __init__(self, stdout, label, every):
+        self.stdout = stdout
+        self.label = label
+        self.every = every
+        self.counts = {"rendered": 0, "skipped": 0, "pyramid": 0}
+        self.bytes = 0
+        self._t0 = self._last = time.monotonic()
+
+    def add(self, status, size):
+        self.counts[status] += 1
+        if status == "rendered":
+            self.bytes += size
+
+    def report(self, z, done, total, force=False):
+        now = time.monotonic()
+        if not force and now - self._last < self.every:
+            return
+        self._last = now
+        elapsed = now - self._t0
+        tiles = sum(self.counts.values())
+        self.stdout.write(
+            f"{self.label} z{z}: {done}/{total} tiles | {self.counts['rendered']} rendered, {self.counts['skipped']} skipped, "
+            f"{self.counts['pyramid']} from base pyramid | {tiles / elapsed if elapsed else 0:.1f} tiles/s, "
+            f"{self.bytes / 2**20:.1f} MB rendered, {elapsed:.0f} s"
+        )
+
+class Command(BaseCommand):
+    help = (
+        "Renders every tile of a network's extent for a zoom range with the MVT tile SQL, into the tile cache "
+        "(the namespace MVTNetworkTileView reads) or an MBTiles file, so the first viewers do not wait for cold tiles. "
+        "Children of tiles without features are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("base_changeset_id", type=int)
+        parser.add_argument("--projects", action="append", default=[], metavar="ID,ID,...",
+                            help="Project changeset ids seeded on top of the base, repeat for several project sets. "
+                                 "The base alone is seeded when omitted; use --projects '' to include it with others.")
+        parser.add_argument("--minzoom", type=int, default=6)
+        parser.add_argument("--maxzoom", type=int, default=14)
+        parser.add_argument("--auth-area", default=None, help="auth_area of the viewers, the base network's by default.")
+        parser.add_argument("--mbtiles", default=None, metavar="PATH",
+                            help="Write into this MBTiles file instead of the tile cache (a single project set only).")
+        parser.add_argument("--workers", type=int, default=settings.JOB_WORKERS, help="Number of worker processes.")
+        parser.add_argument("--resume", action="store_true", help="Keep tiles already in the target instead of rendering them again.")
+        parser.add_argument("--rate", type=float, default=None, help="At most this many tiles per second.")
+        parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines.")
+
+    def handle(self, *args, **options):
+        if not 0 <= options["minzoom"] <= options["maxzoom"] <= 24:
+            raise CommandError("Zooms must satisfy 0 <= minzoom <= maxzoom <= 24.")
+        try:
+            base = Changeset.objects.get(id=options["base_changeset_id"], is_base_network=True)
+        except Changeset.DoesNotExist:
+            raise CommandError(f"{options['base_changeset_id']} is not a base network changeset.")
+
+        project_sets = [[int(i) for i in p.split(",") if i.strip()] for p in options["projects"]] or [[]]
+        if options["mbtiles"] and len(project_sets) > 1:
+            raise CommandError("--mbtiles takes a single project set.")
+        auth_area = options["auth_area"] or base.auth_area
+
+        for project_ids in project_sets:
+            self._seed(base, project_ids, auth_area, options)
+
+    def _seed(self, base, project_ids, auth_area, options):
+        minzoom, maxzoom = options["minzoom"], options["maxzoom"]
+        namespace = tile_namespace(base.id, project_ids, auth_area)
+
+        # Extent of the base and of everything the projects touch, lon/lat
+        boxes = [b for b in (changeset_bbox(cs) for cs in [base.id] + project_ids) if b]
+        if not boxes:
+            self.stdout.write(f"{namespace}: no features, nothing to seed.")
+            return
+        bbox = (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+        resolved = get_resolved_network([base.id] + project_ids)
+
+        if options["mbtiles"]:
+            target_spec = ("mbtiles", options["mbtiles"])
+            MBTiles(options["mbtiles"]).create({
+                "name": namespace,
+                "type": "overlay",
+                "minzoom": minzoom,
+                "maxzoom": maxzoom,
+                "bounds": ",".join(f"{v:.6f}" for v in bbox),
+                "auth_area": auth_area,
+                "json": json.dumps({"vector_layers": [
+                    {"id": "links", "fields": {}, "minzoom": minzoom, "maxzoom": maxzoom},
+                    {"id": "nodes", "fields": {}, "minzoom": minzoom, "maxzoom": maxzoom},
+                ]}),
+            })
+            pyramid_zooms = None
+        else:
+            target_spec = ("cache", namespace)
+            # Tiles the view can serve from the base pyramid are left out of the cache
+            mbtiles = get_base_mbtiles(base.id) if base.auth_area == auth_area else None
+            metadata = mbtiles.metadata() if mbtiles else {}
+            pyramid_zooms = (int(metadata["minzoom"]), int(metadata["maxzoom"])) if metadata else None
+
+        state = {
+            "base_id": base.id,
+            "project_ids": project_ids,
+            "auth_area": auth_area,
+            "resolved_id": resolved.id,
+            "target": target_spec,
+            "pyramid_zooms": pyramid_zooms,
+            "resume": options["resume"],
+        }
+        target = make_target(target_spec)
+        progress = Progress(self.stdout, namespace, options["report_every"])
+        workers = max(1, options["workers"])
+        self.stdout.write(f"Seeding {namespace} z{minzoom}-{maxzoom} into {target_spec[1]} with {workers} workers...")
+
+        # Forked workers must not share the parent's database sockets
+        connections.close_all()
+
+        xmin, xmax, ymin, ymax = bbox_to_tile_range(*bbox, minzoom)
+        level = [(x, y) for x in range(xmin, xmax + 1) for y in range(ymin, ymax + 1)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(state,)) as pool:
+            try:
+                for z in range(minzoom, maxzoom + 1):
+                    children = []
+                    batch = []
+                    done = 0
+                    for _, x, y, status, data, size, descend in self._run_level(pool, z, level, workers, options["rate"]):
+                        done += 1
+                        progress.add(status, size)
+                        if data is not None:
+                            batch.append((z, x, y, data))
+                            if len(batch) >= WRITE_BATCH:
+                                target.put_tiles(batch)
+                                batch = []
+                        if descend and z < maxzoom:
+                            children.extend([(2 * x, 2 * y), (2 * x + 1, 2 * y), (2 * x, 2 * y + 1), (2 * x + 1, 2 * y + 1)])
+                        progress.report(z, done, len(level))
+                    target.put_tiles(batch)
+                    progress.report(z, done, len(level), force=True)
+                    level = children
+            except KeyboardInterrupt:
+                # Every written tile is kept, rerun with --resume to continue
+                pool.shutdown(wait=False, cancel_futures=True)
+                target.put_tiles(batch)
+                self.stdout.write("Interrupted, rerun with --resume to continue.")
+                raise
+
+        if options["mbtiles"]:
+            MBTiles(options["mbtiles"]).finalize()
+
+    def _run_level(self, pool, z, level, workers, rate):
+        '''Results of _seed_tile() for every tile of `level`, at most `rate` submitted per second and a few per worker in flight.'''
+        tiles = iter(level)
+        pending = set()
+        submitted = 0
+        t0 = time.monotonic()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < workers * 4:
+                tile = next(tiles, None)
+                if tile is None:
+                    exhausted = True
+                    break
+                if rate:
+                    delay = t0 + submitted / rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                pending.add(pool.submit(_seed_tile, z, *tile))
+                submitted += 1
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
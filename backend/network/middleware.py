@@ -0,0 +1,127 @@
+import contextlib
+import cProfile
+import os
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.urls import reverse
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from network.utils.metrics import RequestMetrics, activate, deactivate, observe, server_timing
+
+PROFILE_ID_RE = re.compile(r"^[\w-]+$")
+
+def profile_dir():
+    return settings.METRICS["PROFILE_DIR"]
+
+def profile_path(profile_id):
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    return os.path.join(profile_dir(), f"{profile_id}.prof")
+
+def list_profiles():
+    '''Saved profile ids, newest first.'''
+    if not os.path.isdir(profile_dir()):
+        return []
+    names = [n for n in os.listdir(profile_dir()) if n.endswith(".prof")]
+    names.sort(key=lambda n: os.path.getmtime(os.path.join(profile_dir(), n)), reverse=True)
+    return [n[:-len(".prof")] for n in names]
+
+def _prune_profiles(keep):
+    for profile_id in list_profiles()[keep:]:
+        with contextlib.suppress(OSError):
+            os.remove(profile_path(profile_id))
+
+def _is_superuser(request):
+    '''
+    Whether the request comes from a superuser. The API authenticates with JWT inside the views, after this
+    middleware has run, so the bearer token (or the ?token= of the tile views) is checked here directly.
+    '''
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.is_superuser
+    auth = JWTAuthentication()
+    try:
+        result = auth.authenticate(request)
+        if result is None and request.GET.get("token"):
+            result = auth.get_user(auth.get_validated_token(request.GET["token"])), None
+    except Exception:
+        return False
+    return bool(result and result[0].is_superuser)
+
+class MetricsMiddleware:
+    '''
+    Instruments the API requests: named spans (network.utils.metrics.span), database queries and their time,
+    rows processed and peak memory, sent back in a Server-Timing header and added to the histograms of the
+    metrics endpoint (MetricsView). With ?profile=1 a superuser's request also runs under cProfile; the dump
+    is saved under METRICS["PROFILE_DIR"] and linked from the X-Profile header.
+    Streaming responses are measured until their last chunk, past the headers.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS["ENABLED"] or not request.path.startswith(settings.METRICS["PATH_PREFIX"]):
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        profiler = None
+        if request.GET.get("profile") == "1" and _is_superuser(request):
+            profiler = cProfile.Profile()
+            metrics.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        with self._active(metrics, profiler):
+            response = self.get_response(request)
+
+        response["Server-Timing"] = server_timing(metrics)
+        if profiler is not None:
+            response["X-Profile"] = reverse("metrics_profile", args=[metrics.profile_id])
+
+        if response.streaming:
+            response.streaming_content = self._stream(request, response.streaming_content, metrics, profiler)
+        else:
+            self._finish(request, metrics, profiler)
+        return response
+
+    @contextlib.contextmanager
+    def _active(self, metrics, profiler):
+        token = activate(metrics)
+        try:
+            with connection.execute_wrapper(metrics.record_query):
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            deactivate(token)
+
+    def _stream(self, request, content, metrics, profiler):
+        # Chunks are produced one next() at a time, each with the metrics active (possibly on another thread under ASGI)
+        content = iter(content)
+        end = object()
+        try:
+            while True:
+                with self._active(metrics, profiler):
+                    chunk = next(content, end)
+                if chunk is end:
+                    return
+                yield chunk
+        finally:
+            self._finish(request, metrics, profiler)
+
+    def _finish(self, request, metrics, profiler):
+        match = request.resolver_match
+        name = f"view.{match.url_name}" if match and match.url_name else "view.unresolved"
+        observe(name, metrics.total_seconds(), queries=metrics.queries, db_seconds=metrics.db_seconds)
+        if profiler is not None:
+            os.makedirs(profile_dir(), exist_ok=True)
+            profiler.dump_stats(profile_path(metrics.profile_id))
+            _prune_profiles(settings.METRICS["PROFILE_KEEP"])
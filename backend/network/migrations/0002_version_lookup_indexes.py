@@ -0,0 +1,43 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("network", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="linkversion",
+            index=models.Index(
+                fields=["changeset", "link", "-version"],
+                name="linkversion_cs_link_ver_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="linkversion",
+            index=models.Index(
+                condition=models.Q(("active", True)),
+                fields=["changeset", "link", "-version"],
+                name="linkversion_cs_active_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="nodeversion",
+            index=models.Index(
+                fields=["changeset", "node", "-version"],
+                name="nodeversion_cs_node_ver_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="nodeversion",
+            index=models.Index(
+                condition=models.Q(("active", True)),
+                fields=["changeset", "node", "-version"],
+                name="nodeversion_cs_active_idx",
+            ),
+        ),
+    ]
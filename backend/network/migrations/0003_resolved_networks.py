@@ -0,0 +1,122 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("network", "0002_version_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResolvedNetwork",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(editable=False, primary_key=True, serialize=False),
+                ),
+                ("key", models.TextField(unique=True)),
+                ("node_count", models.IntegerField(default=0)),
+                ("link_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("last_used_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "changesets",
+                    models.ManyToManyField(
+                        related_name="resolved_networks", to="network.changeset"
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ResolvedLink",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(editable=False, primary_key=True, serialize=False),
+                ),
+                (
+                    "link",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="network.link",
+                    ),
+                ),
+                (
+                    "link_version",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="resolutions",
+                        to="network.linkversion",
+                    ),
+                ),
+                (
+                    "resolved_network",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="links",
+                        to="network.resolvednetwork",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["resolved_network", "link_version"],
+                        name="resolvedlink_rn_version_idx",
+                    )
+                ],
+                "unique_together": {("resolved_network", "link")},
+            },
+        ),
+        migrations.CreateModel(
+            name="ResolvedNode",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(editable=False, primary_key=True, serialize=False),
+                ),
+                (
+                    "node",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="network.node",
+                    ),
+                ),
+                (
+                    "node_version",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="resolutions",
+                        to="network.nodeversion",
+                    ),
+                ),
+                (
+                    "resolved_network",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="nodes",
+                        to="network.resolvednetwork",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["resolved_network", "node_version"],
+                        name="resolvednode_rn_version_idx",
+                    )
+                ],
+                "unique_together": {("resolved_network", "node")},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:26
+
+import django.db.models.fields.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("network", "0004_jobs"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="linkversion",
+            index=models.Index(
+                django.db.models.fields.json.KeyTextTransform("a", "attributes"),
+                django.db.models.fields.json.KeyTextTransform("b", "attributes"),
+                name="linkversion_attr_ab_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="nodeversion",
+            index=models.Index(
+                django.db.models.fields.json.KeyTextTransform("n", "attributes"),
+                name="nodeversion_attr_n_idx",
+            ),
+        ),
+    ]
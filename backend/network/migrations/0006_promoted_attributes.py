@@ -0,0 +1,100 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:29
+
+from django.db import migrations, models
+
+# Frozen copy of network.utils.promoted as of this migration: default attribute keys, no PROMOTED_ATTRIBUTES overrides.
+# Run the backfill_promoted_attributes command afterwards when the settings override the keys.
+INTEGER = r"'^\s*-?[0-9]{1,18}(\.0*)?\s*$'"
+NUMBER = r"'^\s*-?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'"
+
+FACILITY_TYPE = "COALESCE(attributes->>'facility_type', attributes->>'facility_t', attributes->>'ft', attributes->>'factype')"
+CAPACITY = "COALESCE(attributes->>'capacity', attributes->>'cap')"
+
+BACKFILL = {
+    "network_nodeversion": [
+        f"n = CASE WHEN attributes->>'n' ~ {INTEGER} THEN round((attributes->>'n')::numeric)::bigint END",
+    ],
+    "network_linkversion": [
+        f"a = CASE WHEN attributes->>'a' ~ {INTEGER} THEN round((attributes->>'a')::numeric)::bigint END",
+        f"b = CASE WHEN attributes->>'b' ~ {INTEGER} THEN round((attributes->>'b')::numeric)::bigint END",
+        f"facility_type = CASE WHEN {FACILITY_TYPE} ~ {INTEGER} THEN round(({FACILITY_TYPE})::numeric)::bigint END",
+        f"lanes = CASE WHEN attributes->>'lanes' ~ {INTEGER} THEN round((attributes->>'lanes')::numeric)::bigint END",
+        f"capacity = CASE WHEN {CAPACITY} ~ {NUMBER} THEN ({CAPACITY})::double precision END",
+    ],
+}
+
+BATCH_ROWS = 100_000
+
+
+def backfill(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, assignments in BACKFILL.items():
+            cursor.execute(f"SELECT min(id), max(id) FROM {table}")
+            low, high = cursor.fetchone()
+            if low is None:
+                continue
+            for start in range(low, high + 1, BATCH_ROWS):
+                cursor.execute(
+                    f"UPDATE {table} SET {', '.join(assignments)} WHERE id >= %s AND id < %s", [start, start + BATCH_ROWS]
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("network", "0005_attribute_key_indexes"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="linkversion",
+            name="linkversion_attr_ab_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="nodeversion",
+            name="nodeversion_attr_n_idx",
+        ),
+        migrations.AddField(
+            model_name="linkversion",
+            name="a",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="linkversion",
+            name="b",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="linkversion",
+            name="capacity",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="linkversion",
+            name="facility_type",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="linkversion",
+            name="lanes",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="nodeversion",
+            name="n",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="linkversion",
+            index=models.Index(fields=["a", "b"], name="linkversion_ab_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="linkversion",
+            index=models.Index(fields=["facility_type"], name="linkversion_ft_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="nodeversion",
+            index=models.Index(fields=["n"], name="nodeversion_n_idx"),
+        ),
+    ]
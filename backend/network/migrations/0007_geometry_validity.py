@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("network", "0006_promoted_attributes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="linkversion",
+            name="is_valid",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name="nodeversion",
+            name="is_valid",
+            field=models.BooleanField(default=True),
+        ),
+        # Existing versions: only the invalid ones need rewriting
+        migrations.RunSQL(
+            "UPDATE network_linkversion SET is_valid = false WHERE NOT ST_IsValid(geometry)",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            "UPDATE network_nodeversion SET is_valid = false WHERE NOT ST_IsValid(geometry)",
+            migrations.RunSQL.noop,
+        ),
+    ]
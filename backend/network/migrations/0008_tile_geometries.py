@@ -0,0 +1,108 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:45
+
+import django.contrib.gis.db.models.fields
+import django.contrib.gis.db.models.functions
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("network", "0007_geometry_validity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="linkversion",
+            name="geom_3857",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform(
+                    models.F("geometry"), 3857
+                ),
+                output_field=django.contrib.gis.db.models.fields.LineStringField(
+                    spatial_index=False, srid=3857
+                ),
+            ),
+        ),
+        migrations.AddField(
+            model_name="linkversion",
+            name="geom_3857_s50",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform(
+                    models.Func(
+                        models.F("geometry"),
+                        models.Value(50.0),
+                        function="ST_SimplifyPreserveTopology",
+                        output_field=django.contrib.gis.db.models.fields.LineStringField(
+                            srid=3735
+                        ),
+                    ),
+                    3857,
+                ),
+                output_field=django.contrib.gis.db.models.fields.LineStringField(
+                    spatial_index=False, srid=3857
+                ),
+            ),
+        ),
+        migrations.AddField(
+            model_name="linkversion",
+            name="geom_3857_s500",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform(
+                    models.Func(
+                        models.F("geometry"),
+                        models.Value(500.0),
+                        function="ST_SimplifyPreserveTopology",
+                        output_field=django.contrib.gis.db.models.fields.LineStringField(
+                            srid=3735
+                        ),
+                    ),
+                    3857,
+                ),
+                output_field=django.contrib.gis.db.models.fields.LineStringField(
+                    spatial_index=False, srid=3857
+                ),
+            ),
+        ),
+        migrations.AddField(
+            model_name="nodeversion",
+            name="geom_3857",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform(
+                    models.F("geometry"), 3857
+                ),
+                output_field=django.contrib.gis.db.models.fields.PointField(
+                    spatial_index=False, srid=3857
+                ),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="linkversion",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["geom_3857"], name="linkversion_geom_3857_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="linkversion",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["geom_3857_s50"], name="linkversion_geom_s50_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="linkversion",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["geom_3857_s500"], name="linkversion_geom_s500_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="nodeversion",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["geom_3857"], name="nodeversion_geom_3857_idx"
+            ),
+        ),
+    ]
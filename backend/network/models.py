@@ -1,7 +1,23 @@
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models.functions import Transform
+from django.contrib.postgres.indexes import GistIndex
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.contrib.auth import get_user_model
 
+from network.utils.promoted import promoted_values
+
+def web_mercator(field_class, tolerance=0):
+    '''
+    Stored generated EPSG:3857 copy of `geometry` for the tile queries (utils/tiles.py), first simplified
+    in USE_SRID units by `tolerance` when given. PostgreSQL recomputes it on every write, COPY included.
+    '''
+    geometry = models.F("geometry")
+    if tolerance:
+        geometry = models.Func(geometry, models.Value(float(tolerance)), function="ST_SimplifyPreserveTopology",
+                               output_field=field_class(srid=3735))
+    return models.GeneratedField(expression=Transform(geometry, 3857), output_field=field_class(srid=3857, spatial_index=False),
+                                 db_persist=True)
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, username, password=None, **extra_fields):
         if not username:
@@ -47,12 +63,38 @@ class NodeVersion(models.Model):
     active = models.BooleanField(default=True, null=True)
     geometry = models.PointField(srid=3735)
     attributes = models.JSONField(blank=True, default=dict)
+    # ST_IsValid(geometry), computed when the version is written so tile queries only read the flag
+    is_valid = models.BooleanField(default=True)
+    # Tile geometry, a point needs no simplification
+    geom_3857 = web_mercator(models.PointField)
+
+    # Promoted attributes (utils/promoted.py), copied from `attributes` on every write
+    n = models.BigIntegerField(null=True, blank=True)
 
     changeset = models.ForeignKey("Changeset", on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('node', 'version')
+        indexes = [
+            # Latest-version resolution: changeset_id IN (...) + DISTINCT ON (node_id) ORDER BY version DESC.
+            # The geometry column already carries a GiST index (spatial_index defaults to True).
+            models.Index(fields=['changeset', 'node', '-version'], name='nodeversion_cs_node_ver_idx'),
+            models.Index(fields=['changeset', 'node', '-version'], condition=models.Q(active=True), name='nodeversion_cs_active_idx'),
+            # Cube-style key lookups (utils/lookup.py)
+            models.Index(fields=['n'], name='nodeversion_n_idx'),
+            # Tile envelope lookups (utils/tiles.py)
+            GistIndex(fields=['geom_3857'], name='nodeversion_geom_3857_idx'),
+        ]
+
+    def promote_attributes(self):
+        for column, value in promoted_values(self.attributes or {}, "node").items():
+            setattr(self, column, value)
+
+    def save(self, *args, **kwargs):
+        self.promote_attributes()
+        self.is_valid = self.geometry is not None and self.geometry.valid
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"NodeVersion {self.node} v{self.version}"
@@ -75,12 +117,47 @@ class LinkVersion(models.Model):
 
     geometry = models.LineStringField(srid=3735)
     attributes = models.JSONField(blank=True, default=dict)
+    # ST_IsValid(geometry), computed when the version is written so tile queries only read the flag
+    is_valid = models.BooleanField(default=True)
+    # Tile geometries, one per zoom band of utils/tiles.py get_simplification_tolerance()
+    geom_3857 = web_mercator(models.LineStringField)
+    geom_3857_s50 = web_mercator(models.LineStringField, 50)
+    geom_3857_s500 = web_mercator(models.LineStringField, 500)
+
+    # Promoted attributes (utils/promoted.py), copied from `attributes` on every write
+    a = models.BigIntegerField(null=True, blank=True)
+    b = models.BigIntegerField(null=True, blank=True)
+    facility_type = models.BigIntegerField(null=True, blank=True)
+    lanes = models.BigIntegerField(null=True, blank=True)
+    capacity = models.FloatField(null=True, blank=True)
 
     changeset = models.ForeignKey("Changeset", on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('link', 'version')
+        indexes = [
+            # Latest-version resolution: changeset_id IN (...) + DISTINCT ON (link_id) ORDER BY version DESC.
+            # The geometry column already carries a GiST index (spatial_index defaults to True).
+            models.Index(fields=['changeset', 'link', '-version'], name='linkversion_cs_link_ver_idx'),
+            models.Index(fields=['changeset', 'link', '-version'], condition=models.Q(active=True), name='linkversion_cs_active_idx'),
+            # Cube-style key lookups (utils/lookup.py)
+            models.Index(fields=['a', 'b'], name='linkversion_ab_idx'),
+            models.Index(fields=['facility_type'], name='linkversion_ft_idx'),
+            # Tile envelope lookups (utils/tiles.py)
+            GistIndex(fields=['geom_3857'], name='linkversion_geom_3857_idx'),
+            GistIndex(fields=['geom_3857_s50'], name='linkversion_geom_s50_idx'),
+            GistIndex(fields=['geom_3857_s500'], name='linkversion_geom_s500_idx'),
+        ]
+
+    def promote_attributes(self):
+        for column, value in promoted_values(self.attributes or {}, "link").items():
+            setattr(self, column, value)
+
+    def save(self, *args, **kwargs):
+        self.promote_attributes()
+        self.is_valid = self.geometry is not None and self.geometry.valid
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"LinkVersion {self.link} v{self.version}"
@@ -105,4 +182,78 @@ class Changeset(models.Model):
     depends_on = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='required_by')
 
     def __str__(self):
-        return f"Changeset {self.id} ({self.pid or 'No project name'})"
\ No newline at end of file
+        return f"Changeset {self.id} ({self.pid or 'No project name'})"
+
+class ResolvedNetwork(models.Model):
+    '''Materialized latest-version resolution for one combination of changesets (see utils/resolved.py).'''
+    id = models.AutoField(primary_key=True, editable=False)
+    key = models.TextField(unique=True)  # sorted changeset ids, e.g. "1,4,7"
+    changesets = models.ManyToManyField(Changeset, related_name='resolved_networks')
+    node_count = models.IntegerField(default=0)
+    link_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"ResolvedNetwork {self.id} ({self.key})"
+
+class ResolvedNode(models.Model):
+    id = models.AutoField(primary_key=True, editable=False)
+    resolved_network = models.ForeignKey(ResolvedNetwork, on_delete=models.CASCADE, related_name='nodes')
+    # Lookups go through the indexes below; single-column FK indexes would only slow down the bulk insert.
+    node = models.ForeignKey(Node, on_delete=models.CASCADE, related_name='+', db_index=False)
+    node_version = models.ForeignKey(NodeVersion, on_delete=models.CASCADE, related_name='resolutions', db_index=False)
+
+    class Meta:
+        unique_together = ('resolved_network', 'node')
+        indexes = [
+            models.Index(fields=['resolved_network', 'node_version'], name='resolvednode_rn_version_idx'),
+        ]
+
+class ResolvedLink(models.Model):
+    id = models.AutoField(primary_key=True, editable=False)
+    resolved_network = models.ForeignKey(ResolvedNetwork, on_delete=models.CASCADE, related_name='links')
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, related_name='+', db_index=False)
+    link_version = models.ForeignKey(LinkVersion, on_delete=models.CASCADE, related_name='resolutions', db_index=False)
+
+    class Meta:
+        unique_together = ('resolved_network', 'link')
+        indexes = [
+            models.Index(fields=['resolved_network', 'link_version'], name='resolvedlink_rn_version_idx'),
+        ]
+
+class Job(models.Model):
+    '''A long-running upload, export or tiling task, queued in the database and run by `manage.py run_jobs` (see utils/jobs.py).'''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    id = models.AutoField(primary_key=True, editable=False)
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, null=True, blank=True)
+    params = models.JSONField(blank=True, default=dict)
+
+    stage = models.CharField(max_length=100, blank=True)
+    progress = models.FloatField(null=True, blank=True)  # 0-1 when the stage can tell
+    message = models.TextField(blank=True)
+
+    result = models.JSONField(blank=True, default=dict)
+    result_file = models.CharField(max_length=255, blank=True)  # relative to the job directory
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.kind}, {self.status})"
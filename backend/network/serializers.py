@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Changeset, Node, Link, NodeVersion, LinkVersion
+from .models import Changeset, Node, Link, NodeVersion, LinkVersion, Job
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -57,6 +57,12 @@ class ChangesetSerializer(serializers.ModelSerializer):
         model = Changeset
         fields = ['id', 'comment', 'pid', 'created_at', 'user', 'editor', 'auth_area', 'is_base_network', 'base_network', 'depends_on']
 
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'stage', 'progress', 'message', 'result', 'result_file', 'error',
+                  'created_at', 'started_at', 'finished_at', 'updated_at']
+
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -1,3 +1,244 @@
-from django.test import TestCase
+import io
+import os
+import gzip
+import json
+import tempfile
+import zipfile
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Point
+from django.test import SimpleTestCase
+
+from network.utils.zipstream import stream_zip
+from network.utils.diff import compare_gdf
+from network.utils.lookup import normalize_keys
+from network.utils.promoted import promoted_values, promoted_frame
+from network.utils.netchange_stream import NetChangeFormatError, open_netchange_stream, iter_netchange
+from network.utils.tile_batch import TILE_RECORD, parse_tile_list, encode_tile_batch, decode_tile_batch
+
+############################## Zip Streaming ##############################
+
+class StreamZipTests(SimpleTestCase):
+    def test_archive_is_readable_by_zipfile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            members = []
+            for name, data in [("nodes.shp", b"n" * 5000), ("links.shp", os.urandom(3000)), ("empty.dbf", b"")]:
+                path = os.path.join(tmpdir, name)
+                with open(path, "wb") as f:
+                    f.write(data)
+                members.append((name, path, data))
+
+            for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                archive = b"".join(stream_zip([(name, path) for name, path, _ in members], compression=compression))
+                with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+                    self.assertIsNone(zf.testzip())
+                    self.assertEqual(zf.namelist(), [name for name, _, _ in members])
+                    for name, _, data in members:
+                        self.assertEqual(zf.read(name), data)
+
+    def test_member_larger_than_a_chunk_is_streamed_in_pieces(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "big.bin")
+            data = os.urandom(2 * 1024 * 1024 + 17)
+            with open(path, "wb") as f:
+                f.write(data)
+
+            chunks = list(stream_zip([("big.bin", path)]))
+            self.assertGreater(len(chunks), 2)
+            with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+                self.assertEqual(zf.read("big.bin"), data)
+
+############################## Diff ##############################
+
+def nodes_gdf(rows):
+    return gpd.GeoDataFrame(
+        [{"node_id": node_id, "name": name, "lanes": lanes} for node_id, name, lanes, _ in rows],
+        geometry=[Point(xy) for *_, xy in rows], crs="EPSG:3735",
+    )
+
+class CompareGdfTests(SimpleTestCase):
+    def setUp(self):
+        self.original = nodes_gdf([
+            (1, "Main St", 2, (0, 0)),
+            (2, "High St", 2, (10, 0)),
+            (3, "Oak Ave", 1, (20, 0)),
+        ])
+
+    def changes_by_action(self, edited):
+        changes = compare_gdf(self.original, edited, "node")
+        return {action: sorted(c["id"] for c in changes if c["action"] == action) for action in ("create", "modify", "delete")}
+
+    def test_unchanged_network_has_no_changes(self):
+        self.assertEqual(compare_gdf(self.original, self.original.copy(), "node"), [])
+
+    def test_create_modify_delete(self):
+        edited = nodes_gdf([
+            (1, "Main St", 2, (0, 0)),
+            (2, "High St", 3, (10, 0)),
+            (4, "Elm St", 1, (30, 0)),
+        ])
+        self.assertEqual(self.changes_by_action(edited), {"create": [4], "modify": [2], "delete": [3]})
+
+        created = next(c for c in compare_gdf(self.original, edited, "node") if c["action"] == "create")
+        self.assertEqual(created["type"], "node")
+        self.assertEqual(created["data"]["geometry"], {"type": "Point", "coordinates": (30.0, 0.0)})
+        self.assertEqual(created["data"]["properties"], {"name": "Elm St", "lanes": 1})
+
+    def test_text_column_change_is_a_modification(self):
+        edited = nodes_gdf([
+            (1, "Main Street", 2, (0, 0)),
+            (2, "High St", 2, (10, 0)),
+            (3, "Oak Ave", 1, (20, 0)),
+        ])
+        self.assertEqual(self.changes_by_action(edited), {"create": [], "modify": [1], "delete": []})
+
+    def test_numeric_and_geometry_changes_within_tolerance_are_ignored(self):
+        edited = nodes_gdf([
+            (1, "Main St", 2.001, (0.001, 0)),
+            (2, "High St", 2, (10, 0)),
+            (3, "Oak Ave", 1, (20, 0.5)),
+        ])
+        self.assertEqual(self.changes_by_action(edited), {"create": [], "modify": [3], "delete": []})
+
+    def test_missing_value_differs_from_a_present_one(self):
+        edited = self.original.copy()
+        edited["name"] = edited["name"].astype(object)
+        edited.loc[edited["node_id"] == 2, "name"] = None
+        self.assertEqual(self.changes_by_action(edited), {"create": [], "modify": [2], "delete": []})
+
+    def test_invalid_element_type(self):
+        with self.assertRaises(Exception):
+            compare_gdf(self.original, self.original, "way")
+
+############################## Lookup ##############################
+
+class NormalizeKeysTests(SimpleTestCase):
+    def test_integral_numbers_lose_their_decimals(self):
+        self.assertEqual(normalize_keys([5, 5.0, "5", " 7 ", 12345678901]).tolist(), ["5", "5", "5", "7", "12345678901"])
+
+    def test_other_values_are_stripped_strings(self):
+        self.assertEqual(normalize_keys(["5.5", 5.5, " abc ", "N12"]).tolist(), ["5.5", "5.5", "abc", "N12"])
+
+    def test_missing_values_stay_none(self):
+        self.assertEqual(normalize_keys([None, np.nan, pd.NA, 3]).tolist(), [None, None, None, "3"])
+
+    def test_index_is_reset(self):
+        keys = normalize_keys(pd.Series([1.0, 2.0], index=[10, 20]))
+        self.assertEqual(list(keys.index), [0, 1])
+
+############################## Promoted Columns ##############################
+
+class PromotedValuesTests(SimpleTestCase):
+    def test_values_are_typed(self):
+        self.assertEqual(
+            promoted_values({"a": 1, "b": "2", "facility_type": 3.0, "lanes": " 2 ", "capacity": "1800.5"}, "link"),
+            {"a": 1, "b": 2, "facility_type": 3, "lanes": 2, "capacity": 1800.5},
+        )
+        self.assertEqual(promoted_values({"n": 101}, "node"), {"n": 101})
+
+    def test_first_present_source_wins(self):
+        self.assertEqual(promoted_values({"ft": 5, "facility_t": 4}, "link")["facility_type"], 4)
+        self.assertEqual(promoted_values({"capacity": None, "cap": 900}, "link")["capacity"], 900.0)
+
+    def test_values_that_do_not_fit_become_none(self):
+        for value in ["abc", "1e3", "nan", "inf", "+5", "1_000", "5.5", True, [1], {"n": 1}, float("nan"), ""]:
+            with self.subTest(value=value):
+                self.assertIsNone(promoted_values({"n": value}, "node")["n"])
+        for value in ["nan", "inf", "-inf", "1_000", "abc", False]:
+            with self.subTest(value=value):
+                self.assertIsNone(promoted_values({"capacity": value}, "link")["capacity"])
+
+    def test_numbers_follow_the_sql_pattern(self):
+        self.assertEqual(promoted_values({"n": "5.00"}, "node")["n"], 5)
+        self.assertEqual(promoted_values({"capacity": "1e3"}, "link")["capacity"], 1000.0)
+        self.assertEqual(promoted_values({"capacity": ".5"}, "link")["capacity"], 0.5)
+        self.assertIsNone(promoted_values({"n": 10 ** 19}, "node")["n"])
+
+    def test_frame_matches_values(self):
+        rows = [{"n": 1}, {"n": "2.0"}, {"n": "1e3"}, {"n": None}, {"n": "x"}, {"n": True}]
+        frame = promoted_frame(pd.DataFrame(rows), "node")
+        self.assertEqual(str(frame["n"].dtype), "Int64")
+        self.assertEqual(
+            [None if pd.isna(v) else int(v) for v in frame["n"]],
+            [promoted_values(row, "node")["n"] for row in rows],
+        )
+
+############################## Netchange Parsing ##############################
+
+class FakeUpload:
+    def __init__(self, body):
+        self.stream = io.BytesIO(body)
+
+NETCHANGE = {
+    "changeset": {"pid": "P-1", "comment": "widen Main St"},
+    "operations": [
+        {"id": 1, "type": "link", "action": "modify", "data": {"properties": {"lanes": 3}}},
+        {"id": 2, "type": "node", "action": "delete", "data": {}},
+    ],
+}
+
+class IterNetchangeTests(SimpleTestCase):
+    def parse(self, body):
+        return list(iter_netchange(open_netchange_stream(FakeUpload(body))))
+
+    def test_changeset_then_operations(self):
+        items = self.parse(json.dumps(NETCHANGE).encode())
+        self.assertEqual(items, [("changeset", NETCHANGE["changeset"])] + [("operation", op) for op in NETCHANGE["operations"]])
+
+    def test_gzip_body_is_recognized_by_its_magic_bytes(self):
+        body = json.dumps(NETCHANGE).encode()
+        self.assertEqual(self.parse(gzip.compress(body)), self.parse(body))
+
+    def test_null_changeset(self):
+        self.assertEqual(self.parse(b'{"changeset": null, "operations": []}'), [("changeset", {})])
+
+    def test_operations_before_changeset(self):
+        body = json.dumps({"operations": NETCHANGE["operations"], "changeset": NETCHANGE["changeset"]}).encode()
+        with self.assertRaises(NetChangeFormatError):
+            self.parse(body)
+
+    def test_missing_changeset(self):
+        with self.assertRaises(NetChangeFormatError):
+            self.parse(b'{"operations": []}')
+
+    def test_operation_must_be_an_object(self):
+        with self.assertRaises(NetChangeFormatError):
+            self.parse(b'{"changeset": {}, "operations": [1]}')
+
+    def test_malformed_json(self):
+        for body in [b'{"changeset": {}, "operations": [{"id": 1}', b"not json", gzip.compress(b'{"changeset": {')]:
+            with self.subTest(body=body), self.assertRaises(NetChangeFormatError):
+                self.parse(body)
+
+############################## Tile Batches ##############################
+
+class ParseTileListTests(SimpleTestCase):
+    def test_lists_and_strings(self):
+        self.assertEqual(parse_tile_list([[3, 1, 2], "4/15/0", ["0", "0", "0"]], 10), [(3, 1, 2), (4, 15, 0), (0, 0, 0)])
+
+    def test_duplicates_are_dropped_in_order(self):
+        self.assertEqual(parse_tile_list(["2/1/1", [1, 0, 0], [2, 1, 1]], 10), [(2, 1, 1), (1, 0, 0)])
+
+    def test_invalid_lists(self):
+        for tiles in [None, [], "1/0/0", {"z": 1}, [[1, 0, 0]] * 11]:
+            with self.subTest(tiles=tiles), self.assertRaises(ValueError):
+                parse_tile_list(tiles, 10)
+
+    def test_invalid_tiles(self):
+        for tile in ["1/0", [1, 0], [1, 0, 0, 0], "a/b/c", None, [2, 4, 0], [2, 0, -1], [25, 0, 0], "-1/0/0"]:
+            with self.subTest(tile=tile), self.assertRaises(ValueError):
+                parse_tile_list([tile], 10)
+
+class TileBatchEncodingTests(SimpleTestCase):
+    def test_round_trip(self):
+        tiles = [(14, 4500, 6100, b"\x1a\x02mvt"), (0, 0, 0, b""), (24, 2 ** 24 - 1, 0, os.urandom(300))]
+        data = encode_tile_batch(tiles)
+        self.assertEqual(len(data), 3 * TILE_RECORD.size + 5 + 300)
+        self.assertEqual(decode_tile_batch(data), tiles)
+        self.assertEqual(decode_tile_batch(memoryview(data)), tiles)
+
+    def test_empty_batch(self):
+        self.assertEqual(encode_tile_batch([]), b"")
+        self.assertEqual(decode_tile_batch(b""), [])
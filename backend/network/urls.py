@@ -3,7 +3,9 @@ from rest_framework.routers import DefaultRouter
 from .views import (SignupView, BaseNetworkUploadView, NetChangeUploadView, 
                     BaseNetworkChangesetsView, ChangesetAncestryTreeView,
                     MVTNetworkTileView, ValidateTilesView, UserProfileView, 
-                    ToChangeFileView, NetworkExportView)
+                    ToChangeFileView, NetworkExportView, TileCacheStatsView,
+                    MetricsView, MetricsProfileView, TileBatchView,
+                    JobSubmitView, JobStatusView, JobResultView)
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.conf import settings
 from django.conf.urls.static import static
@@ -23,11 +25,20 @@ urlpatterns = [
     path("api/base-upload/", BaseNetworkUploadView.as_view(), name="base_network_upload"),
 
     path("api/tiles/<int:z>/<int:x>/<int:y>.mvt", MVTNetworkTileView.as_view(), name="network_mvt_tile"),
+    path("api/tiles/batch/", TileBatchView.as_view(), name="network_tile_batch"),
     path("api/tiles-validate", ValidateTilesView.as_view(), name="tiles_validate"),
+    path("api/tiles/cache-stats/", TileCacheStatsView.as_view(), name="tile_cache_stats"),
+
+    path("api/metrics/", MetricsView.as_view(), name="metrics"),
+    path("api/metrics/profiles/<str:profile_id>/", MetricsProfileView.as_view(), name="metrics_profile"),
 
     path("api/network-export/", NetworkExportView.as_view(), name="network_export"),
     path("api/to-netchange/", ToChangeFileView.as_view(), name="to_netchange"),
     path("api/netchange-upload/", NetChangeUploadView.as_view(), name="netchange_upload"),
+
+    path("api/jobs/<int:job_id>/", JobStatusView.as_view(), name="job_status"),
+    path("api/jobs/<int:job_id>/result/", JobResultView.as_view(), name="job_result"),
+    path("api/jobs/<str:kind>/", JobSubmitView.as_view(), name="job_submit"),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,29 @@
+import hashlib
+
+from django.core.cache import caches
+
+from network.models import Changeset
+from network.utils.scripts import detect_conflicts
+
+############################## Conflict Verdicts ##############################
+
+# A verdict is stored under the sorted changeset ids alone. A changeset's versions and dependencies are only
+# written in the transaction that creates it, so the verdict of a set of ids never changes and needs no
+# invalidation; every process (gunicorn workers, run_jobs) may cache it on its own.
+
+def get_conflicts(project_ids):
+    '''
+    detect_conflicts() for the project changesets `project_ids`, memoized per set of ids.
+    Only a miss loads the changesets and runs the conflict query.
+    '''
+    changeset_ids = sorted({int(i) for i in project_ids})
+    if len(changeset_ids) < 2:
+        return []
+
+    cache = caches["conflicts"]
+    key = "conflicts:" + hashlib.md5(",".join(str(i) for i in changeset_ids).encode()).hexdigest()
+    conflicts = cache.get(key)
+    if conflicts is None:
+        conflicts = detect_conflicts(Changeset.objects.filter(id__in=changeset_ids))
+        cache.set(key, conflicts, None)
+    return conflicts
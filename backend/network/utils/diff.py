@@ -0,0 +1,151 @@
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import mapping
+
+from network.utils.metrics import timed
+
+# Columns never compared between the reference network and an uploaded one
+DIFF_IGNORE = ['geometry','geometrysou','geometrysource','x','y','dist','changeset_id','created_at','node_id','active','version']
+
+ID_COLUMNS = {
+    "node": "node_id",
+    "link": "link_id",
+}
+
+############################## Masks ##############################
+
+def attribute_diff_mask(orig, edit, rtol=1e-2, atol=1e-2):
+    '''
+    Boolean array, True where a row of `edit` differs from the aligned row of `orig` in any column.
+    Values that are numeric on both sides are compared with tolerance, other values as strings.
+    Missing values are equal to each other only.
+    '''
+    changed = np.zeros(len(orig), dtype=bool)
+    for col in orig.columns:
+        a = orig[col].to_numpy()
+        b = edit[col].to_numpy()
+        a_null = pd.isna(a)
+        b_null = pd.isna(b)
+
+        a_num = pd.to_numeric(orig[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        b_num = pd.to_numeric(edit[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        numeric = ~np.isnan(a_num) & ~np.isnan(b_num)
+
+        diff = a_null != b_null
+        diff[numeric] |= ~np.isclose(a_num[numeric], b_num[numeric], rtol=rtol, atol=atol)
+
+        # Anything else present on both sides is compared as text
+        text = ~numeric & ~a_null & ~b_null
+        if text.any():
+            diff[text] |= orig[col].to_numpy()[text].astype(str) != edit[col].to_numpy()[text].astype(str)
+
+        changed |= diff
+    return changed
+
+def geometry_diff_mask(orig_geoms, edit_geoms, tolerance=1e-2):
+    '''
+    Boolean array, True where geometries differ. Byte-identical WKB is accepted without
+    touching coordinates; only the remaining pairs are compared with equals_exact(tolerance).
+    '''
+    orig_geoms = np.asarray(orig_geoms, dtype=object)
+    edit_geoms = np.asarray(edit_geoms, dtype=object)
+    same_wkb = shapely.to_wkb(orig_geoms) == shapely.to_wkb(edit_geoms)
+
+    changed = ~same_wkb
+    if changed.any():
+        changed[changed] = ~shapely.equals_exact(orig_geoms[changed], edit_geoms[changed], tolerance=tolerance)
+    return changed
+
+############################## Change Records ##############################
+
+def _is_missing(value):
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and value != value)
+
+def geometries_to_dicts(geoms):
+    '''GeoJSON-like {"type", "coordinates"} of every geometry, splitting one coordinate array for points and linestrings.'''
+    geoms = np.asarray(geoms, dtype=object)
+    type_ids = shapely.get_type_id(geoms)
+    include_z = bool(shapely.has_z(geoms).any())
+    coords, index = shapely.get_coordinates(geoms, include_z=include_z, return_index=True)
+    counts = np.bincount(index, minlength=len(geoms))
+    parts = np.split(coords, np.cumsum(counts)[:-1])
+
+    dicts = []
+    for geom, type_id, part in zip(geoms, type_ids, parts):
+        if geom is None:
+            dicts.append(None)
+        elif type_id == 0 and len(part):
+            dicts.append({"type": "Point", "coordinates": tuple(part[0].tolist())})
+        elif type_id == 1:
+            dicts.append({"type": "LineString", "coordinates": [tuple(c) for c in part.tolist()]})
+        else:
+            geo = mapping(geom)
+            dicts.append({"type": geo["type"], "coordinates": geo["coordinates"]})
+    return dicts
+
+def change_records(ids, rows, element_type, action):
+    '''Change dicts for the rows of a GeoDataFrame, built column-wise. Missing properties are left out.'''
+    geometries = geometries_to_dicts(rows.geometry.values)
+    properties = rows.drop(columns="geometry").to_dict("records")
+    return [
+        {
+            "id": obj_id,
+            "type": element_type,
+            "action": action,
+            "data": {
+                "geometry": geometry,
+                "properties": {k: v for k, v in props.items() if not _is_missing(v)}
+            }
+        }
+        for obj_id, geometry, props in zip(ids, geometries, properties)
+    ]
+
+############################## Diff ##############################
+
+@timed("compare_gdf", rows=len)
+def compare_gdf(original, edited, element_type, ignore=DIFF_IGNORE, geom_tol=1e-2, attr_tol=1e-2, timings=None):
+    '''
+    Changes turning the reference network `original` into the uploaded `edited`, as netchange operations.
+    Rows are matched on node_id/link_id: ids only in `edited` are created, ids only in `original` deleted,
+    and shared ids are modified when an attribute or the geometry differs beyond tolerance.
+    `timings`, when a dict, receives the seconds spent per stage.
+    '''
+    if element_type not in ID_COLUMNS:
+        raise Exception(f"Invalid element_type {element_type}. Use 'node' or 'link'.")
+    id_col = ID_COLUMNS[element_type]
+    timings = {} if timings is None else timings
+    t0 = time.perf_counter()
+
+    # Rows (ids)
+    orig_ids = original[id_col].to_numpy()
+    edit_ids = edited[id_col].to_numpy()
+    in_orig = np.isin(edit_ids, orig_ids)
+    deleted_ids = np.unique(orig_ids[~np.isin(orig_ids, edit_ids)])
+
+    # Align shared ids: one reference row per edited row
+    edit_shared = edited[in_orig].drop_duplicates(subset=id_col)
+    orig_shared = original.drop_duplicates(subset=id_col).set_index(id_col).loc[edit_shared[id_col].to_numpy()]
+    timings["ids"] = time.perf_counter() - t0
+
+    # Cols (fields)
+    cols = [c for c in edit_shared.columns if c in orig_shared.columns and c not in set(ignore)]
+    t0 = time.perf_counter()
+    modified = attribute_diff_mask(orig_shared[cols], edit_shared[cols], rtol=attr_tol, atol=attr_tol)
+    timings["attributes"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    modified |= geometry_diff_mask(orig_shared.geometry.values, edit_shared.geometry.values, tolerance=geom_tol)
+    timings["geometry"] = time.perf_counter() - t0
+
+    # Changes
+    t0 = time.perf_counter()
+    created_rows = edited[~in_orig]
+    modified_rows = edit_shared[modified]
+    changes = change_records(created_rows[id_col].tolist(), created_rows.drop(columns=id_col), element_type, "create")
+    changes += [{"id": obj_id, "type": element_type, "action": "delete", "data": {}} for obj_id in deleted_ids.tolist()]
+    changes += change_records(modified_rows[id_col].tolist(), modified_rows.drop(columns=id_col), element_type, "modify")
+    timings["emit"] = time.perf_counter() - t0
+    return changes
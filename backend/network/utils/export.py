@@ -0,0 +1,337 @@
+import os
+import json
+import tempfile
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pyogrio
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import CRS
+
+from django.db import connection, transaction
+from django.conf import settings
+
+from network.utils.resolved import get_resolved_network, resolved_network_sql
+from network.utils.jobs import job_dir, no_progress
+from network.utils.metrics import span
+from network.utils.promoted import PROMOTED_COLUMNS
+from network.utils.zipstream import stream_zip
+SRID = settings.USE_SRID
+
+# Rows fetched from the server-side cursor and written to the output per batch
+EXPORT_BATCH_ROWS = 50_000
+
+# Fixed columns of each layer, ids then the promoted attribute columns. An attribute with the name of a promoted column
+# is exported through that column, or in its place as text when some of its values do not fit the column type.
+LAYER_COLUMNS = {
+    "nodes": ["id", "node_id"] + list(PROMOTED_COLUMNS["node"]),
+    "links": ["id", "link_id", "f_node_id", "t_node_id"] + list(PROMOTED_COLUMNS["link"]),
+}
+
+# Type of each fixed column, as found by attribute_schema() for attributes
+LAYER_COLUMN_TYPES = {
+    "nodes": {c: PROMOTED_COLUMNS["node"].get(c, "integer") for c in LAYER_COLUMNS["nodes"]},
+    "links": {c: PROMOTED_COLUMNS["link"].get(c, "integer") for c in LAYER_COLUMNS["links"]},
+}
+
+# Output dtype of each attribute type found by attribute_schema()
+ATTRIBUTE_DTYPES = {
+    "integer": "Int64",
+    "number": "float64",
+    "boolean": "boolean",
+    "string": object,
+}
+
+ATTRIBUTE_ARROW_TYPES = {
+    "integer": pa.int64(),
+    "number": pa.float64(),
+    "boolean": pa.bool_(),
+    "string": pa.string(),
+}
+
+GEOMETRY_TYPES = {
+    "nodes": "Point",
+    "links": "LineString",
+}
+
+ATTRIBUTE_CASTS = {
+    "integer": "::bigint",
+    "number": "::double precision",
+    "boolean": "::boolean",
+    "string": "",
+}
+
+def _layer_sql(resolved_network_id, layer, columns, active_only=True):
+    nodes_sql, links_sql = resolved_network_sql(resolved_network_id, active_only, node_columns=columns, link_columns=columns)
+    return nodes_sql if layer == "nodes" else links_sql
+
+def _quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+############################## Attribute Schema ##############################
+
+def _promoted(layer):
+    return PROMOTED_COLUMNS["node" if layer == "nodes" else "link"]
+
+def unfit_promoted_keys(resolved_network_id, layer, keys, active_only=True):
+    '''
+    Attribute keys named like a promoted column that hold values the column could not take (e.g. a text N),
+    which would otherwise be lost from the export.
+    '''
+    keys = [key for key in keys if key in _promoted(layer)]
+    if not keys:
+        return []
+    sql = _layer_sql(resolved_network_id, layer, ", ".join(["v.attributes"] + [f"v.{key}" for key in keys]), active_only)
+    flags = ", ".join(f"coalesce(bool_or(v.{key} IS NULL AND v.attributes->>{_quote_literal(key)} IS NOT NULL), false)" for key in keys)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {flags} FROM ({sql}) v")
+        return [key for key, unfit in zip(keys, cursor.fetchone()) if unfit]
+
+def attribute_schema(resolved_network_id, layer, active_only=True):
+    '''
+    [(key, type)] of the attributes of a layer, discovered in SQL over every exported row.
+    type is "integer", "number", "boolean" or "string"; keys holding mixed types are exported as strings.
+    Keys of promoted columns are left to the fixed columns unless unfit_promoted_keys() lists them.
+    '''
+    sql = _layer_sql(resolved_network_id, layer, "v.attributes", active_only)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT e.key,
+                   array_agg(DISTINCT jsonb_typeof(e.value)) FILTER (WHERE jsonb_typeof(e.value) <> 'null'),
+                   bool_and(jsonb_typeof(e.value) <> 'number' OR e.value::text ~ '^-?[0-9]{{1,18}}$')
+            FROM ({sql}) v, jsonb_each(v.attributes) e
+            GROUP BY e.key
+            ORDER BY e.key
+        """)
+        rows = cursor.fetchall()
+
+    schema = [(key, "string") for key in unfit_promoted_keys(resolved_network_id, layer, [r[0] for r in rows], active_only)]
+    for key, types, integral in rows:
+        if key in LAYER_COLUMNS[layer] or key == "geometry":
+            continue
+        types = types or []
+        if types == ["number"]:
+            schema.append((key, "integer" if integral else "number"))
+        elif types == ["boolean"]:
+            schema.append((key, "boolean"))
+        else:
+            schema.append((key, "string"))
+    return schema
+
+def layer_columns(layer, schema):
+    '''Fixed columns of a layer, less the promoted columns `schema` exports as text.'''
+    keys = {key for key, _ in schema}
+    return [c for c in LAYER_COLUMNS[layer] if c not in keys]
+
+def layer_column_types(layer, schema):
+    columns = layer_columns(layer, schema)
+    return {c: kind for c, kind in LAYER_COLUMN_TYPES[layer].items() if c in columns}
+
+def export_sql(resolved_network_id, layer, schema, active_only=True):
+    '''
+    SQL selecting the fixed columns, one column per attribute of `schema` and the geometry as WKB, in that order.
+    Ids and promoted attributes are plain columns; only the remaining attributes are read from the JSON, and a
+    promoted column exported as text falls back to its attribute where the column is NULL.
+    '''
+    columns = [f"v.{c}" for c in layer_columns(layer, schema)]
+    for key, kind in schema:
+        if key in _promoted(layer):
+            columns.append(f"coalesce(v.{key}::text, v.attributes->>{_quote_literal(key)})")
+        else:
+            columns.append(f"(v.attributes->>{_quote_literal(key)}){ATTRIBUTE_CASTS[kind]}")
+    columns.append("ST_AsBinary(v.geometry)")
+    return _layer_sql(resolved_network_id, layer, ", ".join(columns), active_only)
+
+############################## Batches ##############################
+
+def iter_export_batches(resolved_network_id, layer, schema, batch_rows=EXPORT_BATCH_ROWS, active_only=True):
+    '''
+    Yields the layer as GeoDataFrames of at most `batch_rows` rows, read through a server-side cursor.
+    Every batch has the same columns and dtypes, whatever values it happens to contain.
+    '''
+    names = layer_columns(layer, schema) + [key for key, _ in schema]
+    dtypes = {key: ATTRIBUTE_DTYPES[kind] for key, kind in layer_column_types(layer, schema).items()}
+    dtypes.update({key: ATTRIBUTE_DTYPES[kind] for key, kind in schema})
+
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(export_sql(resolved_network_id, layer, schema, active_only))
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+
+            df = pd.DataFrame.from_records(rows, columns=names + ["geometry"])
+            wkb = np.array([bytes(g) if g is not None else None for g in df.pop("geometry")], dtype=object)
+            df = df.astype(dtypes)
+            yield gpd.GeoDataFrame(df, geometry=shapely.from_wkb(wkb), crs=f"EPSG:{SRID}")
+
+def read_layer(resolved_network_id, layer, active_only=True, batch_rows=EXPORT_BATCH_ROWS):
+    '''The whole layer as one GeoDataFrame with typed columns, e.g. the reference network of a diff.'''
+    schema = attribute_schema(resolved_network_id, layer, active_only)
+    batches = list(iter_export_batches(resolved_network_id, layer, schema, batch_rows, active_only))
+    if not batches:
+        names = layer_columns(layer, schema) + [key for key, _ in schema]
+        return gpd.GeoDataFrame(columns=names, geometry=[], crs=f"EPSG:{SRID}")
+    return pd.concat(batches, ignore_index=True)
+
+def write_layer(resolved_network_id, layer, path, driver, batch_rows=EXPORT_BATCH_ROWS, progress=no_progress):
+    '''Writes a layer batch by batch, appending to the file created by the first batch. Returns the row count.'''
+    with span(f"export.{layer}") as s:
+        schema = attribute_schema(resolved_network_id, layer)
+        total = 0
+        for gdf in iter_export_batches(resolved_network_id, layer, schema, batch_rows):
+            pyogrio.write_dataframe(gdf, path, layer=layer, driver=driver, append=total > 0)
+            total += len(gdf)
+            progress(f"export {layer}", message=f"{total} rows")
+        s.rows = total
+    return total
+
+############################## Arrow ##############################
+
+def arrow_schema(layer, schema):
+    '''
+    Arrow schema of a layer: typed fixed columns and attributes and a WKB geometry column tagged
+    as geoarrow.wkb, with the GeoParquet "geo" metadata on the schema.
+    '''
+    crs = CRS.from_epsg(SRID).to_json_dict()
+    fields = [pa.field(c, ATTRIBUTE_ARROW_TYPES[kind]) for c, kind in layer_column_types(layer, schema).items()]
+    fields += [pa.field(key, ATTRIBUTE_ARROW_TYPES[kind]) for key, kind in schema]
+    fields.append(pa.field("geometry", pa.binary(), metadata={
+        "ARROW:extension:name": "geoarrow.wkb",
+        "ARROW:extension:metadata": json.dumps({"crs": crs}),
+    }))
+    geo = {
+        "version": "1.0.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": {"encoding": "WKB", "geometry_types": [GEOMETRY_TYPES[layer]], "crs": crs}},
+    }
+    return pa.schema(fields, metadata={"geo": json.dumps(geo)})
+
+def iter_record_batches(resolved_network_id, layer, schema, batch_rows=EXPORT_BATCH_ROWS):
+    '''
+    Yields the layer as Arrow record batches read through a server-side cursor. Geometries stay
+    as the WKB returned by PostGIS and attributes go straight from the rows into typed arrays.
+    '''
+    batch_schema = arrow_schema(layer, schema)
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(export_sql(resolved_network_id, layer, schema))
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            columns = zip(*rows)
+            arrays = [pa.array(values, type=field.type) for values, field in zip(columns, batch_schema)]
+            yield pa.RecordBatch.from_arrays(arrays, schema=batch_schema)
+
+def write_arrow_layer(resolved_network_id, layer, path, file_format, batch_rows=EXPORT_BATCH_ROWS, progress=no_progress):
+    '''Writes a layer as GeoParquet ("parquet") or an Arrow IPC file ("arrow"). Returns the row count.'''
+    with span(f"export.{layer}") as s:
+        schema = attribute_schema(resolved_network_id, layer)
+        batch_schema = arrow_schema(layer, schema)
+        total = 0
+        if file_format == "parquet":
+            writer = pq.ParquetWriter(path, batch_schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_file(path, batch_schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+        with writer:
+            for batch in iter_record_batches(resolved_network_id, layer, schema, batch_rows):
+                writer.write_batch(batch)
+                total += batch.num_rows
+                progress(f"export {layer}", message=f"{total} rows")
+        s.rows = total
+    return total
+
+############################## Formats ##############################
+
+def write_shp(resolved_network_id, tmpdir, batch_rows=EXPORT_BATCH_ROWS, progress=no_progress):
+    members = []
+    for layer in ["nodes", "links"]:
+        path = os.path.join(tmpdir, f"{layer}.shp")
+        if write_layer(resolved_network_id, layer, path, "ESRI Shapefile", batch_rows, progress):
+            for ext in [".shp", ".shx", ".dbf", ".prj", ".cpg"]:
+                if os.path.exists(path.replace(".shp", ext)):
+                    members.append((f"{layer}{ext}", path.replace(".shp", ext)))
+    return members
+
+def write_gdb(resolved_network_id, tmpdir, batch_rows=EXPORT_BATCH_ROWS, progress=no_progress):
+    gdb_path = os.path.join(tmpdir, "network.gdb")
+    for layer in ["nodes", "links"]:
+        write_layer(resolved_network_id, layer, gdb_path, "OpenFileGDB", batch_rows, progress)
+
+    members = []
+    for root, dirs, files in os.walk(gdb_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            # Keep relative path to preserve folder structure inside the zip
+            members.append((os.path.relpath(file_path, start=tmpdir), file_path))
+    return members
+
+def write_parquet(resolved_network_id, tmpdir, batch_rows=EXPORT_BATCH_ROWS, progress=no_progress):
+    members = []
+    for layer in ["nodes", "links"]:
+        path = os.path.join(tmpdir, f"{layer}.parquet")
+        write_arrow_layer(resolved_network_id, layer, path, "parquet", batch_rows, progress)
+        members.append((f"{layer}.parquet", path))
+    return members
+
+def write_arrow(resolved_network_id, tmpdir, batch_rows=EXPORT_BATCH_ROWS, progress=no_progress):
+    members = []
+    for layer in ["nodes", "links"]:
+        path = os.path.join(tmpdir, f"{layer}.arrow")
+        write_arrow_layer(resolved_network_id, layer, path, "arrow", batch_rows, progress)
+        members.append((f"{layer}.arrow", path))
+    return members
+
+EXPORT_FORMATS = {
+    "shp": write_shp,
+    "gdb": write_gdb,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
+
+def write_network_export(resolved_network_id, output_format, batch_rows=EXPORT_BATCH_ROWS, progress=no_progress):
+    '''
+    Writes the layers of a ResolvedNetwork into a new temporary directory, in batches, so memory is bounded by
+    `batch_rows` rather than by the network size. Returns (TemporaryDirectory, zip members) for stream_export_zip().
+    Errors are raised here, before a response streams anything.
+    '''
+    tmpdir = tempfile.TemporaryDirectory()
+    try:
+        return tmpdir, EXPORT_FORMATS[output_format](resolved_network_id, tmpdir.name, batch_rows, progress)
+    except Exception:
+        tmpdir.cleanup()
+        raise
+
+def stream_export_zip(tmpdir, members, progress=no_progress):
+    '''
+    Yields the zip of the members written by write_network_export() in chunks and removes the directory once
+    the response is consumed or the client disconnects (or when it is garbage-collected if never read).
+    '''
+    with tmpdir:
+        progress("zip")
+        yield from stream_zip(members)
+
+def stream_network_export(resolved_network_id, output_format, batch_rows=EXPORT_BATCH_ROWS, progress=no_progress):
+    '''Yields the zipped export of a ResolvedNetwork in chunks: write_network_export() then stream_export_zip().'''
+    tmpdir, members = write_network_export(resolved_network_id, output_format, batch_rows, progress)
+    yield from stream_export_zip(tmpdir, members, progress)
+
+def run_network_export_job(job, progress):
+    output_format = job.params.get("output_format")
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"output_format '{output_format}' not supported. use one of: {', '.join(EXPORT_FORMATS)}.")
+    project_ids = [int(pid) for pid in job.params.get("project_changeset_ids") or []]
+
+    progress("resolve")
+    resolved = get_resolved_network([int(job.params["base_changeset_id"])] + project_ids)
+
+    result_file = f"network_{output_format}.zip"
+    size = 0
+    with open(os.path.join(job_dir(job.id), result_file), "wb") as f:
+        for chunk in stream_network_export(resolved.id, output_format, progress=progress):
+            f.write(chunk)
+            size += len(chunk)
+    return {"bytes": size}, result_file
@@ -1,41 +1,95 @@
-import os, tempfile, subprocess
-import geopandas as gpd
-# from network.models import NodeVersion, LinkVersion
-# from .scripts import queryset_to_gdf
-import pandas as pd
-from django.contrib.gis.db.models.functions import AsWKB
+import os
+import json
+
 from django.conf import settings
 
-def generate_base_mbtiles(base_changeset_id):
-    try:
-        # Query
-        # base_nodes = NodeVersion.objects.filter(changeset_id=base_changeset_id).annotate(geom_wkb=AsWKB("geometry"))
-        # base_links = LinkVersion.objects.filter(changeset_id=base_changeset_id).annotate(geom_wkb=AsWKB("geometry"))
-        
-        base_nodes=''
-        base_links=''
-
-        # gdf_nodes = queryset_to_gdf(base_nodes, geometry_field='geom_wkb', crs='EPSG:4326')
-        # gdf_links = queryset_to_gdf(base_links, geometry_field='geom_wkb', crs='EPSG:4326')
-        # gdf = gpd.GeoDataFrame(pd.concat([gdf_nodes, gdf_links]), crs="EPSG:4326")
-
-        geojson_path = os.path.join(settings.MEDIA_ROOT, 'networks', f"{base_changeset_id}.json")
-        gdf = gpd.read_file(geojson_path, engine='pyogrio')
-        gdf.to_crs("EPSG:4326").to_file(geojson_path, driver="GeoJSON", engine='pyogrio')
-
-        # mbtiles_path = os.path.join(settings.MEDIA_ROOT, 'tiles', f"{base_changeset_id}.mbtiles")
-        # mbtiles_path = os.path.join(r'C:\dgaldino\2025_06_TDM_NETWORK_VERSIONING_PLATFORM\tdm_nvp\backend\media\tiles', f"{base_changeset_id}.mbtiles")
-
-        # cmd = [
-        #     "docker", "run"
-        #     "-o", mbtiles_path,
-        #     "-l", "base_network",
-        #     "-Z", "6", "-z", "16",
-        #     "--drop-densest-as-needed",
-        #     geojson_path,
-        # ]
-
-        # subprocess.run(cmd, check=True)
-        # print(f"MBTiles written to: {mbtiles_path}")
-    except Exception as e:
-        print(e)
\ No newline at end of file
+from network.models import Changeset
+from network.utils.jobs import no_progress
+from network.utils.mbtiles import MBTiles
+from network.utils.metrics import StageTimer
+from network.utils.resolved import get_resolved_network
+from network.utils.tiles import render_tile, tile_has_features, changeset_bbox, bbox_to_tile_range, tile_settings_version
+
+BASE_MINZOOM = 6
+BASE_MAXZOOM = 16
+
+# Tiles written to the MBTiles file per transaction
+WRITE_BATCH = 500
+
+def base_mbtiles_path(base_changeset_id):
+    return os.path.join(settings.MEDIA_ROOT, 'tiles', f"{int(base_changeset_id)}.mbtiles")
+
+def get_base_mbtiles(base_changeset_id):
+    '''The finished pyramid of a base network, or None when it has not been generated (yet) or was rendered with other tile settings.'''
+    mbtiles = MBTiles(base_mbtiles_path(base_changeset_id))
+    if not mbtiles.exists() or mbtiles.metadata().get("tile_version") != tile_settings_version():
+        return None
+    return mbtiles
+
+def generate_base_mbtiles(base_changeset_id, minzoom=BASE_MINZOOM, maxzoom=BASE_MAXZOOM, progress=no_progress):
+    '''
+    Pre-renders the MVT pyramid of a base network into MEDIA_ROOT/tiles/<id>.mbtiles with
+    the same SQL as MVTNetworkTileView. Only the children of tiles that hold features are
+    visited, so empty parts of the extent cost one query per empty parent.
+    The pyramid is written to a temporary file and swapped in once complete.
+    '''
+    base = Changeset.objects.get(id=base_changeset_id, is_base_network=True)
+    bbox = changeset_bbox(base.id)
+    if bbox is None:
+        progress("done", 1, "no features, no tiles generated")
+        return None
+
+    resolved = get_resolved_network([base.id])
+
+    path = base_mbtiles_path(base.id)
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    mbtiles = MBTiles(tmp_path).create({
+        "name": f"base_network_{base.id}",
+        "type": "baselayer",
+        "minzoom": minzoom,
+        "maxzoom": maxzoom,
+        "bounds": ",".join(f"{v:.6f}" for v in bbox),
+        "auth_area": base.auth_area,
+        "tile_version": tile_settings_version(),
+        "json": json.dumps({"vector_layers": [
+            {"id": "links", "fields": {}, "minzoom": minzoom, "maxzoom": maxzoom},
+            {"id": "nodes", "fields": {}, "minzoom": minzoom, "maxzoom": maxzoom},
+        ]}),
+    })
+
+    xmin, xmax, ymin, ymax = bbox_to_tile_range(*bbox, minzoom)
+    level = [(x, y) for x in range(xmin, xmax + 1) for y in range(ymin, ymax + 1)]
+    total = 0
+    timer = StageTimer("base_tiles")
+
+    for z in range(minzoom, maxzoom + 1):
+        batch = []
+        children = []
+        for x, y in level:
+            tile_data = render_tile(z, x, y, resolved.id, base.auth_area)
+            if tile_data:
+                batch.append((z, x, y, bytes(tile_data)))
+            elif not tile_has_features(z, x, y, resolved.id):
+                continue
+            children.extend([(2 * x, 2 * y), (2 * x + 1, 2 * y), (2 * x, 2 * y + 1), (2 * x + 1, 2 * y + 1)])
+
+            if len(batch) >= WRITE_BATCH:
+                mbtiles.put_tiles(batch)
+                total += len(batch)
+                batch = []
+
+        mbtiles.put_tiles(batch)
+        total += len(batch)
+        timer.mark(f"z{z}", len(level))
+        progress(f"z{z}", (z - minzoom + 1) / (maxzoom - minzoom + 1), f"{total} tiles")
+        level = children
+
+    mbtiles.finalize()
+    os.replace(tmp_path, path)
+    return total
+
+def run_base_tiles_job(job, progress):
+    tiles = generate_base_mbtiles(int(job.params["base_changeset_id"]), progress=progress)
+    return {"tiles": tiles or 0}, None
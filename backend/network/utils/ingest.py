@@ -0,0 +1,232 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from django.db import connection
+from django.utils import timezone
+from django.conf import settings
+
+from network.utils.promoted import PROMOTED_COLUMNS, promoted_frame, promoted_values
+from network.utils.metrics import StageTimer
+SRID = settings.USE_SRID
+
+# Rows sent per COPY statement. Keeps the CSV buffer bounded for statewide networks.
+COPY_CHUNK_ROWS = 50_000
+
+############################## Bulk Helpers ##############################
+
+def reserve_ids(cursor, table, count):
+    '''
+    Reserves `count` primary keys from the table's id sequence in a single round trip.
+    The ids are consumed from the sequence, so concurrent inserts can never collide with them.
+    '''
+    if count == 0:
+        return np.empty(0, dtype=np.int64)
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+        [table, count]
+    )
+    return np.fromiter((r[0] for r in cursor.fetchall()), dtype=np.int64, count=count)
+
+def to_ewkb_hex(geometries, srid=SRID):
+    '''Vectorized hex EWKB (with SRID) for a GeoSeries/array, the text form COPY accepts for geometry columns.'''
+    geoms = shapely.set_srid(np.asarray(geometries, dtype=object), srid)
+    return shapely.to_wkb(geoms, hex=True, include_srid=True)
+
+def attributes_to_json(df):
+    '''Serializes every row of `df` into a JSON object string in one vectorized pass.'''
+    if df.shape[1] == 0:
+        return np.full(len(df), "{}", dtype=object)
+    records = df.to_json(orient="records", lines=True, date_format="iso", double_precision=15)
+    return np.array(records.splitlines(), dtype=object)
+
+def copy_rows(cursor, table, frame, chunk_rows=COPY_CHUNK_ROWS):
+    '''Streams `frame` into `table` with COPY ... FORMAT csv. Column names of `frame` must match the table.'''
+    columns = ", ".join(frame.columns)
+    sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    for start in range(0, len(frame), chunk_rows):
+        buf = io.StringIO()
+        frame.iloc[start:start + chunk_rows].to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        cursor.copy_expert(sql, buf)
+
+############################## Base Network Ingestion ##############################
+
+def ingest_base_network(changeset, gdf_nodes, gdf_links, progress=None):
+    '''
+    Writes a validated base network (nodes keyed by 'n', links keyed by 'a'/'b') under `changeset`.
+    Node and link ids are reserved in blocks and every table is loaded with COPY,
+    so the cost is a handful of statements regardless of network size.
+    Must be called inside a transaction. Returns the per-stage statistics.
+    `progress` is called after every stage (see utils/jobs.py).
+    '''
+    timer = StageTimer("ingest", progress)
+    created_at = timezone.now()
+
+    with connection.cursor() as cursor:
+        # Step 1: Reserve ids
+        node_ids = reserve_ids(cursor, "network_node", len(gdf_nodes))
+        link_ids = reserve_ids(cursor, "network_link", len(gdf_links))
+        timer.mark("reserve_ids", len(node_ids) + len(link_ids))
+
+        # Step 2: Resolve link endpoints from the reserved node ids
+        node_id_by_n = pd.Series(node_ids, index=gdf_nodes["n"].astype(str).values)
+        f_node_ids = gdf_links["a"].astype(str).map(node_id_by_n)
+        t_node_ids = gdf_links["b"].astype(str).map(node_id_by_n)
+        if f_node_ids.isna().any() or t_node_ids.isna().any():
+            raise ValueError("Links reference A/B values that are not present in the nodes shapefile.")
+
+        # Step 3: Build the version rows
+        node_rows = pd.DataFrame({
+            "node_id": node_ids,
+            "version": 1,
+            "active": True,
+            "geometry": to_ewkb_hex(gdf_nodes.geometry.values),
+            "is_valid": gdf_nodes.geometry.is_valid.values,
+            "attributes": attributes_to_json(gdf_nodes.drop(columns="geometry")),
+            "changeset_id": changeset.id,
+            "created_at": created_at,
+        })
+        node_rows = pd.concat([node_rows, promoted_frame(gdf_nodes, "node").reset_index(drop=True)], axis=1)
+        link_rows = pd.DataFrame({
+            "link_id": link_ids,
+            "version": 1,
+            "active": True,
+            "f_node_id": f_node_ids.values.astype(np.int64),
+            "t_node_id": t_node_ids.values.astype(np.int64),
+            "geometry": to_ewkb_hex(gdf_links.geometry.values),
+            "is_valid": gdf_links.geometry.is_valid.values,
+            "attributes": attributes_to_json(gdf_links.drop(columns="geometry")),
+            "changeset_id": changeset.id,
+            "created_at": created_at,
+        })
+        link_rows = pd.concat([link_rows, promoted_frame(gdf_links, "link").reset_index(drop=True)], axis=1)
+        timer.mark("build_rows", len(node_rows) + len(link_rows))
+
+        # Step 4: COPY
+        copy_rows(cursor, "network_node", pd.DataFrame({"id": node_ids}))
+        copy_rows(cursor, "network_nodeversion", node_rows)
+        timer.mark("copy_nodes", len(node_rows))
+
+        copy_rows(cursor, "network_link", pd.DataFrame({"id": link_ids}))
+        copy_rows(cursor, "network_linkversion", link_rows)
+        timer.mark("copy_links", len(link_rows))
+
+    return timer.stages
+
+############################## NetChange Apply ##############################
+
+VERSION_TABLES = {
+    "node": ("network_node", "network_nodeversion", "node_id"),
+    "link": ("network_link", "network_linkversion", "link_id"),
+}
+
+def _new_geometry(element, data):
+    '''Geometry of a create/modify operation: WKB from a binary netchange, otherwise GeoJSON-like coordinates.'''
+    if data.get("wkb") is not None:
+        return shapely.from_wkb(data["wkb"])
+    coordinates = data['geometry']['coordinates']
+    return shapely.Point(coordinates) if element == "node" else shapely.LineString(coordinates)
+
+def latest_versions(cursor, element, ids):
+    '''
+    DataFrame indexed by element id with the latest version of every id in `ids`, read in one query.
+    Geometries come back as hex EWKB and attributes as JSON text, ready to be copied into a new version.
+    '''
+    _, table, id_column = VERSION_TABLES[element]
+    columns = ["version", "geometry", "is_valid", "attributes"] + list(PROMOTED_COLUMNS[element])
+    if element == "link":
+        columns += ["f_node_id", "t_node_id"]
+    select = ", ".join(
+        "encode(ST_AsEWKB(geometry), 'hex')" if c == "geometry" else "attributes::text" if c == "attributes" else c
+        for c in columns
+    )
+    ids = sorted(set(ids))
+    if not ids:
+        return pd.DataFrame(columns=columns, index=pd.Index([], name=id_column, dtype=np.int64))
+    cursor.execute(f"""
+        SELECT DISTINCT ON ({id_column}) {id_column}, {select}
+        FROM {table}
+        WHERE {id_column} = ANY(%s)
+        ORDER BY {id_column}, version DESC
+    """, [ids])
+    latest = pd.DataFrame(cursor.fetchall(), columns=[id_column] + columns).set_index(id_column)
+
+    missing = sorted(set(ids) - set(latest.index))
+    if missing:
+        raise ValueError(f"Unknown {element} ids: {', '.join(map(str, missing[:20]))}{' ...' if len(missing) > 20 else ''}")
+    return latest
+
+def apply_netchange_operations(element, changeset, operations, node_id_by_n=None, progress=None):
+    '''
+    Writes the `element` ("node" or "link") operations of a netchange under `changeset`.
+    Created elements get ids reserved in one statement, the latest versions of modified and deleted
+    elements are read in one query, and all parents and versions are loaded with COPY, so the number
+    of statements does not grow with the netchange. Links resolve their A/B through `node_id_by_n`
+    ({n: node_id}, see utils/lookup.py referenced_node_ids).
+    Must be called inside a transaction. Returns the per-stage statistics.
+    '''
+    parent_table, table, id_column = VERSION_TABLES[element]
+    timer = StageTimer("netchange", progress)
+    created_at = timezone.now()
+
+    ops = [op for op in operations if op['type'] == element]
+    creates = [op for op in ops if op['action'] == 'create']
+    modifies = [op for op in ops if op['action'] == 'modify']
+    deletes = [op for op in ops if op['action'] == 'delete']
+    if not ops:
+        return timer.stages
+
+    with connection.cursor() as cursor:
+        # Step 1: New ids and the latest versions of the touched elements
+        new_ids = reserve_ids(cursor, parent_table, len(creates))
+        latest = latest_versions(cursor, element, [int(op['id']) for op in modifies + deletes])
+        timer.mark(f"{element}_lookup", len(new_ids) + len(latest))
+
+        # Step 2: Created and modified versions carry the uploaded geometry and properties
+        written = creates + modifies
+        modified_ids = [int(op['id']) for op in modifies]
+        properties = [{k.lower(): v for k, v in op['data']['properties'].items()} for op in written]
+        geometries = np.array([_new_geometry(element, op['data']) for op in written], dtype=object)
+        rows = pd.DataFrame({
+            id_column: np.concatenate([new_ids, np.array(modified_ids, dtype=np.int64)]),
+            "version": [1] * len(creates) + (latest.loc[modified_ids, "version"] + 1).tolist(),
+            "active": True,
+            "geometry": to_ewkb_hex(geometries),
+            "is_valid": shapely.is_valid(geometries),
+            "attributes": [json.dumps(props) for props in properties],
+        })
+        promoted = pd.DataFrame([promoted_values(props, element) for props in properties], columns=list(PROMOTED_COLUMNS[element]))
+        rows = pd.concat([rows, promoted], axis=1)
+        if element == "link":
+            rows["f_node_id"] = rows["a"].map(node_id_by_n)
+            rows["t_node_id"] = rows["b"].map(node_id_by_n)
+            unresolved = rows["f_node_id"].isna() | rows["t_node_id"].isna()
+            if unresolved.any():
+                first = rows[unresolved].iloc[0]
+                raise ValueError(f"Link A={first['a']} B={first['b']} references a node which is not in the network.")
+
+        # Step 3: Deleted versions copy the latest version, inactive
+        deleted = latest.loc[[int(op['id']) for op in deletes]].reset_index()
+        deleted["version"] += 1
+        deleted["active"] = False
+
+        # Integer columns stay integers in the CSV even with missing values
+        integer_columns = [c for c, kind in PROMOTED_COLUMNS[element].items() if kind == "integer"] + ["version"]
+        integer_columns += ["f_node_id", "t_node_id"] if element == "link" else []
+        dtypes = {c: "Int64" for c in integer_columns}
+        dtypes.update({c: "float64" for c, kind in PROMOTED_COLUMNS[element].items() if kind == "number"})
+        rows = pd.concat([rows.astype(dtypes), deleted[rows.columns].astype(dtypes)], ignore_index=True)
+        rows["changeset_id"] = changeset.id
+        rows["created_at"] = created_at
+        timer.mark(f"{element}_build_rows", len(rows))
+
+        # Step 4: COPY
+        copy_rows(cursor, parent_table, pd.DataFrame({"id": new_ids}))
+        copy_rows(cursor, table, rows)
+        timer.mark(f"{element}_copy", len(rows))
+
+    return timer.stages
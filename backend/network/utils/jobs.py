@@ -0,0 +1,152 @@
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.db import connection, connections, transaction, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django.conf import settings
+
+from network.models import Job
+
+# Job kinds and their handlers. A handler is called as handler(job, progress) and
+# returns (result, result_file): a JSON-able dict and an optional file name in the job directory.
+JOB_HANDLERS = {
+    "base_upload": "network.views.run_base_upload_job",
+    "to_netchange": "network.views.run_to_netchange_job",
+    "network_export": "network.utils.export.run_network_export_job",
+    "base_tiles": "network.utils.generate_base_tiles.run_base_tiles_job",
+}
+
+# Kinds only superusers may submit
+SUPERUSER_JOBS = {"base_upload", "base_tiles"}
+
+def job_dir(job_id):
+    return os.path.join(settings.JOB_ROOT, str(int(job_id)))
+
+def job_input_path(job, field):
+    '''Path of the file uploaded as `field` when the job was submitted, or None.'''
+    name = job.params.get("files", {}).get(field)
+    return os.path.join(job_dir(job.id), "input", name) if name else None
+
+def job_result_path(job):
+    return os.path.join(job_dir(job.id), job.result_file) if job.result_file else None
+
+############################## Submit ##############################
+
+def submit_job(kind, user=None, params=None, files=None):
+    '''
+    Queues a job. `files` maps field names to uploaded files, which are copied to the job
+    directory before the job becomes visible to workers.
+    '''
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'.")
+
+    with transaction.atomic():
+        job = Job.objects.create(kind=kind, user=user, params=dict(params or {}))
+        if files:
+            input_dir = os.path.join(job_dir(job.id), "input")
+            os.makedirs(input_dir, exist_ok=True)
+            job.params["files"] = {}
+            for field, uploaded in files.items():
+                name = os.path.basename(uploaded.name) or field
+                with open(os.path.join(input_dir, name), "wb") as f:
+                    for chunk in uploaded.chunks():
+                        f.write(chunk)
+                job.params["files"][field] = name
+            job.save(update_fields=["params"])
+    return job
+
+############################## Progress ##############################
+
+class JobProgress:
+    '''
+    Progress callback handed to job handlers: progress(stage, fraction=None, message="").
+    Updates go through a connection of their own, so they are visible while the handler
+    is still inside a transaction (e.g. a base network ingest).
+    '''
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._connection = None
+
+    def __call__(self, stage, fraction=None, message=""):
+        if self._connection is None:
+            self._connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        with self._connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE network_job SET stage = %s, progress = %s, message = %s, updated_at = now() WHERE id = %s",
+                [str(stage)[:100], fraction, message, self.job_id]
+            )
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def no_progress(stage, fraction=None, message=""):
+    '''Progress callback of work run inside a request.'''
+    pass
+
+############################## Workers ##############################
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def claim_job(kinds=None):
+    '''Marks the oldest queued job as running and returns it. Concurrent workers skip each other's rows.'''
+    with transaction.atomic():
+        queued = Job.objects.select_for_update(skip_locked=True).filter(status=Job.QUEUED)
+        if kinds:
+            queued = queued.filter(kind__in=kinds)
+        job = queued.order_by("created_at", "id").first()
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.started_at = timezone.now()
+        job.worker = worker_name()
+        job.save(update_fields=["status", "started_at", "worker", "updated_at"])
+    return job
+
+def run_job(job):
+    handler = import_string(JOB_HANDLERS[job.kind])
+    progress = JobProgress(job.id)
+    os.makedirs(job_dir(job.id), exist_ok=True)
+    try:
+        result, result_file = handler(job, progress)
+        job.status = Job.SUCCEEDED
+        job.result = result or {}
+        job.result_file = result_file or ""
+        job.stage = "done"
+        job.progress = 1
+        fields = ["status", "result", "result_file", "stage", "progress"]
+    except Exception as e:
+        traceback.print_exc()
+        job.status = Job.FAILED
+        job.error = str(e)
+        fields = ["status", "error"]
+    finally:
+        progress.close()
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=fields + ["finished_at", "updated_at"])
+    return job
+
+def run_next_job(kinds=None):
+    '''Claims and runs one job. Returns its id, or None when the queue is empty.'''
+    try:
+        job = claim_job(kinds)
+        if job is None:
+            return None
+        run_job(job)
+        return job.id
+    finally:
+        connection.close()
+
+def requeue_stale_jobs(minutes):
+    '''Puts back running jobs that have not reported progress for `minutes`, e.g. after a worker was killed.'''
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    return Job.objects.filter(status=Job.RUNNING, updated_at__lt=cutoff).update(
+        status=Job.QUEUED, worker="", started_at=None, updated_at=timezone.now()
+    )
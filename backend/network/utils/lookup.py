@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from django.core.cache import cache
+from django.db import connection
+
+from network.utils.resolved import resolved_network_sql
+from network.utils.promoted import promoted_values
+
+# Key maps are immutable per ResolvedNetwork (a changed network gets a new snapshot id)
+KEY_MAP_TIMEOUT = 60 * 60
+
+############################## Keys ##############################
+
+def normalize_keys(values):
+    '''
+    Cube-style keys as comparable strings: integral numbers lose their decimals (5, 5.0 and "5" all
+    become "5"), other values are stripped strings and missing values stay None.
+    '''
+    values = pd.Series(values).reset_index(drop=True)
+    numbers = pd.to_numeric(values, errors="coerce").astype("float64")
+    integral = np.isfinite(numbers) & (numbers == np.floor(numbers))
+
+    keys = values.astype(str).str.strip().astype(object)
+    keys[integral] = numbers[integral].astype("int64").astype(str)
+    keys[values.isna()] = None
+    return keys
+
+############################## Key Maps ##############################
+
+def node_key_map(resolved_network_id):
+    '''DataFrame [n, node_id] of the active nodes of a ResolvedNetwork, one row per key, read from the promoted n column.'''
+    key = f"keymap:node:{int(resolved_network_id)}"
+    key_map = cache.get(key)
+    if key_map is None:
+        nodes_sql, _ = resolved_network_sql(resolved_network_id, node_columns="v.n, v.node_id")
+        with connection.cursor() as cursor:
+            cursor.execute(f"{nodes_sql} ORDER BY v.node_id")
+            rows = cursor.fetchall()
+        key_map = pd.DataFrame(rows, columns=["n", "node_id"])
+        key_map = key_map.dropna(subset=["n"])
+        key_map["n"] = key_map["n"].astype("int64").astype(str)
+        key_map = key_map.drop_duplicates(subset="n", keep="last")
+        cache.set(key, key_map, KEY_MAP_TIMEOUT)
+    return key_map
+
+def link_key_map(resolved_network_id):
+    '''DataFrame [a, b, link_id] of the active links of a ResolvedNetwork, one row per (a, b), read from the promoted a/b columns.'''
+    key = f"keymap:link:{int(resolved_network_id)}"
+    key_map = cache.get(key)
+    if key_map is None:
+        _, links_sql = resolved_network_sql(resolved_network_id, link_columns="v.a, v.b, v.link_id")
+        with connection.cursor() as cursor:
+            cursor.execute(f"{links_sql} ORDER BY v.link_id")
+            rows = cursor.fetchall()
+        key_map = pd.DataFrame(rows, columns=["a", "b", "link_id"])
+        key_map = key_map.dropna(subset=["a", "b"])
+        key_map["a"] = key_map["a"].astype("int64").astype(str)
+        key_map["b"] = key_map["b"].astype("int64").astype(str)
+        key_map = key_map.drop_duplicates(subset=["a", "b"], keep="last")
+        cache.set(key, key_map, KEY_MAP_TIMEOUT)
+    return key_map
+
+############################## Resolution ##############################
+
+def resolve_node_ids(gdf_nodes, resolved_network_id):
+    '''node_id of every row of `gdf_nodes` matched on its 'n' column, -1 when the network has no such node.'''
+    keys = pd.DataFrame({"n": normalize_keys(gdf_nodes["n"])})
+    merged = keys.merge(node_key_map(resolved_network_id), on="n", how="left")
+    return merged["node_id"].fillna(-1).astype("int64").to_numpy()
+
+def resolve_link_ids(gdf_links, resolved_network_id):
+    '''link_id of every row of `gdf_links` matched on its 'a' and 'b' columns, -1 when the network has no such link.'''
+    keys = pd.DataFrame({"a": normalize_keys(gdf_links["a"]), "b": normalize_keys(gdf_links["b"])})
+    merged = keys.merge(link_key_map(resolved_network_id), on=["a", "b"], how="left")
+    return merged["link_id"].fillna(-1).astype("int64").to_numpy()
+
+############################## Referenced Nodes ##############################
+
+def link_endpoint_keys(operations):
+    '''Distinct A/B values (as promoted integers) of the links created or modified by a netchange.'''
+    keys = set()
+    for op in operations:
+        if op['type'] == 'link' and op['action'] in ('create', 'modify'):
+            values = promoted_values({k.lower(): v for k, v in op['data']['properties'].items()}, "link")
+            keys.update(v for v in (values["a"], values["b"]) if v is not None)
+    return sorted(keys)
+
+def referenced_node_ids(resolved_network_id, n_values, changeset_id=None):
+    '''
+    [(n, node_id)] of the active nodes numbered `n_values` in a ResolvedNetwork, with the versions of
+    `changeset_id` (still being written) layered on top. Goes through the promoted n index, so the
+    cost follows len(n_values) rather than the network size. When several nodes share an N the
+    highest node_id comes last, as in node_key_map().
+    '''
+    n_values = [int(n) for n in n_values]
+    if not n_values:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT n, node_id FROM (
+                SELECT DISTINCT ON (node_id) node_id, n, active FROM (
+                    SELECT v.node_id, v.version, v.n, v.active
+                    FROM network_nodeversion v
+                    JOIN network_resolvednode r ON r.node_version_id = v.id
+                    WHERE r.resolved_network_id = %(rid)s AND v.n = ANY(%(ns)s)
+                    UNION ALL
+                    SELECT v.node_id, v.version, v.n, v.active
+                    FROM network_nodeversion v
+                    WHERE v.changeset_id = %(cs)s
+                ) candidates
+                ORDER BY node_id, version DESC
+            ) latest
+            WHERE active AND n = ANY(%(ns)s)
+            ORDER BY node_id
+        """, {"rid": int(resolved_network_id), "ns": n_values, "cs": changeset_id})
+        return cursor.fetchall()
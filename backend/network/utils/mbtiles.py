@@ -0,0 +1,114 @@
+import gzip
+import os
+import sqlite3
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+class MBTiles:
+    '''
+    Minimal MBTiles 1.3 reader/writer. Tiles are addressed with XYZ coordinates and
+    stored gzip-compressed with TMS rows, as the spec and most tile servers expect.
+    A connection is opened per call so instances can be shared between threads.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def _connection(self, write=False):
+        '''
+        Read connections are opened read-only and leave the journal mode alone, so reading a finalized file
+        neither flips it back to WAL nor needs write access to its directory. Writers switch to WAL so readers
+        are not blocked while tiles are added.
+        '''
+        if write:
+            conn = sqlite3.connect(self.path, timeout=30)
+        else:
+            conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro", timeout=30, uri=True)
+        try:
+            if write:
+                conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, metadata=None):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connection(write=True) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tiles (
+                    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB
+                )
+            """)
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
+            conn.executemany(
+                "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                [("format", "pbf")] + [(k, str(v)) for k, v in (metadata or {}).items()]
+            )
+        return self
+
+    def finalize(self):
+        '''Checkpoints the WAL back into the main file so it can be moved or copied as a single file.'''
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            conn.close()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def metadata(self):
+        if not self.exists():
+            return {}
+        with self._connection() as conn:
+            return dict(conn.execute("SELECT name, value FROM metadata").fetchall())
+
+    def get_tile(self, z, x, y):
+        '''Returns the tile bytes, b"" for a stored empty tile, or None when the tile is not stored.'''
+        if not self.exists():
+            return None
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, (2 ** z - 1) - y)
+            ).fetchone()
+        if row is None:
+            return None
+        return gzip.decompress(row[0]) if row[0] else b""
+
+    def has_tile(self, z, x, y):
+        if not self.exists():
+            return False
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, (2 ** z - 1) - y)
+            ).fetchone()
+        return row is not None
+
+    def put_tiles(self, tiles):
+        '''Writes an iterable of (z, x, y, data) in one transaction.'''
+        rows = [
+            (z, x, (2 ** z - 1) - y, gzip.compress(data, compresslevel=6) if data else b"")
+            for z, x, y, data in tiles
+        ]
+        if not rows:
+            return
+        with self._connection(write=True) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                rows
+            )
+
+    def put_tile(self, z, x, y, data):
+        self.put_tiles([(z, x, y, data)])
+
+    def stats(self):
+        if not self.exists():
+            return {"entries": 0, "bytes": 0}
+        with self._connection() as conn:
+            entries, size = conn.execute("SELECT count(*), coalesce(sum(length(tile_data)), 0) FROM tiles").fetchone()
+        return {"entries": entries, "bytes": size}
@@ -0,0 +1,275 @@
+import contextvars
+import functools
+import re
+import sys
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds (ms) of the duration histogram buckets; the last bucket is unbounded
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+NAMES_KEY = "metrics:names"
+
+# Metrics of the request being served, None outside of a request (jobs, management commands)
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+############################## Spans ##############################
+
+class Span:
+    '''One named, timed piece of work. `rows` can be set while the span is open.'''
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+
+class RequestMetrics:
+    '''Spans, database queries and memory of one request, collected by network.middleware.MetricsMiddleware.'''
+
+    def __init__(self):
+        self.spans = []
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.profile_id = None
+        self.rss_start = peak_rss()
+        self._t0 = time.perf_counter()
+
+    def total_seconds(self):
+        return time.perf_counter() - self._t0
+
+    def record_query(self, execute, sql, params, many, context):
+        '''connection.execute_wrapper() hook counting the queries of the request and their time.'''
+        t0 = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - t0
+
+def current_metrics():
+    return _current.get()
+
+def activate(metrics):
+    return _current.set(metrics)
+
+def deactivate(token):
+    _current.reset(token)
+
+class span:
+    '''
+    Times the enclosed block under `name`: added to the current request's Server-Timing and
+    to the duration histograms.
+
+        with span("compare_gdf", rows=len(edited)) as s:
+            ...
+    '''
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self._span = Span(self.name, self.rows)
+        self._metrics = current_metrics()
+        self._queries = (self._metrics.queries, self._metrics.db_seconds) if self._metrics else (0, 0.0)
+        self._t0 = time.perf_counter()
+        return self._span
+
+    def __exit__(self, *exc):
+        s = self._span
+        s.seconds = time.perf_counter() - self._t0
+        if self._metrics:
+            s.queries = self._metrics.queries - self._queries[0]
+            s.db_seconds = self._metrics.db_seconds - self._queries[1]
+        record_span(s)
+        return False
+
+def timed(name, rows=None):
+    '''Decorator timing every call of a function as span `name`. `rows(result)`, when given, counts the rows processed.'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as s:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    s.rows = rows(result)
+                return result
+        return wrapper
+    return decorator
+
+def record_span(s):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.spans.append(s)
+    observe(s.name, s.seconds, rows=s.rows, queries=s.queries, db_seconds=s.db_seconds)
+
+class StageTimer:
+    '''Collects rows and elapsed time per stage of a long operation, each stage recorded as span "<prefix>.<stage>".'''
+
+    def __init__(self, prefix, progress=None):
+        self.prefix = prefix
+        self.stages = []
+        self.progress = progress
+        self._start()
+
+    def _start(self):
+        metrics = current_metrics()
+        self._queries = (metrics.queries, metrics.db_seconds) if metrics else (0, 0.0)
+        self._t0 = time.perf_counter()
+
+    def mark(self, stage, rows=None):
+        elapsed = time.perf_counter() - self._t0
+        s = Span(f"{self.prefix}.{stage}", rows)
+        s.seconds = elapsed
+        metrics = current_metrics()
+        if metrics:
+            s.queries = metrics.queries - self._queries[0]
+            s.db_seconds = metrics.db_seconds - self._queries[1]
+        record_span(s)
+        self.stages.append({
+            "stage": stage,
+            "rows": None if rows is None else int(rows),
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(rows / elapsed, 1) if rows is not None and elapsed > 0 else None,
+        })
+        if self.progress:
+            message = f"{elapsed:.2f} seconds" if rows is None else f"{rows} rows in {elapsed:.2f} seconds"
+            self.progress(stage, message=message)
+        self._start()
+
+############################## Memory ##############################
+
+def peak_rss():
+    '''Peak resident set size of this process in bytes, None where the resource module is unavailable.'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+############################## Server-Timing ##############################
+
+def _token(name):
+    return re.sub(r"[^\w.\-]", "_", name)
+
+def server_timing(metrics):
+    '''Server-Timing header value of a request: total, db, one entry per span name and the peak memory.'''
+    entries = [
+        f"total;dur={metrics.total_seconds() * 1000:.1f}",
+        f'db;dur={metrics.db_seconds * 1000:.1f};desc="{metrics.queries} queries"',
+    ]
+    # Spans of the same name (e.g. one per chunk of a netchange) are summed into one entry
+    totals = {}
+    for s in metrics.spans:
+        total = totals.setdefault(s.name, {"seconds": 0.0, "calls": 0, "rows": None, "queries": 0})
+        total["seconds"] += s.seconds
+        total["calls"] += 1
+        total["queries"] += s.queries
+        if s.rows is not None:
+            total["rows"] = (total["rows"] or 0) + s.rows
+    for name, total in totals.items():
+        details = [f"{total['calls']} calls"] if total["calls"] > 1 else []
+        if total["rows"] is not None:
+            details.append(f"{total['rows']} rows")
+        if total["queries"]:
+            details.append(f"{total['queries']} queries")
+        desc = f';desc="{", ".join(details)}"' if details else ""
+        entries.append(f"{_token(name)};dur={total['seconds'] * 1000:.1f}{desc}")
+    rss = peak_rss()
+    if rss is not None:
+        grown = rss - metrics.rss_start
+        entries.append(f'mem;desc="peak {rss / 2**20:.0f} MB, +{grown / 2**20:.0f} MB"')
+    return ", ".join(entries)
+
+############################## Histograms ##############################
+
+def _incr(key, delta=1):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+def bucket_index(ms):
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS_MS)
+
+def observe(name, seconds, rows=None, queries=0, db_seconds=0.0):
+    '''
+    Adds one observation to the histogram of `name`. Like the tile cache counters, histograms live
+    in Django's cache so a shared backend aggregates all workers. Sums are kept in whole milliseconds.
+    '''
+    ms = seconds * 1000
+    prefix = f"metrics:{name}"
+    _incr(f"{prefix}:count")
+    _incr(f"{prefix}:sum_ms", int(round(ms)))
+    _incr(f"{prefix}:bucket:{bucket_index(ms)}")
+    if rows:
+        _incr(f"{prefix}:rows", int(rows))
+    if queries:
+        _incr(f"{prefix}:queries", int(queries))
+        _incr(f"{prefix}:db_ms", int(round(db_seconds * 1000)))
+
+    names = cache.get(NAMES_KEY) or []
+    if name not in names:
+        cache.set(NAMES_KEY, sorted(set(names) | {name}), None)
+
+def _quantile(buckets, count, q):
+    '''Upper bound (ms) of the bucket holding quantile `q`, None when it is the unbounded one.'''
+    target = q * count
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= target:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else None
+    return None
+
+def histograms():
+    '''{name: {count, mean_ms, p50_ms, p95_ms, p99_ms, buckets, rows, queries, db_ms}} of every span seen.'''
+    result = {}
+    for name in cache.get(NAMES_KEY) or []:
+        prefix = f"metrics:{name}"
+        keys = [f"{prefix}:{k}" for k in ("count", "sum_ms", "rows", "queries", "db_ms")]
+        keys += [f"{prefix}:bucket:{i}" for i in range(len(BUCKETS_MS) + 1)]
+        values = cache.get_many(keys)
+        count = values.get(f"{prefix}:count", 0)
+        if not count:
+            continue
+        buckets = [values.get(f"{prefix}:bucket:{i}", 0) for i in range(len(BUCKETS_MS) + 1)]
+        labels = [f"le_{bound}" for bound in BUCKETS_MS] + ["inf"]
+        result[name] = {
+            "count": count,
+            "mean_ms": round(values.get(f"{prefix}:sum_ms", 0) / count, 1),
+            "p50_ms": _quantile(buckets, count, 0.50),
+            "p95_ms": _quantile(buckets, count, 0.95),
+            "p99_ms": _quantile(buckets, count, 0.99),
+            "buckets": dict(zip(labels, buckets)),
+            "rows": values.get(f"{prefix}:rows", 0),
+            "queries": values.get(f"{prefix}:queries", 0),
+            "db_ms": values.get(f"{prefix}:db_ms", 0),
+        }
+    return result
+
+def histograms_are_shared():
+    '''False when the default cache is local to each process, so histograms() only covers the process calling it.'''
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+def reset_histograms():
+    names = cache.get(NAMES_KEY) or []
+    keys = [NAMES_KEY]
+    for name in names:
+        prefix = f"metrics:{name}"
+        keys += [f"{prefix}:{k}" for k in ("count", "sum_ms", "rows", "queries", "db_ms")]
+        keys += [f"{prefix}:bucket:{i}" for i in range(len(BUCKETS_MS) + 1)]
+    cache.delete_many(keys)
@@ -0,0 +1,137 @@
+'''
+Netchange encodings. Kept free of Django so producers outside the backend can import it.
+
+A netchange is a changeset header plus a list of operations {"type", "action", "id", "data": {"geometry", "properties"}}.
+It is written either as the original JSON document or as an Arrow IPC stream:
+one row per operation with type, action, id, the geometry as WKB (geoarrow.wkb) and the properties as
+a struct with one typed field per property key. The header is kept as JSON in the schema metadata.
+'''
+import io
+import json
+
+import pyarrow as pa
+import shapely
+from shapely.geometry import shape
+
+from network.utils.zipstream import compress_member
+
+JSON_CONTENT_TYPE = "application/json"
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+# format -> (content type, file extension)
+NETCHANGE_FORMATS = {
+    "json": (JSON_CONTENT_TYPE, ".json"),
+    "arrow": (ARROW_CONTENT_TYPE, ".arrow"),
+}
+
+# Operations per Arrow record batch
+ARROW_BATCH_ROWS = 10_000
+
+HEADER_KEY = b"netchange"
+JSON_FIELD = {b"encoding": b"json"}
+
+def netchange_format_for(content_type):
+    '''Netchange format named by a Content-Type or Accept header value, "json" unless Arrow is asked for.'''
+    return "arrow" if content_type and ARROW_CONTENT_TYPE in content_type else "json"
+
+############################## JSON ##############################
+
+def encode_netchange_json(header, operations):
+    return json.dumps({"changeset": header, "operations": operations}, indent=2).encode("utf-8")
+
+############################## Arrow ##############################
+
+def _property_array(values):
+    '''Typed array of one property, or JSON text when the values are mixed or nested (flagged in the field metadata).'''
+    try:
+        array = pa.array(values)
+        if not (pa.types.is_nested(array.type) or pa.types.is_binary(array.type)):
+            return array, None
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    return pa.array([None if v is None else json.dumps(v) for v in values], type=pa.string()), JSON_FIELD
+
+def _operations_table(header, operations):
+    geometries = [op.get("data", {}).get("geometry") for op in operations]
+    geometries = shapely.to_wkb([shape(g) if g else None for g in geometries])
+    properties = [op.get("data", {}).get("properties") or {} for op in operations]
+
+    keys = list(dict.fromkeys(k for props in properties for k in props))
+    fields, children = [], []
+    for key in keys:
+        array, metadata = _property_array([props.get(key) for props in properties])
+        fields.append(pa.field(key, array.type, metadata=metadata))
+        children.append(array)
+    if children:
+        props_array = pa.StructArray.from_arrays(children, fields=fields)
+    else:
+        props_array = pa.array([{}] * len(operations), type=pa.struct([]))
+
+    columns = {
+        "type": pa.array([op["type"] for op in operations], type=pa.string()),
+        "action": pa.array([op["action"] for op in operations], type=pa.string()),
+        "id": pa.array([op.get("id") for op in operations], type=pa.int64()),
+        "geometry": pa.array(geometries, type=pa.binary()),
+        "properties": props_array,
+    }
+    schema = pa.schema(
+        [pa.field(name, array.type, metadata={"ARROW:extension:name": "geoarrow.wkb"} if name == "geometry" else None)
+         for name, array in columns.items()],
+        metadata={HEADER_KEY: json.dumps(header)},
+    )
+    return pa.Table.from_arrays(list(columns.values()), schema=schema)
+
+def encode_netchange_arrow(header, operations, batch_rows=ARROW_BATCH_ROWS):
+    '''Arrow IPC stream (zstd-compressed buffers) of a netchange.'''
+    table = _operations_table(header, operations)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+        writer.write_table(table, max_chunksize=batch_rows)
+    return sink.getvalue().to_pybytes()
+
+class _RawStream(io.RawIOBase):
+    '''io wrapper for any object with read(), e.g. a request body, as pyarrow wants a proper file object.'''
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def iter_netchange_arrow(stream):
+    '''
+    Reads an Arrow netchange from a file-like `stream` one record batch at a time.
+    Yields ("changeset", dict) and then ("operation", dict) per row, like iter_netchange() for JSON.
+    Geometries are handed over as WKB in data["wkb"]; missing properties are left out.
+    '''
+    reader = pa.ipc.open_stream(_RawStream(stream))
+    metadata = reader.schema.metadata or {}
+    yield "changeset", json.loads(metadata.get(HEADER_KEY, b"{}"))
+
+    props_type = reader.schema.field("properties").type
+    json_keys = {f.name for f in props_type if (f.metadata or {}).get(b"encoding") == b"json"}
+    for batch in reader:
+        columns = batch.to_pydict()
+        for op_type, action, op_id, wkb, props in zip(columns["type"], columns["action"], columns["id"],
+                                                      columns["geometry"], columns["properties"]):
+            props = {k: json.loads(v) if k in json_keys else v for k, v in (props or {}).items() if v is not None}
+            data = {"properties": props}
+            if wkb is not None:
+                data["wkb"] = wkb
+            yield "operation", {"type": op_type, "action": action, "id": op_id, "data": data}
+
+############################## Zip Members ##############################
+
+def encode_netchange_member(arcname, header, operations, netchange_format="json", compresslevel=9):
+    '''
+    One netchange file as a compressed ZipMember, ready for stream_zip_members().
+    Top-level so a process pool can run it. Arrow files are stored as they are, their buffers being zstd-compressed.
+    '''
+    if netchange_format == "arrow":
+        return compress_member(arcname, encode_netchange_arrow(header, operations), 0)
+    return compress_member(arcname, encode_netchange_json(header, operations), compresslevel)
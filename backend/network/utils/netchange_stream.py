@@ -0,0 +1,153 @@
+import gzip
+import pickle
+import tempfile
+from itertools import islice
+
+import ijson
+import pyarrow as pa
+
+from network.utils.ingest import apply_netchange_operations
+from network.utils.lookup import link_endpoint_keys, referenced_node_ids
+from network.utils.jobs import no_progress
+from network.utils.netchange_format import netchange_format_for, iter_netchange_arrow
+
+# Operations parsed and applied per batch; bounds memory whatever the size of the netchange
+NETCHANGE_CHUNK_OPS = 10_000
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+class NetChangeFormatError(ValueError):
+    pass
+
+############################## Request Body ##############################
+
+class _PrefixedStream:
+    '''Read-only stream returning `prefix` before the rest of `stream`, so the first bytes can be sniffed.'''
+
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._stream.read(size) if size is not None and size >= 0 else self._stream.read()
+        if size is None or size < 0:
+            data, self._prefix = self._prefix + self._stream.read(), b""
+            return data
+        data, self._prefix = self._prefix[:size], self._prefix[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+def open_netchange_stream(request):
+    '''
+    File-like over the raw body of a netchange upload (DRF request.stream), never read into memory as a whole.
+    Gzip bodies are decompressed on the fly, recognized by their magic bytes whatever the headers say.
+    '''
+    stream = request.stream
+    if stream is None:
+        raise NetChangeFormatError("Empty request body.")
+    head = stream.read(len(GZIP_MAGIC))
+    stream = _PrefixedStream(head, stream)
+    if head == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    return stream
+
+############################## Parser ##############################
+
+def _read_value(events, event, value):
+    '''Builds the JSON value starting with (`event`, `value`) from the remaining parser events.'''
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+    depth = 1 if event in ("start_map", "start_array") else 0
+    while depth:
+        _, event, value = next(events)
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+    return builder.value
+
+def iter_netchange(stream):
+    '''
+    Parses a netchange incrementally. Yields ("changeset", dict) and then ("operation", dict) for every
+    element of "operations"; only one operation is built at a time. "changeset" must come before
+    "operations", as in the files written by ToChangeFileView, so nothing has to be buffered.
+    '''
+    events = ijson.parse(stream, use_float=True)
+    seen_changeset = False
+    try:
+        for prefix, event, value in events:
+            if prefix == "changeset" and event in ("start_map", "null"):
+                seen_changeset = True
+                yield "changeset", _read_value(events, event, value) or {}
+            elif prefix == "operations.item":
+                if not seen_changeset:
+                    raise NetChangeFormatError("'changeset' must come before 'operations' in a netchange file.")
+                operation = _read_value(events, event, value)
+                if not isinstance(operation, dict):
+                    raise NetChangeFormatError("Every operation must be a JSON object.")
+                yield "operation", operation
+    except ijson.JSONError as e:
+        raise NetChangeFormatError(f"Invalid netchange JSON: {e}")
+    if not seen_changeset:
+        raise NetChangeFormatError("'changeset' is missing from the netchange file.")
+
+def read_netchange(request):
+    '''
+    Parser of the netchange in a request body, picked by Content-Type: an Arrow IPC stream
+    (application/vnd.apache.arrow.stream, see utils/netchange_format.py) or JSON.
+    '''
+    stream = open_netchange_stream(request)
+    if netchange_format_for(request.content_type) == "arrow":
+        return _checked_arrow(iter_netchange_arrow(stream))
+    return iter_netchange(stream)
+
+def _checked_arrow(items):
+    try:
+        yield from items
+    except (pa.ArrowInvalid, KeyError) as e:
+        raise NetChangeFormatError(f"Invalid Arrow netchange: {e}")
+
+def iter_chunks(items, size=NETCHANGE_CHUNK_OPS):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+############################## Apply ##############################
+
+def _unspool(spool, count):
+    for _ in range(count):
+        yield pickle.load(spool)
+
+def apply_netchange_stream(changeset, operations, resolved_network_id, chunk_ops=NETCHANGE_CHUNK_OPS, progress=no_progress):
+    '''
+    Applies an iterable of operations under `changeset` in batches of `chunk_ops`.
+    Node operations are applied as they arrive; link operations are spooled to a temporary file and
+    applied once every node is written, since their A/B may refer to nodes created later in the file.
+    Must be called inside a transaction. Returns {"nodes": n, "links": n} operation counts.
+    '''
+    counts = {"nodes": 0, "links": 0}
+    with tempfile.TemporaryFile() as spool:
+        for chunk in iter_chunks(operations, chunk_ops):
+            nodes = [op for op in chunk if op.get('type') == 'node']
+            apply_netchange_operations("node", changeset, nodes)
+            counts["nodes"] += len(nodes)
+            for op in chunk:
+                if op.get('type') == 'link':
+                    pickle.dump(op, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                    counts["links"] += 1
+            progress("nodes", message=f"{counts['nodes']} node operations")
+
+        spool.seek(0)
+        applied = 0
+        for chunk in iter_chunks(_unspool(spool, counts["links"]), chunk_ops):
+            node_id_by_n = dict(referenced_node_ids(resolved_network_id, link_endpoint_keys(chunk), changeset.id))
+            apply_netchange_operations("link", changeset, chunk, node_id_by_n)
+            applied += len(chunk)
+            progress("links", counts["links"] and applied / counts["links"], f"{applied} link operations")
+    return counts
@@ -0,0 +1,132 @@
+import json
+import re
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+
+# Attributes copied out of the JSON into typed, indexed columns of NodeVersion/LinkVersion.
+# column -> type; the columns themselves are declared on the models.
+PROMOTED_COLUMNS = {
+    "node": {
+        "n": "integer",
+    },
+    "link": {
+        "a": "integer",
+        "b": "integer",
+        "facility_type": "integer",
+        "lanes": "integer",
+        "capacity": "number",
+    },
+}
+
+# Attribute keys each column is read from, first present wins.
+# Override per column with settings.PROMOTED_ATTRIBUTES, e.g. {"capacity": ["cap", "capacity"]}
+DEFAULT_SOURCES = {
+    "n": ["n"],
+    "a": ["a"],
+    "b": ["b"],
+    "facility_type": ["facility_type", "facility_t", "ft", "factype"],  # facility_t: shapefile-truncated name
+    "lanes": ["lanes"],
+    "capacity": ["capacity", "cap"],
+}
+
+# JSON text accepted for each type; anything else leaves the column NULL
+SQL_PATTERNS = {
+    "integer": r"^\s*-?[0-9]{1,18}(\.0*)?\s*$",
+    "number": r"^\s*-?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$",
+}
+
+TABLES = {
+    "node": "network_nodeversion",
+    "link": "network_linkversion",
+}
+
+def promoted_sources(column):
+    overrides = getattr(settings, "PROMOTED_ATTRIBUTES", {}) or {}
+    return [key.lower() for key in overrides.get(column, DEFAULT_SOURCES[column])]
+
+############################## Python ##############################
+
+# The write paths apply the same rule as promoted_sql(): the value's JSON text must match SQL_PATTERNS
+PATTERNS = {kind: re.compile(pattern) for kind, pattern in SQL_PATTERNS.items()}
+
+def _json_text(value):
+    '''Text of a JSON value as PostgreSQL's ->> returns it, None for null and missing (NaN) values.'''
+    if value is None or value is pd.NA:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return "true" if value else "false"
+    if isinstance(value, (float, np.floating)) and np.isnan(value):
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+def _to_type(value, kind):
+    text = _json_text(value)
+    if text is None or not PATTERNS[kind].match(text):
+        return None
+    if kind == "integer":
+        return int(Decimal(text.strip()).to_integral_value(ROUND_HALF_UP))
+    number = float(text)
+    return number if np.isfinite(number) else None
+
+def promoted_values(attributes, element):
+    '''{column: typed value} of one attributes dict. Values that do not fit the column type become None.'''
+    values = {}
+    for column, kind in PROMOTED_COLUMNS[element].items():
+        value = None
+        for key in promoted_sources(column):
+            if attributes.get(key) is not None:
+                value = attributes[key]
+                break
+        values[column] = _to_type(value, kind)
+    return values
+
+def promoted_frame(df, element):
+    '''
+    DataFrame of the promoted columns for every row of `df` (lower-case attribute columns),
+    typed as nullable Int64/float64, computed column-wise for the COPY paths.
+    '''
+    out = pd.DataFrame(index=df.index)
+    for column, kind in PROMOTED_COLUMNS[element].items():
+        raw = pd.Series(None, index=df.index, dtype=object)
+        for key in promoted_sources(column):
+            if key in df.columns:
+                raw = raw.where(raw.notna(), df[key].astype(object))
+        text = raw.map(_json_text)
+        fits = text.map(lambda t: t is not None and PATTERNS[kind].match(t) is not None).astype(bool)
+        values = pd.to_numeric(text.where(fits), errors="coerce").astype("float64")
+        values = values.where(np.isfinite(values))
+        if kind == "integer":
+            values = values.round().astype("Int64")
+        out[column] = values
+    return out
+
+############################## SQL ##############################
+
+def promoted_sql(column, kind, alias="attributes"):
+    '''SQL expression computing a promoted column from the JSON attributes, NULL when the value does not fit.'''
+    text = ", ".join(f"{alias}->>'{key}'" for key in promoted_sources(column))
+    text = f"COALESCE({text})" if len(promoted_sources(column)) > 1 else text
+    cast = f"round(({text})::numeric)::bigint" if kind == "integer" else f"({text})::double precision"
+    return f"CASE WHEN {text} ~ '{SQL_PATTERNS[kind]}' THEN {cast} END"
+
+def backfill_promoted_columns(cursor, element, batch_rows=100_000):
+    '''
+    Recomputes the promoted columns of every version of `element` from its JSON attributes,
+    in id ranges so each UPDATE stays short. Returns the number of rows visited.
+    '''
+    table = TABLES[element]
+    assignments = ", ".join(f"{column} = {promoted_sql(column, kind)}" for column, kind in PROMOTED_COLUMNS[element].items())
+    cursor.execute(f"SELECT min(id), max(id) FROM {table}")
+    low, high = cursor.fetchone()
+    if low is None:
+        return 0
+    for start in range(low, high + 1, batch_rows):
+        cursor.execute(f"UPDATE {table} SET {assignments} WHERE id >= %s AND id < %s", [start, start + batch_rows])
+    cursor.execute(f"SELECT count(*) FROM {table}")
+    return cursor.fetchone()[0]
@@ -0,0 +1,135 @@
+import zlib
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.conf import settings
+
+from network.models import Changeset, ResolvedNetwork
+from network.utils.metrics import timed
+
+# last_used_at is only refreshed when older than this, so cache hits stay read-only
+TOUCH_INTERVAL = timedelta(seconds=60)
+
+############################## Resolution SQL ##############################
+
+def resolve_sql(element_type):
+    '''
+    Ranking query picking the winning version of every node/link for a set of changesets.
+    Takes a single parameter: the list of changeset ids.
+    '''
+    table = f"network_{element_type}version"
+    id_col = f"{element_type}_id"
+    return f"""
+        SELECT DISTINCT ON ({id_col}) {id_col}, id
+        FROM {table}
+        WHERE changeset_id = ANY(%s)
+        ORDER BY {id_col}, version DESC
+    """
+
+def resolved_network_key(changeset_ids):
+    return ",".join(str(i) for i in sorted({int(i) for i in changeset_ids}))
+
+############################## Snapshots ##############################
+
+@timed("get_resolved_network")
+def get_resolved_network(changeset_ids):
+    '''
+    Returns the ResolvedNetwork for `changeset_ids`, building it on first use.
+    Concurrent requests for the same combination wait on an advisory lock instead of building twice.
+    '''
+    key = resolved_network_key(changeset_ids)
+    resolved = ResolvedNetwork.objects.filter(key=key).first()
+
+    if resolved is None:
+        # Checked before taking the lock: an unknown id would fail the changesets M2M insert half-way through the build
+        ids = [int(i) for i in key.split(",")]
+        unknown = sorted(set(ids) - set(Changeset.objects.filter(id__in=ids).values_list("id", flat=True)))
+        if unknown:
+            raise ValueError(f"Unknown changeset ids {unknown}")
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [zlib.crc32(key.encode())])
+            resolved = ResolvedNetwork.objects.filter(key=key).first()
+            if resolved is None:
+                resolved = _build_resolved_network(key)
+        evict_resolved_networks(keep=resolved.id)
+        return resolved
+
+    now = timezone.now()
+    if resolved.last_used_at < now - TOUCH_INTERVAL:
+        ResolvedNetwork.objects.filter(id=resolved.id).update(last_used_at=now)
+    return resolved
+
+def _build_resolved_network(key):
+    ids = [int(i) for i in key.split(",")]
+    resolved = ResolvedNetwork.objects.create(key=key)
+    resolved.changesets.set(ids)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO network_resolvednode (resolved_network_id, node_id, node_version_id)
+            SELECT %s, node_id, id FROM ({resolve_sql("node")}) latest
+        """, [resolved.id, ids])
+        resolved.node_count = cursor.rowcount
+
+        cursor.execute(f"""
+            INSERT INTO network_resolvedlink (resolved_network_id, link_id, link_version_id)
+            SELECT %s, link_id, id FROM ({resolve_sql("link")}) latest
+        """, [resolved.id, ids])
+        resolved.link_count = cursor.rowcount
+
+    resolved.save(update_fields=["node_count", "link_count"])
+    return resolved
+
+def invalidate_resolved_networks(changeset_ids):
+    '''
+    Drops every snapshot that includes any of `changeset_ids`. Only needed when versions are written under an
+    existing changeset (e.g. by hand); uploads always create a new changeset, which no snapshot contains yet.
+    '''
+    stale = ResolvedNetwork.objects.filter(changesets__in=[int(i) for i in changeset_ids]).values_list("id", flat=True)
+    ResolvedNetwork.objects.filter(id__in=list(stale)).delete()
+
+def evict_resolved_networks(keep=None, max_rows=None):
+    '''Evicts least recently used snapshots until the total row count is under RESOLVED_NETWORK_MAX_ROWS.'''
+    max_rows = settings.RESOLVED_NETWORK_MAX_ROWS if max_rows is None else max_rows
+    sizes = ResolvedNetwork.objects.annotate(size=F("node_count") + F("link_count"))
+    total = sizes.aggregate(total=Sum("size"))["total"] or 0
+    if total <= max_rows:
+        return
+
+    evict = []
+    for resolved_id, size in sizes.exclude(id=keep).order_by("last_used_at").values_list("id", "size"):
+        if total <= max_rows:
+            break
+        evict.append(resolved_id)
+        total -= size
+    ResolvedNetwork.objects.filter(id__in=evict).delete()
+
+############################## Queries ##############################
+
+def resolved_network_sql(resolved_network_id, active_only=True,
+                         node_columns="v.id, v.node_id, v.geometry, v.attributes",
+                         link_columns="v.id, v.link_id, v.f_node_id, v.t_node_id, v.geometry, v.attributes"):
+    '''
+    SQL selecting the winning node and link versions of a ResolvedNetwork (version rows are aliased `v`).
+    Returns (nodes_sql, links_sql).
+    '''
+    resolved_network_id = int(resolved_network_id)
+    active_sql = "AND v.active = TRUE" if active_only else ""
+
+    nodes_sql = f"""
+        SELECT {node_columns}
+        FROM network_resolvednode r
+        JOIN network_nodeversion v ON v.id = r.node_version_id
+        WHERE r.resolved_network_id = {resolved_network_id} {active_sql}
+    """
+
+    links_sql = f"""
+        SELECT {link_columns}
+        FROM network_resolvedlink r
+        JOIN network_linkversion v ON v.id = r.link_version_id
+        WHERE r.resolved_network_id = {resolved_network_id} {active_sql}
+    """
+    return nodes_sql, links_sql
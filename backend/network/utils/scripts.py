@@ -1,15 +1,11 @@
-from network.models import NodeVersion, LinkVersion
+from network.utils.metrics import timed
 import tempfile
 import os
 import zipfile
-import uuid
-import pandas as pd
-import geopandas as gpd
-from shapely.wkb import loads as wkb_loads
 import io
-import time
 
 from django.db import connection
+from django.db.models import prefetch_related_objects
 from django.conf import settings
 SRID = settings.USE_SRID
 
@@ -86,6 +82,22 @@ def get_lineages_from_tree(roots_map):
 
     return lineages
 
+# Elements versioned by more than one of the given changesets, with the changesets that touched them
+CONFLICT_CANDIDATES_SQL = """
+    SELECT 'node' AS type, node_id AS id, array_agg(DISTINCT changeset_id) AS changeset_ids
+    FROM network_nodeversion
+    WHERE changeset_id = ANY(%(ids)s)
+    GROUP BY node_id
+    HAVING count(DISTINCT changeset_id) > 1
+    UNION ALL
+    SELECT 'link', link_id, array_agg(DISTINCT changeset_id)
+    FROM network_linkversion
+    WHERE changeset_id = ANY(%(ids)s)
+    GROUP BY link_id
+    HAVING count(DISTINCT changeset_id) > 1
+"""
+
+@timed("detect_conflicts", rows=len)
 def detect_conflicts(changesets):
     '''
     Detects three types of conflicts:
@@ -93,28 +105,10 @@ def detect_conflicts(changesets):
     2. Link-level conflicts: same link modified by changesets in different lineages.
     3. Base network conflicts: all changesets must share the same base_network.
     '''
+    changesets = list(changesets)
+    prefetch_related_objects(changesets, "depends_on")
 
-    def _collect_conflicts(obj_map, obj_type, cs_objects, lineages):
-        conflicts = []
-        for obj_id, cs_ids in obj_map.items():
-            if len(cs_ids) <= 1:
-                continue
-            
-            different_lineages_check = True
-            for l in lineages:
-                if set(cs_ids).issubset(set(l)):
-                    different_lineages_check = False
-                    break
-            
-            if different_lineages_check:
-                conflicts.append({
-                    "type": obj_type,
-                    "id": obj_id,
-                    "conflicting_changesets": [cs_objects[cs_id].pid for cs_id in cs_ids]
-                })
-        return conflicts
-
-    # Step 2: Check for base network mismatches
+    # Step 1: Check for base network mismatches
     base_groups = {}
     for cs in changesets:
         base_id = str(cs.base_network_id) if cs.base_network_id else "None"
@@ -127,49 +121,42 @@ def detect_conflicts(changesets):
             "conflicting_changesets": list(base_groups.values())
         })
 
-    # Step 3: Map node/link modifications to changesets
-    node_map = {}
-    link_map = {}
-    for cs in changesets:
-        for nv in NodeVersion.objects.filter(changeset=cs):
-            node_map.setdefault(nv.node_id, set()).add(cs.id)
-        for lv in LinkVersion.objects.filter(changeset=cs):
-            link_map.setdefault(lv.link_id, set()).add(cs.id)
+    if len(changesets) < 2:
+        return base_conflicts
+
+    # Step 2: Elements touched by more than one changeset, in a single grouped query
+    with connection.cursor() as cursor:
+        cursor.execute(CONFLICT_CANDIDATES_SQL, {"ids": [cs.id for cs in changesets]})
+        candidates = cursor.fetchall()
+
+    if not candidates:
+        return base_conflicts
 
-    # Step 4: Build dependency tree and lineages list
+    # Step 3: Lineages as bitsets, one bit per changeset
     _, roots_map = build_dependency_tree(changesets)
     lineages = get_lineages_from_tree(roots_map)
-
-    # Step 5: Conflict collection
-    cs_objects = {cs.id:cs for cs in changesets}
-    node_conflicts = _collect_conflicts(node_map, "node", cs_objects, lineages)
-    link_conflicts = _collect_conflicts(link_map, "link", cs_objects, lineages)
+    bits = {cs.id: 1 << i for i, cs in enumerate(changesets)}
+    lineage_masks = {sum(bits[cs_id] for cs_id in set(l)) for l in lineages}
+
+    # Step 4: An element conflicts unless one lineage contains all of its changesets.
+    # Many elements share the same set of changesets, so verdicts are computed once per mask.
+    cs_objects = {cs.id: cs for cs in changesets}
+    verdicts = {}
+    node_conflicts = []
+    link_conflicts = []
+    for obj_type, obj_id, cs_ids in candidates:
+        mask = sum(bits[cs_id] for cs_id in cs_ids)
+        if mask not in verdicts:
+            verdicts[mask] = not any(mask & lineage == mask for lineage in lineage_masks)
+        if verdicts[mask]:
+            (node_conflicts if obj_type == "node" else link_conflicts).append({
+                "type": obj_type,
+                "id": obj_id,
+                "conflicting_changesets": [cs_objects[cs_id].pid for cs_id in cs_ids]
+            })
 
     return base_conflicts + node_conflicts + link_conflicts
 
-def queryset_to_gdf(qs, geometry_field='geom_wkb', crs=f'EPSG:{SRID}'):
-    t0 = time.time()
-    df = pd.DataFrame(list(qs.values()))
-
-    df["geometry"] = df[geometry_field].map(
-        lambda x: wkb_loads(x.tobytes() if isinstance(x, memoryview) else x) if x else None
-    )
-    df.drop(columns=[geometry_field], inplace=True)
-
-    if "attributes" in df.columns and not df["attributes"].isnull().all():
-        attr_df = pd.json_normalize(df["attributes"])
-        overlapping_cols = set(attr_df.columns) & set(df.columns)
-        attr_df.drop(columns=overlapping_cols, inplace=True)
-        df = pd.concat([df.drop(columns=["attributes"]), attr_df], axis=1)
-
-    for col in df.columns:
-        if df[col].dtype == object and df[col].apply(lambda x: isinstance(x, uuid.UUID)).any():
-            df[col] = df[col].astype(str)
-        elif pd.api.types.is_datetime64_any_dtype(df[col]):
-            df[col] = df[col].dt.strftime('%Y-%m-%dT%H:%M:%S')
-
-    return gpd.GeoDataFrame(df, geometry="geometry", crs=crs)
-
 def create_shapefile_zip_on_disk(nodes_gdf, links_gdf) -> bytes:
     with tempfile.TemporaryDirectory() as tmpdir:
         node_path = os.path.join(tmpdir, "nodes")
@@ -191,38 +178,3 @@ def create_shapefile_zip_on_disk(nodes_gdf, links_gdf) -> bytes:
 
         mem_zip.seek(0)
         return mem_zip.read()
-
-############################## Build Network from Changesets ##############################
-def build_network_from_changesets(base_id, project_ids):
-    changeset_ids = [base_id] + project_ids
-    changeset_ids_sql = ",".join([str(i) for i in changeset_ids])
-
-    nodes_sql = f"""
-        WITH ranked_nodes AS (
-            SELECT DISTINCT ON (node_id) *
-            FROM network_nodeversion
-            WHERE changeset_id IN ({changeset_ids_sql}) AND active = TRUE
-            ORDER BY node_id, version DESC
-        )
-        SELECT id, node_id, geometry, attributes
-        FROM ranked_nodes
-    """
-
-    links_sql = f"""
-        WITH ranked_links AS (
-            SELECT DISTINCT ON (link_id) *
-            FROM network_linkversion
-            WHERE changeset_id IN ({changeset_ids_sql}) AND active = TRUE
-            ORDER BY link_id, version DESC
-        )
-        SELECT id, link_id, f_node_id, t_node_id, geometry, attributes
-        FROM ranked_links
-    """
-    with connection.cursor():
-        nodes_gdf = gpd.read_postgis(nodes_sql, connection.connection, geom_col='geometry')
-        links_gdf = gpd.read_postgis(links_sql, connection.connection, geom_col='geometry')
-
-    nodes_gdf.set_crs(epsg=SRID, inplace=True)
-    links_gdf.set_crs(epsg=SRID, inplace=True)
-
-    return nodes_gdf, links_gdf
\ No newline at end of file
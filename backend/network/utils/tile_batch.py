@@ -0,0 +1,137 @@
+import contextvars
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.conf import settings
+
+from network.utils.generate_base_tiles import get_base_mbtiles
+from network.utils.resolved import get_resolved_network
+from network.utils.tile_cache import get_tile_cache, tile_namespace, record_tile_cache
+from network.utils.tiles import render_tile, tile_touched_by_projects
+
+# Batch response record header: z (uint8), x (uint32), y (uint32), tile length (uint32), big-endian
+TILE_RECORD = struct.Struct(">BIII")
+
+TILE_BATCH_CONTENT_TYPE = "application/vnd.tdm.tile-batch"
+
+############################## Tiles of a Network ##############################
+
+class NetworkTiles:
+    '''
+    Tiles of one base network + project changesets for one auth_area, looked up in order in the base
+    pyramid, the tile cache and the database. Shared by MVTNetworkTileView and TileBatchView; the
+    base and projects must already be validated. Thread-safe: the ResolvedNetwork is fetched once,
+    on the first tile that has to be rendered.
+    '''
+
+    def __init__(self, base, project_ids, auth_area):
+        self.base = base
+        self.project_ids = project_ids
+        self.auth_area = auth_area
+        self.namespace = tile_namespace(base.id, project_ids, auth_area)
+        self.tile_cache = get_tile_cache()
+
+        # Tiles the projects do not touch are identical to the pre-rendered base tile
+        self.mbtiles = get_base_mbtiles(base.id) if base.auth_area == auth_area else None
+        self.pyramid_zooms = None
+        if self.mbtiles:
+            metadata = self.mbtiles.metadata()
+            self.pyramid_zooms = (int(metadata["minzoom"]), int(metadata["maxzoom"]))
+
+        self._resolved_id = None
+        self._lock = threading.Lock()
+
+    def resolved_id(self):
+        with self._lock:
+            if self._resolved_id is None:
+                self._resolved_id = get_resolved_network([self.base.id] + self.project_ids).id
+            return self._resolved_id
+
+    def get(self, z, x, y):
+        '''
+        MVT bytes of tile z/x/y, b"" when empty. The tile cache is looked up first; the pyramid, and for a project
+        set the spatial check of whether the projects touch the tile, only on a miss.
+        '''
+        tile_data = self.tile_cache.get(self.namespace, z, x, y)
+        if tile_data is not None:
+            record_tile_cache("hit")
+            return tile_data
+
+        if self.pyramid_zooms and self.pyramid_zooms[0] <= z <= self.pyramid_zooms[1] and (
+            not self.project_ids or not tile_touched_by_projects(z, x, y, self.base.id, self.project_ids)
+        ):
+            record_tile_cache("pyramid")
+            return self.mbtiles.get_tile(z, x, y) or b""
+
+        record_tile_cache("miss")
+        tile_data = bytes(render_tile(z, x, y, self.resolved_id(), self.auth_area) or b"")
+        self.tile_cache.set(self.namespace, z, x, y, tile_data)
+        return tile_data
+
+############################## Batches ##############################
+
+def parse_tile_list(tiles, max_tiles):
+    '''
+    Validated, de-duplicated [(z, x, y)] of a batch request given as [[z, x, y], ...] or ["z/x/y", ...].
+    Raises ValueError on anything else.
+    '''
+    if not isinstance(tiles, list) or not tiles:
+        raise ValueError("tiles must be a non-empty list of [z, x, y].")
+    if len(tiles) > max_tiles:
+        raise ValueError(f"At most {max_tiles} tiles per batch.")
+    parsed = []
+    for tile in tiles:
+        try:
+            z, x, y = (int(v) for v in (tile.split("/") if isinstance(tile, str) else tile))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid tile {tile!r}, expected [z, x, y].")
+        if not (0 <= z <= 24 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f"Tile {z}/{x}/{y} is out of range.")
+        parsed.append((z, x, y))
+    return list(dict.fromkeys(parsed))
+
+def _get_tiles(network_tiles, tiles):
+    try:
+        return [(z, x, y, network_tiles.get(z, x, y)) for z, x, y in tiles]
+    finally:
+        # Each worker thread has a database connection of its own
+        connection.close()
+
+def get_tiles(network_tiles, tiles, workers=None):
+    '''
+    [(z, x, y, bytes)] of every tile, fetched by a small thread pool. Tiles are split in one group per
+    thread, so each thread opens a single database connection for the batch.
+    '''
+    workers = max(1, min(len(tiles), workers or settings.TILE_BATCH["WORKERS"]))
+    if workers == 1:
+        return [(z, x, y, network_tiles.get(z, x, y)) for z, x, y in tiles]
+
+    groups = [tiles[i::workers] for i in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Spans of the workers are reported with the request (utils/metrics.py)
+        futures = [pool.submit(contextvars.copy_context().run, _get_tiles, network_tiles, group) for group in groups]
+        return [tile for future in futures for tile in future.result()]
+
+def encode_tile_batch(tiles):
+    '''
+    Length-prefixed binary of [(z, x, y, bytes)]: one TILE_RECORD header followed by the tile bytes per tile.
+    An empty tile has length 0.
+    '''
+    parts = []
+    for z, x, y, data in tiles:
+        parts.append(TILE_RECORD.pack(z, x, y, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+def decode_tile_batch(data):
+    '''Inverse of encode_tile_batch(), for clients and scripts written in Python.'''
+    tiles = []
+    offset = 0
+    while offset < len(data):
+        z, x, y, length = TILE_RECORD.unpack_from(data, offset)
+        offset += TILE_RECORD.size
+        tiles.append((z, x, y, bytes(data[offset:offset + length])))
+        offset += length
+    return tiles
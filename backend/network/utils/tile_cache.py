@@ -0,0 +1,161 @@
+import functools
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from django.conf import settings
+
+from network.utils.mbtiles import MBTiles
+from network.utils.tiles import tile_settings_version
+
+# Tiles are cached under a namespace per (base, sorted projects, auth_area, tile settings version), e.g. "12_40-41_all_3f9c2a1b".
+# Versions are append-only and a namespace names its exact set of changesets, so cached tiles never go stale and are
+# never invalidated; a change of the tile SQL or settings moves every network to new namespaces instead.
+NAMESPACE_RE = re.compile(r"^(?P<base>\d+)_(?P<projects>[\d-]*|base)_(?P<area>[\w]+)_(?P<version>[0-9a-f]+)$")
+
+def tile_namespace(base_id, project_ids, auth_area):
+    projects = "-".join(str(p) for p in sorted({int(p) for p in project_ids})) or "base"
+    area = re.sub(r"\W", "", str(auth_area)) or "none"
+    return f"{int(base_id)}_{projects}_{area}_{tile_settings_version()}"
+
+def tile_etag(data):
+    return '"' + hashlib.md5(data).hexdigest() + '"'
+
+############################## Backends ##############################
+
+class BaseTileCache:
+    '''
+    Interface of the tile cache backends. `get` returns None on a miss and b"" for a
+    cached empty tile, so empty tiles are not re-rendered either.
+    '''
+
+    def __init__(self, location):
+        self.location = location
+
+    def get(self, namespace, z, x, y):
+        raise NotImplementedError
+
+    def set(self, namespace, z, x, y, data):
+        raise NotImplementedError
+
+    def namespaces(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+class NullTileCache(BaseTileCache):
+    def get(self, namespace, z, x, y):
+        return None
+
+    def set(self, namespace, z, x, y, data):
+        pass
+
+    def namespaces(self):
+        return []
+
+    def stats(self):
+        return {"entries": 0, "bytes": 0}
+
+class FileSystemTileCache(BaseTileCache):
+    '''Stores tiles as <location>/<namespace>/<z>/<x>/<y>.mvt.'''
+
+    def _path(self, namespace, z, x, y):
+        return os.path.join(self.location, namespace, str(z), str(x), f"{y}.mvt")
+
+    def get(self, namespace, z, x, y):
+        try:
+            with open(self._path(namespace, z, x, y), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, namespace, z, x, y, data):
+        path = self._path(namespace, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial tile
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def namespaces(self):
+        if not os.path.isdir(self.location):
+            return []
+        return [d for d in os.listdir(self.location) if NAMESPACE_RE.match(d)]
+
+    def stats(self):
+        entries, size = 0, 0
+        for root, _, files in os.walk(self.location):
+            for name in files:
+                if name.endswith(".mvt"):
+                    entries += 1
+                    size += os.path.getsize(os.path.join(root, name))
+        return {"entries": entries, "bytes": size}
+
+class MBTilesTileCache(BaseTileCache):
+    '''Stores each namespace in its own <location>/<namespace>.mbtiles file.'''
+
+    def _mbtiles(self, namespace):
+        return MBTiles(os.path.join(self.location, f"{namespace}.mbtiles"))
+
+    def get(self, namespace, z, x, y):
+        return self._mbtiles(namespace).get_tile(z, x, y)
+
+    def set(self, namespace, z, x, y, data):
+        mbtiles = self._mbtiles(namespace)
+        if not mbtiles.exists():
+            mbtiles.create({"name": namespace, "type": "overlay"})
+        mbtiles.put_tile(z, x, y, data)
+
+    def namespaces(self):
+        if not os.path.isdir(self.location):
+            return []
+        names = [f[:-len(".mbtiles")] for f in os.listdir(self.location) if f.endswith(".mbtiles")]
+        return [n for n in names if NAMESPACE_RE.match(n)]
+
+    def stats(self):
+        entries, size = 0, 0
+        for namespace in self.namespaces():
+            s = self._mbtiles(namespace).stats()
+            entries += s["entries"]
+            size += s["bytes"]
+        return {"entries": entries, "bytes": size}
+
+BACKENDS = {
+    "none": NullTileCache,
+    "filesystem": FileSystemTileCache,
+    "mbtiles": MBTilesTileCache,
+}
+
+@functools.lru_cache(maxsize=None)
+def get_tile_cache():
+    '''The configured backend: an alias of BACKENDS or a dotted path to a BaseTileCache subclass.'''
+    backend = settings.TILE_CACHE["BACKEND"]
+    backend_cls = BACKENDS[backend] if backend in BACKENDS else import_string(backend)
+    return backend_cls(settings.TILE_CACHE["LOCATION"])
+
+############################## Counters ##############################
+
+def record_tile_cache(event):
+    '''Counts a "hit", "miss" or "pyramid" (served from a base network MBTiles). Counters live in Django's cache so a shared backend aggregates all workers.'''
+    key = f"tile_cache:{event}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+def tile_cache_counters():
+    counters = cache.get_many(["tile_cache:hit", "tile_cache:miss", "tile_cache:pyramid"])
+    hits = counters.get("tile_cache:hit", 0)
+    misses = counters.get("tile_cache:miss", 0)
+    pyramid = counters.get("tile_cache:pyramid", 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "pyramid_hits": pyramid,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+    }
@@ -0,0 +1,367 @@
+import hashlib
+import json
+import math
+
+from django.core.cache import cache
+from django.db import connection
+from django.conf import settings
+
+from network.utils.metrics import timed
+from network.utils.resolved import get_resolved_network
+SRID = settings.USE_SRID
+
+# Changesets of a ResolvedNetwork visible to an auth_area; both only change through the admin
+ALLOWED_CHANGESETS_TIMEOUT = 5 * 60
+
+# ST_AsMVTGeom extent and buffer of the tile layers
+MVT_EXTENT = 4096
+MVT_BUFFER = 256
+
+# Bump when the tiles build_tile_sql() renders change, so cached tiles and base pyramids of the previous SQL are no longer used
+TILE_SQL_VERSION = 1
+
+############################## Zoom Levels ##############################
+
+def get_simplification_tolerance(z):
+    if z < 8:
+        return 500
+    elif z < 10:
+        return 50
+    elif z < 12:
+        return 50
+    return 0  # full detail
+
+# Tolerance -> LinkVersion column holding the geometry simplified by it, stored in EPSG:3857 (see models.web_mercator)
+LINK_TILE_GEOMETRIES = {
+    0: "geom_3857",
+    50: "geom_3857_s50",
+    500: "geom_3857_s500",
+}
+
+def get_tile_geometry(z):
+    return LINK_TILE_GEOMETRIES[get_simplification_tolerance(z)]
+
+def get_detail_level(z):
+    if z >= 12:
+        return {
+            "nodes":"node_id, version, attributes, changeset_id, active",
+            "links":"link_id, version, f_node_id, t_node_id, attributes, changeset_id, active"
+            }
+    elif z >= 10:
+        return {
+            "nodes":"node_id, version, changeset_id, active",
+            "links":"link_id, version, f_node_id, t_node_id, changeset_id, active"
+            }
+    return {
+            "nodes":"node_id, version, changeset_id, active",
+            "links":"link_id, version, f_node_id, t_node_id, changeset_id, active"
+            }
+
+def tile_to_bounds(x, y, z):
+    n = 2 ** z
+    lon1 = x / n * 360.0 - 180.0
+    lat1 = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lon2 = (x + 1) / n * 360.0 - 180.0
+    lat2 = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lon1, lat2, lon2, lat1  # west, south, east, north
+
+############################## Tile SQL ##############################
+
+def tile_generalization():
+    return settings.TILE_GENERALIZATION
+
+def tile_settings_version():
+    '''Short hash of TILE_SQL_VERSION and TILE_GENERALIZATION, part of every tile cache namespace and base pyramid.'''
+    key = json.dumps([TILE_SQL_VERSION, tile_generalization()], sort_keys=True, default=str)
+    return hashlib.md5(key.encode()).hexdigest()[:8]
+
+def is_generalized(z):
+    '''Whether tile zoom `z` is drawn generalized: links thinned by facility class and merged into display-only lines.'''
+    return z < tile_generalization()["GENERALIZE_BELOW_ZOOM"]
+
+def facility_minzoom(facility_type):
+    '''Zoom from which a facility class is drawn on generalized tiles. None stands for the links whose type is NULL or not listed.'''
+    generalization = tile_generalization()
+    return generalization["FACILITY_MINZOOM"].get(facility_type, generalization["DEFAULT_MINZOOM"])
+
+def get_tile_facility_types(z):
+    '''
+    Facility classes whose links are drawn at zoom `z` of a generalized tile, from the most to the least important.
+    None, when present, is the class of the links with a NULL or unlisted facility_type.
+    '''
+    classes = list(tile_generalization()["FACILITY_MINZOOM"]) + [None]
+    drawn = [ft for ft in classes if facility_minzoom(ft) <= z]
+    return sorted(drawn, key=lambda ft: (facility_minzoom(ft), ft is None, ft or 0))
+
+def _link_layer_sql(z, link_geom, generalized):
+    '''CTEs selecting the links of the tile and their MVT geometries (mvt_links).'''
+    filters = f"""
+            WHERE lv.changeset_id = ANY(%(changesets)s)
+            AND lv.is_valid
+            AND lv.{link_geom} && (SELECT tile_3857 FROM tile_bounds)"""
+    if not generalized:
+        return f"""
+        latest_links AS (
+            SELECT lv.*
+            FROM network_linkversion lv
+            JOIN network_resolvedlink r ON r.link_version_id = lv.id AND r.resolved_network_id = %(resolved)s{filters}
+        ),
+        mvt_links AS (
+            SELECT ST_AsMVTGeom(
+                {link_geom},
+                (SELECT tile_3857 FROM tile_bounds),
+                4096, 256, true
+            ) AS geom,
+            {get_detail_level(z)["links"]}
+            FROM latest_links
+        )"""
+
+    # Active links of the drawn classes, chained into one line per run of touching links
+    # of the same facility type and changeset
+    return f"""
+        latest_links AS (
+            SELECT lv.facility_type, lv.changeset_id, lv.{link_geom} AS geom
+            FROM network_linkversion lv
+            JOIN network_resolvedlink r ON r.link_version_id = lv.id AND r.resolved_network_id = %(resolved)s{filters}
+            AND lv.active
+            AND (
+                lv.facility_type = ANY(%(facility_types)s)
+                OR (%(unknown_facility)s AND (lv.facility_type IS NULL OR NOT (lv.facility_type = ANY(%(known_facility_types)s))))
+            )
+        ),
+        merged_links AS (
+            -- GROUP BY keeps the links without a facility_type together in one NULL group
+            SELECT facility_type, changeset_id, (ST_Dump(ST_LineMerge(ST_Collect(geom)))).geom AS geom
+            FROM latest_links
+            GROUP BY facility_type, changeset_id
+        ),
+        mvt_links AS (
+            SELECT ST_AsMVTGeom(
+                geom,
+                (SELECT tile_3857 FROM tile_bounds),
+                4096, 256, true
+            ) AS geom,
+            facility_type, changeset_id, TRUE AS active
+            FROM merged_links
+        )"""
+
+def build_tile_sql(z, x, y):
+    '''
+    SQL rendering the 'links' and 'nodes' MVT layers of tile z/x/y.
+    Parameters are given by tile_sql_params().
+    The ResolvedNetwork is the one of the changesets visible to the viewer (area_resolved_network_id()), so
+    elements fall back to their latest visible version as they did when resolution ran per tile. Versions are
+    also filtered by those changeset ids and by the is_valid flag set when they are written; the SRID is
+    enforced by the geometry column types.
+    Geometries are read from the stored EPSG:3857 columns, pre-simplified for the zoom band, and matched
+    against the tile envelope through their GiST index, so nothing is transformed or simplified per request.
+
+    Below TILE_GENERALIZATION["NODE_MINZOOM"] the tile has no 'nodes' layer. Generalized zooms (is_generalized())
+    only draw the facility types given in the parameters, merged into display-only lines carrying
+    facility_type and changeset_id instead of link ids.
+    '''
+    z, x, y = int(z), int(x), int(y)
+    with_nodes = z >= tile_generalization()["NODE_MINZOOM"]
+
+    # Link geometry simplified for the zoom
+    link_geom = get_tile_geometry(z)
+
+    ctes = [f"""
+        tile_bounds AS (
+            SELECT ST_TileEnvelope({z}, {x}, {y}) AS tile_3857
+        )""", _link_layer_sql(z, link_geom, is_generalized(z))]
+    layers = ["SELECT ST_AsMVT(q1, 'links', 4096, 'geom') FROM mvt_links q1"]
+
+    if with_nodes:
+        ctes.append(f"""
+        latest_nodes AS (
+            SELECT nv.*
+            FROM network_nodeversion nv
+            JOIN network_resolvednode r ON r.node_version_id = nv.id AND r.resolved_network_id = %(resolved)s
+            WHERE nv.changeset_id = ANY(%(changesets)s)
+            AND nv.is_valid
+            AND nv.geom_3857 && (SELECT tile_3857 FROM tile_bounds)
+        ),
+        mvt_nodes AS (
+            SELECT ST_AsMVTGeom(
+                nv.geom_3857,
+                (SELECT tile_3857 FROM tile_bounds),
+                4096, 256, true
+            ) AS geom,
+            {get_detail_level(z)["nodes"]}
+            FROM latest_nodes nv
+        )""")
+        layers.append("SELECT ST_AsMVT(q2, 'nodes', 4096, 'geom') FROM mvt_nodes q2")
+
+    return f"""
+        WITH {",".join(ctes)}
+        SELECT {" || ".join(f"({layer})" for layer in layers)} AS tile;
+        """
+
+def _resolved_changesets(resolved_network_id):
+    '''[(changeset id, auth_area)] of a ResolvedNetwork, read once and cached. Its membership never changes.'''
+    key = f"tile_changesets:{int(resolved_network_id)}"
+    changesets = cache.get(key)
+    if changesets is None:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT c.id, c.auth_area
+                FROM network_resolvednetwork_changesets rc
+                JOIN network_changeset c ON c.id = rc.changeset_id
+                WHERE rc.resolvednetwork_id = %s
+                ORDER BY c.id
+            """, [int(resolved_network_id)])
+            changesets = cursor.fetchall()
+        cache.set(key, changesets, ALLOWED_CHANGESETS_TIMEOUT)
+    return changesets
+
+def allowed_changeset_ids(resolved_network_id, auth_area):
+    '''Ids of the changesets of a ResolvedNetwork whose auth_area is `auth_area`.'''
+    return [cs_id for cs_id, area in _resolved_changesets(resolved_network_id) if area == auth_area]
+
+def area_resolved_network_id(resolved_network_id, auth_area):
+    '''
+    Id of the ResolvedNetwork drawn for a viewer of `auth_area`, None when no changeset is visible.
+    When some changesets are outside the auth_area, an element whose latest version is in one of them
+    falls back to its latest visible version: the network is resolved again over the visible subset only,
+    as a snapshot of its own.
+    '''
+    changeset_ids = allowed_changeset_ids(resolved_network_id, auth_area)
+    if not changeset_ids:
+        return None
+    if len(changeset_ids) == len(_resolved_changesets(resolved_network_id)):
+        return int(resolved_network_id)
+    return get_resolved_network(changeset_ids).id
+
+def tile_sql_params(z, resolved_network_id, changeset_ids, facility_types=None):
+    '''Parameters of build_tile_sql(). `facility_types` defaults to the classes drawn at zoom `z` (get_tile_facility_types()).'''
+    if facility_types is None:
+        facility_types = get_tile_facility_types(z)
+    return {
+        "resolved": int(resolved_network_id),
+        "changesets": list(changeset_ids),
+        "facility_types": [ft for ft in facility_types if ft is not None],
+        "unknown_facility": None in facility_types,
+        "known_facility_types": list(tile_generalization()["FACILITY_MINZOOM"]),
+    }
+
+@timed("tile_sql")
+def render_tile(z, x, y, resolved_network_id, auth_area):
+    '''
+    Renders tile z/x/y of a ResolvedNetwork. Returns the MVT bytes or None when the tile is empty.
+    A generalized tile larger than TILE_GENERALIZATION["MAX_TILE_BYTES"] is rendered again without its
+    least important facility class, until it fits or a single class is left.
+    '''
+    resolved_network_id = area_resolved_network_id(resolved_network_id, auth_area)
+    if resolved_network_id is None:
+        return None
+    changeset_ids = allowed_changeset_ids(resolved_network_id, auth_area)
+    sql = build_tile_sql(z, x, y)
+    facility_types = get_tile_facility_types(z)
+    max_bytes = tile_generalization()["MAX_TILE_BYTES"]
+
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(sql, tile_sql_params(z, resolved_network_id, changeset_ids, facility_types))
+            row = cursor.fetchone()
+            tile = row[0] if row else None
+            if not is_generalized(z) or tile is None or len(tile) <= max_bytes:
+                return tile
+            # Drop the classes drawn from the highest zoom
+            last = max(facility_minzoom(ft) for ft in facility_types)
+            kept = [ft for ft in facility_types if facility_minzoom(ft) < last]
+            if not kept:
+                return tile
+            facility_types = kept
+
+def tile_has_features(z, x, y, resolved_network_id):
+    '''True when any node or link of the ResolvedNetwork intersects tile z/x/y, even if it renders empty.'''
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH b AS (SELECT ST_TileEnvelope({int(z)}, {int(x)}, {int(y)}) AS bounds)
+            SELECT EXISTS (
+                SELECT 1 FROM network_linkversion lv
+                JOIN network_resolvedlink r ON r.link_version_id = lv.id AND r.resolved_network_id = %s, b
+                WHERE lv.geom_3857 && b.bounds
+            ) OR EXISTS (
+                SELECT 1 FROM network_nodeversion nv
+                JOIN network_resolvednode r ON r.node_version_id = nv.id AND r.resolved_network_id = %s, b
+                WHERE nv.geom_3857 && b.bounds
+            )
+        """, [resolved_network_id, resolved_network_id])
+        return cursor.fetchone()[0]
+
+@timed("tile_touched_by_projects")
+def tile_touched_by_projects(z, x, y, base_id, project_ids):
+    '''
+    True when tile z/x/y of `base_id` + `project_ids` can differ from the base-only tile:
+    a project version lies in the tile, or a base version in the tile is superseded by a project.
+    The tile is widened by the buffer ST_AsMVTGeom draws (256 of 4096 units), so a project feature just
+    outside it still counts.
+    '''
+    project_ids = [int(p) for p in project_ids]
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH b AS (SELECT ST_TileEnvelope({int(z)}, {int(x)}, {int(y)}, margin => {MVT_BUFFER / MVT_EXTENT}) AS bounds)
+            SELECT EXISTS (
+                SELECT 1 FROM network_linkversion lv, b
+                WHERE lv.changeset_id = ANY(%(projects)s) AND lv.geom_3857 && b.bounds
+            ) OR EXISTS (
+                SELECT 1 FROM network_nodeversion nv, b
+                WHERE nv.changeset_id = ANY(%(projects)s) AND nv.geom_3857 && b.bounds
+            ) OR EXISTS (
+                SELECT 1 FROM network_linkversion lv, b
+                WHERE lv.changeset_id = %(base)s AND lv.geom_3857 && b.bounds
+                AND EXISTS (
+                    SELECT 1 FROM network_linkversion p
+                    WHERE p.link_id = lv.link_id AND p.changeset_id = ANY(%(projects)s)
+                )
+            ) OR EXISTS (
+                SELECT 1 FROM network_nodeversion nv, b
+                WHERE nv.changeset_id = %(base)s AND nv.geom_3857 && b.bounds
+                AND EXISTS (
+                    SELECT 1 FROM network_nodeversion p
+                    WHERE p.node_id = nv.node_id AND p.changeset_id = ANY(%(projects)s)
+                )
+            )
+        """, {"base": int(base_id), "projects": project_ids})
+        return cursor.fetchone()[0]
+
+def lonlat_to_tile(lon, lat, z):
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def bbox_to_tile_range(west, south, east, north, z):
+    '''Inclusive (xmin, xmax, ymin, ymax) of the tiles of zoom z covering a lon/lat bbox.'''
+    xmin, ymin = lonlat_to_tile(west, north, z)
+    xmax, ymax = lonlat_to_tile(east, south, z)
+    return xmin, xmax, ymin, ymax
+
+def changeset_bbox(changeset_id):
+    '''
+    Lon/lat bbox of everything a changeset touched: its own versions and the
+    earlier versions of the same elements (so moved features clear their old tiles too).
+    Returns (west, south, east, north) or None when the changeset has no versions.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT ST_XMin(ext), ST_YMin(ext), ST_XMax(ext), ST_YMax(ext)
+            FROM (
+                SELECT ST_Extent(ST_Transform(geometry, 4326)) AS ext
+                FROM (
+                    SELECT geometry FROM network_nodeversion
+                    WHERE node_id IN (SELECT node_id FROM network_nodeversion WHERE changeset_id = %s)
+                    UNION ALL
+                    SELECT geometry FROM network_linkversion
+                    WHERE link_id IN (SELECT link_id FROM network_linkversion WHERE changeset_id = %s)
+                ) touched
+            ) e
+        """, [changeset_id, changeset_id])
+        row = cursor.fetchone()
+
+    if not row or row[0] is None:
+        return None
+    return row
@@ -0,0 +1,101 @@
+import struct
+import time
+import zipfile
+import zlib
+from collections import namedtuple
+
+# Bytes read from a member file per write into the archive
+READ_CHUNK = 1024 * 1024
+
+class _UnseekableSink:
+    '''
+    Write-only buffer handed to zipfile. It has no seek(), so zipfile writes data descriptors
+    after each member instead of seeking back to patch the local headers.
+    '''
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def write(self, data):
+        self._buffer += data
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+def stream_zip(members, compression=zipfile.ZIP_STORED, compresslevel=None):
+    '''
+    Yields a zip archive of `members`, an iterable of (arcname, path), as byte chunks.
+    Only one READ_CHUNK of one member is held in memory at a time.
+    '''
+    sink = _UnseekableSink()
+    with zipfile.ZipFile(sink, "w", compression=compression, compresslevel=compresslevel) as zf:
+        for arcname, path in members:
+            with open(path, "rb") as src, zf.open(arcname, "w", force_zip64=True) as dest:
+                while True:
+                    chunk = src.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+############################## Precompressed Members ##############################
+
+# A member compressed ahead of time, e.g. in another process. `data` is raw deflate (ZIP_DEFLATED) or the bytes as-is (ZIP_STORED).
+ZipMember = namedtuple("ZipMember", ["arcname", "method", "crc", "size", "data"])
+
+ZIP32_LIMIT = 0xFFFFFFFF
+UTF8_FLAG = 0x0800
+
+def compress_member(arcname, data, compresslevel=9):
+    '''ZipMember of `data`: deflated at `compresslevel` (1-9), or stored when compresslevel is 0.'''
+    if compresslevel:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        return ZipMember(arcname, zipfile.ZIP_DEFLATED, zlib.crc32(data), len(data), compressed)
+    return ZipMember(arcname, zipfile.ZIP_STORED, zlib.crc32(data), len(data), data)
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+def stream_zip_members(members):
+    '''
+    Yields a zip archive of ZipMembers, one member per chunk, in the order `members` produces them,
+    so members compressed in parallel can be sent as soon as each one is ready.
+    '''
+    dos_time, dos_date = _dos_datetime(time.time())
+    offset = 0
+    central = []
+    for member in members:
+        name = member.arcname.encode("utf-8")
+        if offset > ZIP32_LIMIT or len(member.data) > ZIP32_LIMIT or member.size > ZIP32_LIMIT:
+            raise ValueError("Netchange archive too large for a zip32 member.")
+        fields = (20, UTF8_FLAG, member.method, dos_time, dos_date, member.crc, len(member.data), member.size, len(name))
+        local = struct.pack("<IHHHHHIIIHH", 0x04034B50, *fields, 0) + name
+        central.append(struct.pack("<IH", 0x02014B50, 20) + struct.pack("<HHHHHIIIHHHHHII", *fields, 0, 0, 0, 0, 0o644 << 16, offset) + name)
+        yield local + member.data
+        offset += len(local) + len(member.data)
+
+    directory = b"".join(central)
+    if len(central) > 0xFFFF or offset + len(directory) > ZIP32_LIMIT:
+        raise ValueError("Netchange archive too large for a zip32 directory.")
+    yield directory + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(directory), offset, 0)
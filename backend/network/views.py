@@ -1,12 +1,9 @@
 ############################## Libraries ##############################
 from django.utils import timezone
-from django.http import JsonResponse, FileResponse, HttpResponse
+from django.http import JsonResponse, FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.contrib.gis.geos import GEOSGeometry, Point, LineString
 from django.contrib.auth import get_user_model
-from django.db.models.functions import RowNumber
-from django.db.models import F, Window
-from django.db import connection
+from django.db import transaction
 from django.conf import settings
 
 from rest_framework.views import APIView
@@ -16,23 +13,37 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from .models import Changeset, Node, NodeVersion, Link, LinkVersion
-from .serializers import ChangesetSerializer, CustomUserSignupSerializer, UserProfileSerializer
-from .utils.scripts import detect_conflicts, build_network_from_changesets, build_dependency_tree
+from .models import Changeset, Job
+from .serializers import ChangesetSerializer, CustomUserSignupSerializer, UserProfileSerializer, JobSerializer
+from .utils.scripts import detect_conflicts, build_dependency_tree
+from .utils.resolved import get_resolved_network
+from .utils.conflict_cache import get_conflicts
+from .utils.ingest import ingest_base_network
+from .utils.netchange_stream import NetChangeFormatError, read_netchange, apply_netchange_stream
+from .utils.netchange_format import NETCHANGE_FORMATS, netchange_format_for, encode_netchange_member
+from .utils.zipstream import stream_zip_members
+from .utils.diff import compare_gdf
+from .utils.lookup import resolve_node_ids, resolve_link_ids
+from .utils.export import EXPORT_FORMATS, write_network_export, stream_export_zip, read_layer
+from .utils.tile_batch import NetworkTiles, TILE_BATCH_CONTENT_TYPE, parse_tile_list, get_tiles, encode_tile_batch
+from .utils.jobs import JOB_HANDLERS, SUPERUSER_JOBS, submit_job, no_progress, job_dir, job_input_path, job_result_path
+from .utils.tile_cache import get_tile_cache, tile_etag, tile_cache_counters
+from .utils.metrics import StageTimer, histograms, histograms_are_shared, reset_histograms
+from .middleware import list_profiles, profile_path
 
 import os
 import io
+import contextlib
 import zipfile
 import tempfile
 import json
-import numpy as np
-import math
-import geopandas as gpd
-import pandas as pd
+import pyogrio
 import warnings
 warnings.filterwarnings('ignore')
-import time
-from shapely.geometry import mapping
+import pstats
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 SRID = settings.USE_SRID
 
@@ -99,7 +110,6 @@ class ToChangeFileView(APIView):
 
     def post(self, request):
         try:
-            t0=time.time()
             format = request.data.get("format")
             base_id = request.data.get("base_changeset_id")
             project_ids = request.data.get("project_changeset_ids")
@@ -110,301 +120,238 @@ class ToChangeFileView(APIView):
             files = request.data.get("files")
             # auth_area = request.user.auth_area
 
-            all_changeset_ids = [base_id] + project_ids
-            changeset_ids_sql = ",".join([str(i) for i in all_changeset_ids])
-            print(f"Inputs: {time.time()-t0:.2f} seconds")
-
             if base_id and files:
-                if format == "shapefiles":
-                    uploaded_nodes, uploaded_links = load_nodes_and_links_from_zip(files)
+                if format != "shapefiles":
                 # elif format == "cubelog":
                 #     uploaded_nodes, uploaded_links = load_nodes_and_links_from_cubelogs(files)
-                else:
                     return Response({"error": f"format {format} not accepted. Try shapefiles."}, status=400)
             else:
                 return Response({"error": "Missing required fields."}, status=400)
 
-            # Check for duplicates
-            if 'node_id' in uploaded_nodes.columns and 'link_id' in uploaded_links.columns:
-                raise Exception("NOT ACTIVE")
-                # duplicated_nodes = uploaded_nodes.duplicated(subset=['id'])
-                # duplicated_links = uploaded_links.duplicated(subset=['id'])
-                # list_of_duplicated_nodes = list(set(uploaded_nodes.loc[duplicated_nodes, 'id']) - set(['-1']))
-                # list_of_duplicated_links = list(set(uploaded_links.loc[duplicated_links, 'id']) - set(['-1']))
-            else:
-                if "n" in uploaded_nodes.columns:
-                    node_df = pd.read_sql(f"""
-                                            SELECT node_id, attributes
-                                            FROM network_nodeversion nv 
-                                            WHERE nv.changeset_id IN ({changeset_ids_sql}) 
-                                            """, 
-                                            connection)
-                    node_atts = node_df['attributes'].apply(json.loads).tolist()
-                    node_atts_df = pd.DataFrame(node_atts)
-                    node_atts_df.columns = [c.lower() for c in node_atts_df.columns]
-                    node_id_map = dict(zip(node_atts_df['n'], node_df['node_id']))
-                    uploaded_nodes['node_id'] = uploaded_nodes['n'].apply(lambda n: node_id_map[n] if n in node_id_map else -1)
-                    
-                    link_df = pd.read_sql(f"""
-                                            SELECT link_id, attributes
-                                            FROM network_linkversion lv 
-                                            WHERE lv.changeset_id IN ({changeset_ids_sql}) 
-                                            """, 
-                                            connection)
-                    link_atts = link_df['attributes'].apply(json.loads).tolist()
-                    link_atts_df = pd.DataFrame(link_atts)
-                    link_atts_df.columns = [c.lower() for c in link_atts_df.columns]
-                    link_atts_df['ab'] = link_atts_df['a'].astype(str) + '_' + link_atts_df['b'].astype(str)
-                    link_id_map = dict(zip(link_atts_df['ab'], link_df['link_id']))
-                    uploaded_links['link_id'] = uploaded_links[['a','b']].apply(lambda r: link_id_map[f"{r.a}_{r.b}"] if f"{r.a}_{r.b}" in link_id_map else -1, axis=1)
-                else:
-                    raise Exception('Your shapefiles must either have id or N, A and B.')
-
-            print(f"ID: {time.time()-t0:.2f} seconds")
-
-            # Pull reference network
-            sql_lv = f"""
-            WITH latest_links AS (
-                SELECT DISTINCT ON (link_id) *
-                FROM network_linkversion lv
-                WHERE lv.changeset_id IN ({changeset_ids_sql})
-                ORDER BY link_id, version DESC
-            )
-            SELECT * FROM latest_links;
-            """
-
-            sql_nv = f"""
-            WITH latest_nodes AS (
-                SELECT DISTINCT ON (node_id) *
-                FROM network_nodeversion nv
-                WHERE nv.changeset_id IN ({changeset_ids_sql})
-                ORDER BY node_id, version DESC
-            )
-            SELECT * FROM latest_nodes;
-            """
-
-            with connection.cursor():
-                ref_links = gpd.read_postgis(sql_lv, connection.connection, geom_col='geometry')
-                ref_nodes = gpd.read_postgis(sql_nv, connection.connection, geom_col='geometry')
-            ref_links = expand_attributes(ref_links)
-            ref_nodes = expand_attributes(ref_nodes)
-            print(f"Ref: {time.time()-t0:.2f} seconds")
-
-            # Ensure CRS match
-            uploaded_nodes = uploaded_nodes.to_crs(ref_nodes.crs)
-            uploaded_links = uploaded_links.to_crs(ref_links.crs)
-
-            # Compare and collect changes
-            node_changes = compare_gdf(ref_nodes, uploaded_nodes, 'node')
-            link_changes = compare_gdf(ref_links, uploaded_links, 'link')
-
-            # Group by pid
-            grouped = {}
-            for change in node_changes + link_changes:
-                pid = change["data"].get("properties", {}).get("pid")
-                if not pid:
-                    pid = pid_inp
-                    # return Response({"error": "No valid 'pid' found in features."}, status=400) # temporary
-                grouped.setdefault(pid, []).append(change)
-
-            if not grouped:
+            # Netchange files are Arrow when the client accepts application/vnd.apache.arrow.stream
+            netchange_format = netchange_format_for(request.META.get("HTTP_ACCEPT"))
+            compresslevel = parse_compresslevel(request.data.get("compresslevel"))
+            if compresslevel is None:
+                return Response({"error": "compresslevel must be an integer from 0 (stored) to 9."}, status=400)
+
+            groups = diff_netchange_groups(request.user, base_id, project_ids, pid_inp, editor_inp, comment_inp, files, netchange_format)
+            file_count = len(groups)
+            if not file_count:
                 return Response({"error": "No valid 'pid' found in features."}, status=400)
-            print(f"Group: {time.time()-t0:.2f} seconds")
-
-            # Create temp dir and zip file
-            with tempfile.TemporaryDirectory() as tmpdir:
-                zip_path = os.path.join(tmpdir, "netchange_files.zip")
-                with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as zipf:
-                    for pid, operations in grouped.items():
-                        netchange = {
-                            "changeset": {
-                                "base_network": str(base_id),
-                                "depends_on": [str(p) for p in project_ids],
-                                "pid": pid_inp,
-                                "comment": comment_inp,
-                                "user": request.user.username,
-                                "editor": editor_inp,
-                                "create_at": timezone.now().strftime("%Y-%m-%d %H:%M:%S %Z%z"),
-                            },
-                            "operations": operations
-                        }
-                        safe_pid = str(pid).replace("/", "").replace("\\", "").replace(":", "").replace("-", "")
-                        file_path = os.path.join(tmpdir, f"netchange_{safe_pid}.json")
-                        with open(file_path, "w") as f:
-                            json.dump(netchange, f, indent=2)
-                        zipf.write(file_path, arcname=os.path.basename(file_path))
-                        print(f"Zip pid: {time.time()-t0:.2f} seconds")
-                with open(zip_path, 'rb') as f:
-                    zip_data = f.read()
-            mem_zip = io.BytesIO(zip_data)
-            response = FileResponse(mem_zip, content_type='application/zip')
+
+            # Members are encoded in parallel and sent as each one is ready. The first one is awaited here,
+            # so an encoding error still gets an error status rather than a cut archive.
+            members = iter_netchange_members(groups, netchange_format, compresslevel)
+            first = next(members)
+            response = StreamingHttpResponse(stream_netchange_zip(itertools.chain([first], members)), content_type='application/zip')
             response['Content-Disposition'] = 'attachment; filename="netchange_files.zip"'
-            response['X-File-Count'] = str(len(grouped))
-            print(f"Response: {time.time()-t0:.2f} seconds")
+            response['X-File-Count'] = str(file_count)
             return response
 
         except Exception as e:
             print({"error": str(e)})
             return Response({"error": str(e)}, status=500)
 
-def load_nodes_and_links_from_zip(file):
-    """Extracts both 'nodes.shp' and 'links.shp' from a single zip file and returns them as GeoDataFrames."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        with zipfile.ZipFile(file) as archive:
-            archive.extractall(tmpdir)
-
-        def find_shp(contains_txt):
-            for fname in os.listdir(tmpdir):
-                if contains_txt in fname.lower() and fname.endswith(".shp"):
-                    return os.path.join(tmpdir, fname)
-            raise ValueError(f"{contains_txt} shp not found in archive.")
-
-        nodes_path = find_shp("node")
-        links_path = find_shp("link")
-
-        gdf_nodes = gpd.read_file(nodes_path, engine='pyogrio')
-        gdf_links = gpd.read_file(links_path, engine='pyogrio')
-
-        gdf_nodes.columns = [c.lower() for c in gdf_nodes.columns]
-        gdf_links.columns = [c.lower() for c in gdf_links.columns]
-
-        return gdf_nodes, gdf_links
-    
-def expand_attributes(gdf):
-    gdf = gdf.copy()
+def diff_netchange_groups(user, base_id, project_ids, pid_inp, editor_inp, comment_inp, files, netchange_format="json", progress=no_progress):
+    '''
+    Compares uploaded node/link shapefiles with the network of `base_id` + `project_ids` and groups
+    the changes by pid. Returns [(arcname, changeset header, operations)], one netchange file per pid.
+    '''
+    timer = StageTimer("to_netchange")
+    all_changeset_ids = [base_id] + project_ids
+
+    progress("load")
+    uploaded_nodes, uploaded_links = load_nodes_and_links_from_zip(files)
+    timer.mark("load", len(uploaded_nodes) + len(uploaded_links))
+
+    # Check for duplicates
+    progress("ids")
+    if 'node_id' in uploaded_nodes.columns and 'link_id' in uploaded_links.columns:
+        raise Exception("NOT ACTIVE")
+        # duplicated_nodes = uploaded_nodes.duplicated(subset=['id'])
+        # duplicated_links = uploaded_links.duplicated(subset=['id'])
+        # list_of_duplicated_nodes = list(set(uploaded_nodes.loc[duplicated_nodes, 'id']) - set(['-1']))
+        # list_of_duplicated_links = list(set(uploaded_links.loc[duplicated_links, 'id']) - set(['-1']))
+    else:
+        if "n" in uploaded_nodes.columns:
+            # Match N and A/B against the latest active versions of the reference network
+            resolved = get_resolved_network(all_changeset_ids)
+            uploaded_nodes['node_id'] = resolve_node_ids(uploaded_nodes, resolved.id)
+            uploaded_links['link_id'] = resolve_link_ids(uploaded_links, resolved.id)
+        else:
+            raise Exception('Your shapefiles must either have id or N, A and B.')
+
+    timer.mark("ids", len(uploaded_nodes) + len(uploaded_links))
+
+    # Pull reference network
+    progress("reference")
+    # Typed columns straight from SQL: promoted attributes as columns, the rest via ->> (no JSON parsing here)
+    ref_links = read_layer(resolved.id, "links", active_only=False)
+    ref_nodes = read_layer(resolved.id, "nodes", active_only=False)
+    ref_links.columns = [c.lower() for c in ref_links.columns]
+    ref_nodes.columns = [c.lower() for c in ref_nodes.columns]
+    timer.mark("reference", len(ref_nodes) + len(ref_links))
+
+    # Ensure CRS match
+    uploaded_nodes = uploaded_nodes.to_crs(ref_nodes.crs)
+    uploaded_links = uploaded_links.to_crs(ref_links.crs)
+
+    # Compare and collect changes
+    progress("compare")
+    node_changes = compare_gdf(ref_nodes, uploaded_nodes, 'node')
+    link_changes = compare_gdf(ref_links, uploaded_links, 'link')
+    timer.mark("compare", len(node_changes) + len(link_changes))
+
+    # Group by pid
+    grouped = {}
+    for change in node_changes + link_changes:
+        pid = change["data"].get("properties", {}).get("pid")
+        if not pid:
+            pid = pid_inp
+            # return Response({"error": "No valid 'pid' found in features."}, status=400) # temporary
+        grouped.setdefault(pid, []).append(change)
+
+    timer.mark("group", len(grouped))
+
+    _, extension = NETCHANGE_FORMATS[netchange_format]
+    groups = []
+    for pid, operations in grouped.items():
+        header = {
+            "base_network": str(base_id),
+            "depends_on": [str(p) for p in project_ids],
+            "pid": pid_inp,
+            "comment": comment_inp,
+            "user": user.username,
+            "editor": editor_inp,
+            "create_at": timezone.now().strftime("%Y-%m-%d %H:%M:%S %Z%z"),
+        }
+        safe_pid = str(pid).replace("/", "").replace("\\", "").replace(":", "").replace("-", "")
+        groups.append((f"netchange_{safe_pid}{extension}", header, operations))
+    return groups
+
+def parse_compresslevel(value, default=9):
+    '''Zip compression level of a request (0 stores, 1-9 deflate), `default` when absent and None when invalid.'''
+    if value in (None, ""):
+        return default
+    try:
+        level = int(value)
+    except (TypeError, ValueError):
+        return None
+    return level if 0 <= level <= 9 else None
+
+def iter_netchange_members(groups, netchange_format="json", compresslevel=9, workers=None):
+    '''
+    ZipMembers of the netchange files, serialized and compressed in a process pool and yielded as they
+    complete. Pending members are cancelled if the consumer stops early (e.g. the client disconnects).
+    '''
+    workers = min(len(groups), workers or settings.NETCHANGE_WORKERS)
+    if workers <= 1:
+        for arcname, header, operations in groups:
+            yield encode_netchange_member(arcname, header, operations, netchange_format, compresslevel)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(encode_netchange_member, arcname, header, operations, netchange_format, compresslevel)
+                   for arcname, header, operations in groups]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def stream_netchange_zip(members):
+    '''
+    stream_zip_members() for a response whose headers are already sent. A member failing mid-stream ends the
+    body without the central directory, so the client is left with a visibly invalid archive, and is logged.
+    '''
+    try:
+        yield from stream_zip_members(members)
+    except Exception:
+        traceback.print_exc()
+
+def write_netchange_zip(zip_path, user, base_id, project_ids, pid_inp, editor_inp, comment_inp, files, progress=no_progress, netchange_format="json", compresslevel=9):
+    '''Writes the netchange files of diff_netchange_groups() into the zip at `zip_path`. Returns the number of files.'''
+    groups = diff_netchange_groups(user, base_id, project_ids, pid_inp, editor_inp, comment_inp, files, netchange_format, progress)
+    if not groups:
+        return 0
+    progress("zip", message=f"{len(groups)} netchange files")
+    with open(zip_path, "wb") as f:
+        for chunk in stream_zip_members(iter_netchange_members(groups, netchange_format, compresslevel)):
+            f.write(chunk)
+    return len(groups)
+
+def run_to_netchange_job(job, progress):
+    p = job.params
+    if p.get("format") != "shapefiles":
+        raise ValueError(f"format {p.get('format')} not accepted. Try shapefiles.")
+    if (p.get("netchange_format") or "json") not in NETCHANGE_FORMATS:
+        raise ValueError(f"netchange_format {p.get('netchange_format')} not supported. Use one of: {', '.join(NETCHANGE_FORMATS)}.")
+    if parse_compresslevel(p.get("compresslevel")) is None:
+        raise ValueError("compresslevel must be an integer from 0 (stored) to 9.")
+    # Parsed into a list of ids by JobSubmitView
+    project_ids = p.get("project_changeset_ids") or []
+
+    file_count = write_netchange_zip(os.path.join(job_dir(job.id), "netchange_files.zip"), job.user, p.get("base_changeset_id"),
+                                     project_ids, p.get("pid"), p.get("editor"), p.get("comment"), job_input_path(job, "files"), progress,
+                                     p.get("netchange_format") or "json", parse_compresslevel(p.get("compresslevel")))
+    if not file_count:
+        raise ValueError("No valid 'pid' found in features.")
+    return {"file_count": file_count}, "netchange_files.zip"
+
+def _find_shp(names, contains_txt):
+    for name in names:
+        fname = os.path.basename(name)
+        if contains_txt in fname.lower() and fname.lower().endswith(".shp") and not name.startswith("__MACOSX"):
+            return name
+    raise ValueError(f"{contains_txt} shp not found in archive.")
+
+def _read_zip_member(source, member, columns=None, bbox=None, where=None):
+    '''
+    Reads one shapefile of a zip with pyogrio's Arrow reader. `source` is a path, read through /vsizip/,
+    or the zip bytes (members at the root only). `columns` are matched case-insensitively.
+    '''
+    if isinstance(source, bytes):
+        path, layer = source, os.path.splitext(os.path.basename(member))[0]
+    else:
+        path, layer = f"/vsizip/{source}/{member}", None
+    if columns is not None:
+        wanted = {c.lower() for c in columns}
+        columns = [f for f in pyogrio.read_info(path, layer=layer)["fields"] if f.lower() in wanted]
+    gdf = pyogrio.read_dataframe(path, layer=layer, columns=columns, bbox=bbox, where=where, use_arrow=True)
     gdf.columns = [c.lower() for c in gdf.columns]
-    if "attributes" in gdf.columns and not gdf["attributes"].isnull().all():
-        parsed_dicts = [json.loads(s) for s in gdf["attributes"]]
-        attr_df = pd.DataFrame(parsed_dicts)
-        attr_df.columns = [c.lower() for c in attr_df.columns]
-        overlapping_cols = set(attr_df.columns) & set(gdf.columns)
-        attr_df.drop(columns=overlapping_cols, inplace=True)
-        gdf = pd.concat([gdf.drop(columns=["attributes"]), attr_df], axis=1)
     return gdf
 
-def geometry_to_dict(geom):
-    geo = mapping(geom)
-    return {
-        "type": geo["type"],
-        "coordinates": geo["coordinates"]
-    }
-
-def compare_gdf(original, edited, element_type, ignore=['geometry','geometrysou','geometrysource','x','y','dist','changeset_id','created_at','node_id','active','version'], geom_tol=1e-2, attr_tol=1e-2):
-    # Rows (ids)
-    if element_type == "node":
-        id_col = "node_id"
-    elif element_type == "link":
-        id_col = "link_id"
-    else:
-        raise Exception(f"Invalid element_type {element_type}. Use 'node' or 'link'.")
-
-    original.columns = [c for c in original.columns]
-    edited.columns = [c for c in edited.columns]
-
-    original = original.set_index(id_col)
-    edited = edited.set_index(id_col)
-    changes = []
-
-    orig_ids = set(original.index)
-    edit_ids = set(edited.index)
-
-    ## Compare ids
-    created = edit_ids - orig_ids
-    deleted = orig_ids - edit_ids
-    possibly_modified = edit_ids & orig_ids
-    
-    # Cols (fields)
-    ignore = set([c for c in ignore])
-    cols1 = set([c for c in original.columns])
-    cols2 = set([c for c in edited.columns])
-    
-    ## Compare cols
-    cols_inter = (cols1 & cols2) - ignore # intersection
-    
-    # Same shape possibly-modified dfs
-    orig_mod = original.loc[list(possibly_modified), list(cols_inter)]
-    edit_mod = edited.loc[list(possibly_modified), list(cols_inter)]
-    
-    # Geometry columns
-    orig_mod_geom = original.loc[list(possibly_modified), 'geometry']
-    edit_mod_geom = edited.loc[list(possibly_modified), 'geometry']
-
-    # Compare cols but geometry
-    comp_nongeom = compare_dataframes_with_tolerance(orig_mod, edit_mod, rtol=attr_tol, atol=attr_tol)
-    ids_modified_nongeom = edit_mod.index[comp_nongeom.sum(axis=1)>0]
-
-    # Compare geometry
-    comp_geom = orig_mod_geom.geom_equals_exact(edit_mod_geom, tolerance=geom_tol)
-    ids_modified_geom = edit_mod.index[~comp_geom]
-
-    # Final confirmed list of ids modified
-    ids_modified = set(ids_modified_nongeom) | set(ids_modified_geom)
-
-    # Rename columns back to full name (>10 chars)
-    # edited.columns = [edit_cols_map[c] for c in edited.columns]
-
-    for obj_id in created:
-        rows = edited.loc[[obj_id]]
-        for r in range(rows.shape[0]):
-            row = rows.iloc[r]
-            changes.append({
-                "id": obj_id,
-                "type": element_type,
-                "action": "create",
-                "data": {
-                    "geometry": geometry_to_dict(row.geometry),
-                    "properties": row.drop("geometry").dropna().to_dict()
-                    }
-            })
-
-    for obj_id in deleted:
-        changes.append({
-            "id": obj_id,
-            "type": element_type,
-            "action": "delete",
-            "data": {}
-        })
-
-    for obj_id in ids_modified:
-        row = edited.loc[obj_id]
-        changes.append({
-            "id": obj_id,
-            "type": element_type,
-            "action": "modify",
-            "data": {
-                "geometry": geometry_to_dict(row.geometry),
-                "properties": row.drop("geometry").dropna().to_dict()
-                }
-        })
-    return changes
-
-def compare_dataframes_with_tolerance(df1, df2, rtol=1e-5, atol=1e-8):
+def load_nodes_and_links_from_zip(file, columns=None, bbox=None, nodes_where=None, links_where=None):
     """
-    Compares two pandas DataFrames element-wise, considering tolerance for numerical columns.
-    Returns a DataFrame of booleans indicating where values are not close.
+    Reads 'nodes.shp' and 'links.shp' straight out of a zip (a path or an uploaded file) and returns them as GeoDataFrames.
+    Nothing is extracted: files on disk are read through GDAL's /vsizip/ and in-memory uploads from their bytes.
+    `columns` limits the attributes read; `bbox` (minx, miny, maxx, maxy) and the per-layer `*_where` (OGR SQL)
+    filters are applied by GDAL while reading.
     """
-    if not df1.shape == df2.shape:
-        raise ValueError("DataFrames must have the same shape for element-wise comparison.")
-
-    # Convert to numeric where possible to enable tolerance comparison
-    df1_numeric = df1.apply(pd.to_numeric, errors='coerce')
-    df2_numeric = df2.apply(pd.to_numeric, errors='coerce')
-
-    # Compare numeric columns with tolerance
-    numeric_diff = ~np.isclose(df1_numeric, df2_numeric, rtol=rtol, atol=atol, equal_nan=True)
-    numeric_diff = pd.DataFrame(numeric_diff, index=df1.index, columns=df1.columns)
-
-    # For non-numeric columns, perform exact comparison
-    non_numeric_cols = df1.select_dtypes(exclude=[np.number]).columns
-    if not non_numeric_cols.empty:
-        non_numeric_diff = (df1[non_numeric_cols].fillna("None") != df2[non_numeric_cols].fillna("None")).astype(bool)
-        non_numeric_diff = pd.DataFrame(non_numeric_diff, index=df1.index, columns=non_numeric_cols)
-        # Combine results, prioritizing non-numeric differences where applicable
-        combined_diff = numeric_diff.combine_first(non_numeric_diff)
-    else:
-        combined_diff = numeric_diff
-
-    return combined_diff
+    with contextlib.ExitStack() as stack:
+        if isinstance(file, str):
+            source = file
+        elif hasattr(file, "temporary_file_path"):
+            source = file.temporary_file_path()
+        else:
+            file.seek(0)
+            source = file.read()
+
+        with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as archive:
+            names = archive.namelist()
+        nodes_member = _find_shp(names, "node")
+        links_member = _find_shp(names, "link")
+
+        if isinstance(source, bytes) and ("/" in nodes_member or "/" in links_member):
+            # GDAL only finds layers at the root of an in-memory zip; small uploads in folders go through a temp file
+            spill = stack.enter_context(tempfile.NamedTemporaryFile(suffix=".zip"))
+            spill.write(source)
+            spill.flush()
+            source = spill.name
+
+        gdf_nodes = _read_zip_member(source, nodes_member, columns, bbox, nodes_where)
+        gdf_links = _read_zip_member(source, links_member, columns, bbox, links_where)
+        return gdf_nodes, gdf_links
 
 class BaseNetworkUploadView(APIView):
     permission_classes = [IsSuperUser]
@@ -418,95 +365,77 @@ class BaseNetworkUploadView(APIView):
             uploaded_file = request.data.get("file")
             if not uploaded_file:
                 return Response({"error": "No file uploaded"}, status=400)
-            
-            # Load node and link shapefiles
-            gdf_nodes, gdf_links = load_nodes_and_links_from_zip(uploaded_file)
-            
-            # Keep only nodes that exist in both sets
-            n_nodes = set(gdf_nodes['n'].values.tolist())
-            gdf_links = gdf_links[gdf_links[['a','b']].isin(list(n_nodes)).sum(axis=1)>1]
-            gdf_nodes = gdf_nodes.drop_duplicates(subset='n')
-
-            # Validate geometries
-            if not all(gdf_nodes.geometry.type == 'Point'):
-                raise ValueError("Nodes shapefile must contain only Point geometries.")
-            if not all(gdf_links.geometry.type == 'LineString'):
-                raise ValueError("Links shapefile must contain only LineString geometries.")
-
-            # Convert geometries
-            gdf_nodes["geometry_json"] = gdf_nodes.geometry.map(mapping)
-            gdf_links["geometry_json"] = gdf_links.geometry.map(mapping)
-
-            # ✅ Passed all checks — proceed to create models
-            base_changeset = Changeset.objects.create(
-                user=request.user,
-                comment=comment if comment.strip()!="" else "Uploaded base network via Shapefiles",
-                pid=pid,
-                editor=editor,
-                is_base_network=True,
-                auth_area="all"
-            )
-            base_changeset.base_network = base_changeset
-            base_changeset.save()
-
-            created_nodes = {}
-            created_links = []
-
-            # Create nodes
-            for _,row in gdf_nodes.iterrows():
-                geometry = GEOSGeometry(json.dumps(row["geometry_json"]))
-                geometry.srid = SRID
-                props = {k: v for k, v in row.items() if k not in ["geometry", "geometry_json"]}
-                node = Node.objects.create()
-                NodeVersion.objects.create(
-                    node=node,
-                    version=1,
-                    geometry=geometry,
-                    attributes=props,
-                    changeset=base_changeset
-                )
-                created_nodes[str(row.n)] = node
-
-            # Create links
-            for _,row in gdf_links.iterrows():
-                geometry = GEOSGeometry(json.dumps(row["geometry_json"]))
-                geometry.srid = SRID
-                props = {k: v for k, v in row.items() if k not in ["geometry", "geometry_json"]}
-                link = Link.objects.create()
-                LinkVersion.objects.create(
-                    link=link,
-                    version=1,
-                    f_node=created_nodes[str(row.a)],
-                    t_node=created_nodes[str(row.b)],
-                    geometry=geometry,
-                    attributes=props,
-                    changeset=base_changeset
-                )
-                created_links.append(link)
 
-            return Response({
-                "status": "success",
-                "changeset_id": str(base_changeset.id),
-                "nodes_created": len(created_nodes),
-                "links_created": len(created_links)
-            }, status=201)
+            result = upload_base_network(uploaded_file, request.user, pid, editor, comment)
+            return Response(result, status=201)
 
         except Exception as e:
             print({"error": str(e)})
             return Response({"error": str(e)}, status=500)
 
+def upload_base_network(uploaded_file, user, pid, editor, comment, progress=no_progress):
+    '''Loads, validates and ingests a base network zip of node and link shapefiles. Returns the response payload.'''
+    # Load node and link shapefiles
+    progress("load")
+    gdf_nodes, gdf_links = load_nodes_and_links_from_zip(uploaded_file)
+    
+    # Keep only nodes that exist in both sets
+    n_nodes = set(gdf_nodes['n'].values.tolist())
+    gdf_links = gdf_links[gdf_links[['a','b']].isin(list(n_nodes)).sum(axis=1)>1]
+    gdf_nodes = gdf_nodes.drop_duplicates(subset='n')
+
+    # Validate geometries
+    progress("validate", message=f"{len(gdf_nodes)} nodes, {len(gdf_links)} links")
+    if not all(gdf_nodes.geometry.type == 'Point'):
+        raise ValueError("Nodes shapefile must contain only Point geometries.")
+    if not all(gdf_links.geometry.type == 'LineString'):
+        raise ValueError("Links shapefile must contain only LineString geometries.")
+
+    # ✅ Passed all checks — bulk load the network in a single transaction
+    with transaction.atomic():
+        base_changeset = Changeset.objects.create(
+            user=user,
+            comment=comment if comment and comment.strip()!="" else "Uploaded base network via Shapefiles",
+            pid=pid,
+            editor=editor,
+            is_base_network=True,
+            auth_area="all"
+        )
+        base_changeset.base_network = base_changeset
+        base_changeset.save()
+
+        ingest_stats = ingest_base_network(base_changeset, gdf_nodes, gdf_links, progress=progress)
+
+        # Pre-render the base network tile pyramid once the rows are visible to the workers
+        transaction.on_commit(lambda: submit_job("base_tiles", user=user, params={"base_changeset_id": base_changeset.id}))
+
+    return {
+        "status": "success",
+        "changeset_id": str(base_changeset.id),
+        "nodes_created": len(gdf_nodes),
+        "links_created": len(gdf_links),
+        "ingest_stats": ingest_stats
+    }
+
+def run_base_upload_job(job, progress):
+    p = job.params
+    result = upload_base_network(job_input_path(job, "file"), job.user, p.get("pid"), p.get("editor"), p.get("comment"), progress)
+    return result, None
+
 class NetChangeUploadView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         try:
-            data = request.data if isinstance(request.data, dict) else json.loads(request.body)
+            # The body (JSON or Arrow, optionally gzipped) is parsed as it is read: the changeset header first,
+            # then the operations one at a time, so memory does not grow with the file.
+            netchange = read_netchange(request)
+            _, cs_data = next(netchange)
+            operations = (op for _, op in netchange)
 
             # Extract changeset metadata
-            cs_data = data.get("changeset", {})
             base_network_id = cs_data.get("base_network")
             depends_on_ids = cs_data.get("depends_on", [])
-            operations = data.get("operations", [])
 
             # Check input data
             if not base_network_id:
@@ -527,242 +456,47 @@ class NetChangeUploadView(APIView):
                 return Response({"error": "Conflicts detected", "conflicts": conflicts}, status=409)
             
             # changeset = Changeset.objects.get(id=15) # debug only
-            # Create the new changeset
-            changeset = Changeset.objects.create(
-                user=request.user,
-                comment=cs_data.get("comment", ""),
-                pid=cs_data.get("pid", ""),
-                editor=cs_data.get("editor", ""),
-                created_at=timezone.now(),
-                base_network=base_network,
-                auth_area="all"
-            )
-            if dependent_changesets: # depends_on is ManyToManyField and should be assigned after changeset is created using "set()".
-                changeset.depends_on.set(dependent_changesets)
-
-            # Apply the operations
-            op_nodes = self._handle_node(operations, changeset)
-            NodeVersion.objects.bulk_create(op_nodes)
-            nodeversion_by_n = pull_node_map(base_network_id, depends_on_ids + [changeset.id], request.user.auth_area)
-            op_links = self._handle_link(operations, changeset, nodeversion_by_n)
-            LinkVersion.objects.bulk_create(op_links)
-
-            return Response({"status": "ok", "changeset_id": changeset.id}, status=201)
-
-        except Exception as e:
-            print({"error": str(e)})
-            return Response({"error": str(e)}, status=500)
-
-    def _handle_node(self, operations, changeset):
-        # Cache nodes and latest versions to avoid repeated DB hits
-        node_cache = {}
-        latest_version_cache = {}
-
-        def get_node_and_latest_version(node_id):
-            if node_id not in node_cache:
-                node = Node.objects.get(id=node_id)
-                latest_version = NodeVersion.objects.filter(node=node).order_by('-version').first()
-                node_cache[node_id] = node
-                latest_version_cache[node_id] = latest_version
-            return node_cache[node_id], latest_version_cache[node_id]
-
-        op_nodes_create = [
-            NodeVersion(
-                node=Node.objects.create(),
-                changeset=changeset,
-                geometry=Point(op['data']['geometry']['coordinates'], srid=SRID),
-                attributes={k.lower(): v for k, v in op['data']['properties'].items()},
-                active=True,
-                version=1
-            )
-            for op in operations if op['type'] == 'node' and op['action'] == 'create'
-        ]
-
-        op_nodes_mod = []
-        op_nodes_del = []
-
-        for op in operations:
-            if op['type'] != 'node':
-                continue
-
-            if op['action'] in ('modify', 'delete'):
-                node, latest_version = get_node_and_latest_version(op['id'])
-                next_version = latest_version.version + 1
-
-                geometry = (
-                    Point(op['data']['geometry']['coordinates'], srid=SRID)
-                    if op['action'] == 'modify' else latest_version.geometry
-                )
-
-                attributes = (
-                    {k.lower(): v for k, v in op['data']['properties'].items()}
-                    if op['action'] == 'modify' else latest_version.attributes
-                )
-
-                active = (op['action'] == 'modify')
-
-                node_version = NodeVersion(
-                    node=node,
-                    changeset=changeset,
-                    geometry=geometry,
-                    attributes=attributes,
-                    active=active,
-                    version=next_version
-                )
-
-                if op['action'] == 'modify':
-                    op_nodes_mod.append(node_version)
-                else:
-                    op_nodes_del.append(node_version)
-
-        return op_nodes_create + op_nodes_mod + op_nodes_del
-
-    def _handle_link(self, operations, changeset, nodeversion_by_n):
-        # Cache links and latest versions to avoid repeated DB hits
-        link_cache = {}
-        latest_version_cache = {}
-
-        def get_link_and_latest_version(link_id):
-            if link_id not in link_cache:
-                link = Link.objects.get(id=link_id)
-                latest_version = LinkVersion.objects.filter(link=link).order_by('-version').first()
-                link_cache[link_id] = link
-                latest_version_cache[link_id] = latest_version
-            return link_cache[link_id], latest_version_cache[link_id]
-
-        def resolve_node(n_key):
-            return nodeversion_by_n[n_key].node
-
-        op_links_create = [
-            LinkVersion(
-                link=Link.objects.create(),#Link.objects.get(id=664501),#Link.objects.create(), # debug only
-                changeset=changeset,
-                geometry=LineString(op['data']['geometry']['coordinates'], srid=SRID),
-                attributes={k.lower(): v for k, v in op['data']['properties'].items()},
-                active=True,
-                version=1,
-                f_node=resolve_node(op['data']['properties']['a']),
-                t_node=resolve_node(op['data']['properties']['b'])
-            )
-            for op in operations if op['type'] == 'link' and op['action'] == 'create'
-        ]
-
-        op_links_mod = []
-        op_links_del = []
-
-        for op in operations:
-            if op['type'] != 'link':
-                continue
-
-            if op['action'] in ('modify', 'delete'):
-                link, latest_version = get_link_and_latest_version(op['id'])
-                next_version = latest_version.version + 1
-
-                geometry = (
-                    LineString(op['data']['geometry']['coordinates'], srid=SRID)
-                    if op['action'] == 'modify' else latest_version.geometry
-                )
-
-                attributes = (
-                    {k.lower(): v for k, v in op['data']['properties'].items()}
-                    if op['action'] == 'modify' else latest_version.attributes
-                )
-
-                f_node = (
-                    resolve_node(op['data']['properties']['a'])
-                    if op['action'] == 'modify' else latest_version.f_node
-                )
-
-                t_node = (
-                    resolve_node(op['data']['properties']['b'])
-                    if op['action'] == 'modify' else latest_version.t_node
-                )
-
-                active = (op['action'] == 'modify')
-
-                link_version = LinkVersion(
-                    link=link,
-                    changeset=changeset,
-                    geometry=geometry,
-                    attributes=attributes,
-                    active=active,
-                    version=next_version,
-                    f_node=f_node,
-                    t_node=t_node
+            with transaction.atomic():
+                # Create the new changeset
+                changeset = Changeset.objects.create(
+                    user=request.user,
+                    comment=cs_data.get("comment", ""),
+                    pid=cs_data.get("pid", ""),
+                    editor=cs_data.get("editor", ""),
+                    created_at=timezone.now(),
+                    base_network=base_network,
+                    auth_area="all"
                 )
+                if dependent_changesets: # depends_on is ManyToManyField and should be assigned after changeset is created using "set()".
+                    changeset.depends_on.set(dependent_changesets)
 
-                if op['action'] == 'modify':
-                    op_links_mod.append(link_version)
-                else:
-                    op_links_del.append(link_version)
-
-        return op_links_create + op_links_mod + op_links_del
+                # Apply the operations in batches. Links resolve A/B against the network including the nodes just written.
+                resolved = get_resolved_network([base_network_id] + depends_on_ids)
+                counts = apply_netchange_stream(changeset, operations, resolved.id)
 
-def pull_node_map(base, projects, auth_area):
-    all_changeset_ids = [base] + projects
+            # Snapshots keep their membership: the new changeset is in none yet, and a dependency gaining a
+            # dependent does not change its versions, so the snapshot built above stays valid for the next requests
 
-    annotated_qs = NodeVersion.objects.filter(
-        changeset_id__in=all_changeset_ids,
-        active=True
-    ).annotate(
-        row_number=Window(
-            expression=RowNumber(),
-            partition_by=[F('node_id')],
-            order_by=F('version').desc()
-        )
-    ).filter(row_number=1)
-
-    nodeversion_by_n = {}
-
-    for nv in annotated_qs:
-        try:
-            n_value = nv.attributes.get("n")
-            if n_value is not None:
-                nodeversion_by_n[n_value] = nv
-        except json.JSONDecodeError:
-            print(f"skip {nv.id}")
-            continue  # skip malformed entries
+            return Response({"status": "ok", "changeset_id": changeset.id, **counts}, status=201)
 
-    return nodeversion_by_n
+        except NetChangeFormatError as e:
+            return Response({"error": str(e)}, status=400)
+        except Exception as e:
+            print({"error": str(e)})
+            return Response({"error": str(e)}, status=500)
 
 # TILES
 
-def get_simplification_tolerance(z):
-    if z < 8:
-        return 500
-    elif z < 10:
-        return 50
-    elif z < 12:
-        return 50
-    return 0  # full detail
-
-def get_detail_level(z):
-    if z >= 12:
-        return {
-            "nodes":"node_id, version, attributes, changeset_id, active",
-            "links":"link_id, version, f_node_id, t_node_id, attributes, changeset_id, active"
-            }
-    elif z >= 10:
-        return {
-            "nodes":"node_id, version, changeset_id, active",
-            "links":"link_id, version, f_node_id, t_node_id, changeset_id, active"
-            }
-    return {
-            "nodes":"node_id, version, changeset_id, active",
-            "links":"link_id, version, f_node_id, t_node_id, changeset_id, active"
-            }
-
-def tile_to_bounds(x, y, z):
-    n = 2 ** z
-    lon1 = x / n * 360.0 - 180.0
-    lat1 = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
-    lon2 = (x + 1) / n * 360.0 - 180.0
-    lat2 = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
-    return lon1, lat2, lon2, lat1  # west, south, east, north
-
 def get_project_changeset_ids(request):
     return [str(i) for i in request.GET.getlist("project_changeset_ids[]") if i]
 
+def unknown_changeset_ids(changeset_ids):
+    '''The values of `changeset_ids` that are not the id of a changeset, including those that are not integers.'''
+    ids = {str(i).strip() for i in changeset_ids}
+    numeric = [int(i) for i in ids if i.isdigit()]
+    found = {str(i) for i in Changeset.objects.filter(id__in=numeric).values_list("id", flat=True)}
+    return sorted(ids - found)
+
 class QueryStringJWTAuthentication(JWTAuthentication):
     def authenticate(self, request):
         token = request.GET.get('token')
@@ -798,9 +532,7 @@ class ValidateTilesView(APIView):
             return JsonResponse({"valid":False, "error": "Invalid base_changeset_id"}, status=200)
         
         # Conflict checking
-        dependent_changesets = list(Changeset.objects.filter(id__in=project_ids))
-
-        conflicts = detect_conflicts(dependent_changesets)
+        conflicts = get_conflicts(project_ids)
         if conflicts:
             return JsonResponse({"valid":False, "error": f"Conflicts detected {conflicts}"}, status=200)
         
@@ -821,101 +553,122 @@ class MVTNetworkTileView(APIView):
             except Exception:
                 return JsonResponse({"error": "Token invalid"}, status=400)
 
-        base_id = request.GET.get("base_changeset_id")
-        project_ids = get_project_changeset_ids(request)
-
-        if not base_id:
-            return JsonResponse({"error": "Missing base_changeset_id"}, status=400)
+        network_tiles, error = get_network_tiles(request.user, request.GET.get("base_changeset_id"), get_project_changeset_ids(request))
+        if error:
+            return error
+
+        return tile_response(request, network_tiles.get(z, x, y))
+
+class TileBatchView(APIView):
+    '''
+    Several tiles of one network in a single request, e.g. a viewport prefetch:
+    {"base_changeset_id", "project_changeset_ids": [...], "tiles": [[z, x, y], ...]}, or the same as form fields
+    with project_changeset_ids and tiles ("z/x/y") repeated.
+    The changesets are validated and checked for conflicts once, the tiles fetched by a small thread pool
+    and returned length-prefixed (utils/tile_batch.py encode_tile_batch()), in no particular order.
+    '''
+    authentication_classes = [QueryStringJWTAuthentication, JWTAuthentication]
+    permission_classes = [IsAuthenticated]
 
+    def post(self, request):
+        if hasattr(request.data, "getlist"):
+            # Form or multipart body: repeated project_changeset_ids (or project_changeset_ids[]) and "z/x/y" tiles fields
+            project_ids = request.data.getlist("project_changeset_ids") or request.data.getlist("project_changeset_ids[]")
+            tiles = request.data.getlist("tiles")
+        else:
+            project_ids = request.data.get("project_changeset_ids") or []
+            if not isinstance(project_ids, list):
+                return JsonResponse({"error": "project_changeset_ids must be a list."}, status=400)
+            tiles = request.data.get("tiles")
+        project_ids = [str(i) for i in project_ids if i]
         try:
-            Changeset.objects.get(id=base_id, is_base_network=True)
-        except Changeset.DoesNotExist:
-            return JsonResponse({"error": "Invalid base_changeset_id"}, status=400)
-        
-        # Conflict checking
-        dependent_changesets = list(Changeset.objects.filter(id__in=project_ids))
+            tiles = parse_tile_list(tiles, settings.TILE_BATCH["MAX_TILES"])
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        network_tiles, error = get_network_tiles(request.user, request.data.get("base_changeset_id"), project_ids)
+        if error:
+            return error
+
+        response = HttpResponse(encode_tile_batch(get_tiles(network_tiles, tiles)), content_type=TILE_BATCH_CONTENT_TYPE)
+        response["X-Tile-Count"] = str(len(tiles))
+        response["Cache-Control"] = f"private, max-age={settings.TILE_CACHE['MAX_AGE']}"
+        return response
+
+def get_network_tiles(user, base_id, project_ids):
+    '''(NetworkTiles, None) for a tile request, or (None, JsonResponse) when the changesets are invalid or conflict.'''
+    if not base_id:
+        return None, JsonResponse({"error": "Missing base_changeset_id"}, status=400)
+
+    try:
+        base = Changeset.objects.get(id=base_id, is_base_network=True)
+    except (Changeset.DoesNotExist, ValueError):
+        return None, JsonResponse({"error": "Invalid base_changeset_id"}, status=400)
+
+    unknown = unknown_changeset_ids(project_ids)
+    if unknown:
+        return None, JsonResponse({"error": "Invalid project_changeset_ids", "invalid": unknown}, status=400)
+
+    # Conflict checking
+    conflicts = get_conflicts(project_ids)
+    if conflicts:
+        return None, JsonResponse({"error": "Conflicts detected", "conflicts": conflicts}, status=409)
+
+    return NetworkTiles(base, project_ids, user.auth_area), None
+
+def tile_response(request, tile_data):
+    etag = tile_etag(tile_data)
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        response = HttpResponseNotModified()
+    elif not tile_data:
+        response = HttpResponse(status=204)
+    else:
+        response = HttpResponse(tile_data, content_type="application/vnd.mapbox-vector-tile")
+    response["ETag"] = etag
+    response["Cache-Control"] = f"private, max-age={settings.TILE_CACHE['MAX_AGE']}"
+    return response
 
-        conflicts = detect_conflicts(dependent_changesets)
-        if conflicts:
-            return JsonResponse({"error": "Conflicts detected", "conflicts": conflicts}, status=409)
-
-        all_changeset_ids = [base_id] + project_ids
-        auth_area = request.user.auth_area
-        detail_level = get_detail_level(int(z))
-
-        # Columns by detail level
-        node_cols = detail_level["nodes"]
-        link_cols = detail_level["links"]
-
-        # Simplification tolerance
-        tolerance = get_simplification_tolerance(int(z))
-        geom_sql = (
-            f"ST_Transform(ST_SimplifyPreserveTopology(geometry, {tolerance}), 3857)"
-            if tolerance > 0 else
-            "ST_Transform(geometry, 3857)"
-        )
+class TileCacheStatsView(APIView):
+    permission_classes = [IsSuperUser]
 
-        sql = f"""
-        WITH tile_bounds AS (
-            SELECT ST_TileEnvelope({z}, {x}, {y}) AS tile_3857
-        ),
-        geom_SRID_bounds AS (
-            SELECT ST_Transform(tile_3857, {SRID}) AS bounds_SRID FROM tile_bounds
-        ),
-        latest_links AS (
-            SELECT DISTINCT ON (link_id) *
-            FROM network_linkversion lv
-            WHERE lv.changeset_id IN %s
-            AND ST_IsValid(lv.geometry)
-            AND ST_SRID(lv.geometry) = {SRID}
-            AND lv.geometry && (SELECT bounds_SRID FROM geom_SRID_bounds)
-            AND (SELECT auth_area FROM network_changeset WHERE id = lv.changeset_id) = %s
-            ORDER BY link_id, version DESC
-        ),
-        latest_nodes AS (
-            SELECT DISTINCT ON (node_id) *
-            FROM network_nodeversion nv
-            WHERE nv.changeset_id IN %s
-            AND ST_IsValid(nv.geometry)
-            AND ST_SRID(nv.geometry) = {SRID}
-            AND nv.geometry && (SELECT bounds_SRID FROM geom_SRID_bounds)
-            AND (SELECT auth_area FROM network_changeset WHERE id = nv.changeset_id) = %s
-            ORDER BY node_id, version DESC
-        ),
-        mvt_links AS (
-            SELECT ST_AsMVTGeom(
-                {geom_sql},
-                (SELECT tile_3857 FROM tile_bounds),
-                4096, 256, true
-            ) AS geom,
-            {link_cols}
-            FROM latest_links
-        ),
-        mvt_nodes AS (
-            SELECT ST_AsMVTGeom(
-                {geom_sql.replace("geometry", "nv.geometry")},
-                (SELECT tile_3857 FROM tile_bounds),
-                4096, 256, true
-            ) AS geom,
-            {node_cols}
-            FROM latest_nodes nv
-        )
-        SELECT (
-            SELECT ST_AsMVT(q1, 'links', 4096, 'geom') FROM mvt_links q1
-        ) || (
-            SELECT ST_AsMVT(q2, 'nodes', 4096, 'geom') FROM mvt_nodes q2
-        ) AS tile;
-        """
+    def get(self, request):
+        return Response({**tile_cache_counters(), **get_tile_cache().stats()})
+
+# METRICS
+
+class MetricsView(APIView):
+    '''
+    Duration histograms of the API views and of the instrumented spans (network/utils/metrics.py), DELETE resets them.
+    "shared" is false when the default cache is per process: the histograms then only cover the process answering.
+    '''
+    permission_classes = [IsSuperUser]
 
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [tuple(all_changeset_ids), auth_area, tuple(all_changeset_ids), auth_area])
-            row = cursor.fetchone()
+    def get(self, request):
+        return Response({"spans": histograms(), "shared": histograms_are_shared(), "profiles": list_profiles()})
+
+    def delete(self, request):
+        reset_histograms()
+        return Response(status=204)
 
-        tile_data = row[0] if row else None
-        if not tile_data:
-            return HttpResponse(status=204)
+class MetricsProfileView(APIView):
+    '''cProfile dump of a ?profile=1 request, as a .prof file or, with ?format=text, the top functions by cumulative time.'''
+    permission_classes = [IsSuperUser]
 
-        return HttpResponse(tile_data, content_type="application/vnd.mapbox-vector-tile")
+    def get(self, request, profile_id):
+        path = profile_path(profile_id)
+        if path is None or not os.path.exists(path):
+            return Response({"error": "Profile not found"}, status=404)
+        if request.GET.get("format") == "text":
+            try:
+                limit = int(request.GET.get("limit", 50))
+            except ValueError:
+                limit = 0
+            if limit < 1:
+                return Response({"error": "limit must be a positive integer."}, status=400)
+            out = io.StringIO()
+            pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+            return HttpResponse(out.getvalue(), content_type="text/plain")
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=f"{profile_id}.prof")
 
 # BUILD NETWORKS
 
@@ -927,56 +680,98 @@ class NetworkExportView(APIView):
         project_ids = request.data.get("project_changeset_ids")
         output_format = request.data.get("output_format")
 
-        print(output_format)
-
-        project_ids = [int(pid) for pid in project_ids]
-
-        nodes_gdf, links_gdf = build_network_from_changesets(base_id, project_ids)
-
-        if output_format == "shp":
-            with tempfile.TemporaryDirectory() as tmpdir:
-                zip_path = os.path.join(tmpdir, "network_shp.zip")
-
-                with zipfile.ZipFile(zip_path, 'w') as zipf:
-                    if not nodes_gdf.empty:
-                        nodes_path = os.path.join(tmpdir, "nodes.shp")
-                        nodes_gdf.to_file(nodes_path)
-                        for ext in [".shp", ".shx", ".dbf", ".prj"]:
-                            zipf.write(nodes_path.replace(".shp", ext), f"nodes{ext}")
-
-                    if not links_gdf.empty:
-                        links_path = os.path.join(tmpdir, "links.shp")
-                        links_gdf.to_file(links_path)
-                        for ext in [".shp", ".shx", ".dbf", ".prj"]:
-                            zipf.write(links_path.replace(".shp", ext), f"links{ext}")
-
-                with open(zip_path, 'rb') as f:
-                    response = HttpResponse(f.read(), content_type='application/zip')
-                    response['Content-Disposition'] = 'attachment; filename=network_shp.zip'
-                    return response
-        elif output_format == "gdb":
-            with tempfile.TemporaryDirectory() as tmpdir:
-                zip_path = os.path.join(tmpdir, "network_gdb.zip")
-                gdb_path = os.path.join(tmpdir, "network.gdb")
-
-                if not nodes_gdf.empty:
-                    nodes_gdf.to_file(gdb_path, layer="nodes", driver="OpenFileGDB")
-
-                if not links_gdf.empty:
-                    links_gdf.to_file(gdb_path, layer="links", driver="OpenFileGDB")
-
-                with zipfile.ZipFile(zip_path, 'w') as zipf:
-                    # Recursively add the .gdb folder contents
-                    for root, dirs, files in os.walk(gdb_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            # Keep relative path to preserve folder structure inside the zip
-                            arcname = os.path.relpath(file_path, start=tmpdir)
-                            zipf.write(file_path, arcname)
-
-                with open(zip_path, 'rb') as f:
-                    response = HttpResponse(f.read(), content_type='application/zip')
-                    response['Content-Disposition'] = 'attachment; filename=network_gdb.zip'
-                    return response
-        else:
-            return Response({"error": f"output_format '{output_format}' not supported. use 'shp' or 'gdb' only."}, status=400)
+        if output_format not in EXPORT_FORMATS:
+            return Response({"error": f"output_format '{output_format}' not supported. use one of: {', '.join(EXPORT_FORMATS)}."}, status=400)
+
+        unknown = unknown_changeset_ids([base_id] + list(project_ids or []))
+        if unknown:
+            return Response({"error": "Invalid changeset ids", "invalid": unknown}, status=400)
+        project_ids = [int(pid) for pid in project_ids or []]
+
+        # Layers are paged from the resolved network into files before answering, so a database or GDAL error
+        # gets an error status; only the zip of the finished files is streamed
+        try:
+            resolved = get_resolved_network([base_id] + project_ids)
+            tmpdir, members = write_network_export(resolved.id, output_format)
+        except Exception as e:
+            traceback.print_exc()
+            return Response({"error": str(e)}, status=500)
+        response = StreamingHttpResponse(stream_export_zip(tmpdir, members), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename=network_{output_format}.zip'
+        return response
+
+# JOBS
+
+class JobSubmitView(APIView):
+    '''Queues the work of BaseNetworkUploadView, ToChangeFileView or NetworkExportView (same fields) as a job.'''
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, kind):
+        if kind not in JOB_HANDLERS:
+            return Response({"error": f"Unknown job kind '{kind}'. Use one of: {', '.join(JOB_HANDLERS)}."}, status=400)
+        if kind in SUPERUSER_JOBS and not request.user.is_superuser:
+            return Response({"error": "Only superusers can submit this job."}, status=403)
+
+        params = {k: request.data.get(k) for k in request.data.keys() if k not in request.FILES and k != "project_changeset_ids[]"}
+        try:
+            if "base_changeset_id" in params:
+                params["base_changeset_id"] = int(params["base_changeset_id"])
+            params["project_changeset_ids"] = parse_changeset_id_list(request.data, "project_changeset_ids")
+        except (TypeError, ValueError) as e:
+            return Response({"error": f"Invalid changeset ids: {e}"}, status=400)
+        job = submit_job(kind, user=request.user, params=params, files=request.FILES)
+        return Response({"job_id": job.id, "status": job.status}, status=202)
+
+def parse_changeset_id_list(data, field):
+    '''
+    Integer ids of a list field of a request body: a JSON list, or for form and multipart bodies the repeated
+    field (or field[]), a single JSON list string or "empty" as ToChangeFileView takes it. Raises ValueError.
+    '''
+    if hasattr(data, "getlist"):
+        values = data.getlist(field) or data.getlist(f"{field}[]")
+        if len(values) == 1 and values[0].strip() in ("", "empty"):
+            values = []
+        elif len(values) == 1 and values[0].strip().startswith("["):
+            values = json.loads(values[0])
+    else:
+        values = data.get(field)
+        if values in (None, "empty"):
+            values = []
+    if not isinstance(values, list):
+        raise ValueError(f"{field} must be a list.")
+    if not all((isinstance(v, int) and not isinstance(v, bool)) or (isinstance(v, str) and v.strip().isdigit()) for v in values):
+        raise ValueError(f"{field} must hold integer ids.")
+    return [int(v) for v in values]
+
+def get_job_for_user(request, job_id):
+    job = get_object_or_404(Job, id=job_id)
+    if not request.user.is_superuser and job.user_id != request.user.id:
+        return None
+    return job
+
+class JobStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_job_for_user(request, job_id)
+        if job is None:
+            return Response({"error": "Job not found"}, status=404)
+        return Response(JobSerializer(job).data)
+
+class JobResultView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_job_for_user(request, job_id)
+        if job is None:
+            return Response({"error": "Job not found"}, status=404)
+        if job.status != Job.SUCCEEDED:
+            return Response({"error": f"Job is {job.status}", "job": JobSerializer(job).data}, status=409)
+
+        path = job_result_path(job)
+        if path is None:
+            return Response(job.result)
+        if not os.path.exists(path):
+            return Response({"error": "Result file no longer exists"}, status=410)
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=job.result_file)
+